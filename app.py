@@ -6,6 +6,7 @@ import tempfile
 import shutil
 import pandas as pd
 from epubtranslator import EpubTranslator
+from job_manager import JobManager
 
 # Set page config
 st.set_page_config(
@@ -19,6 +20,22 @@ os.makedirs("tmp", exist_ok=True)
 os.makedirs("translated_files", exist_ok=True)
 os.makedirs("uploads", exist_ok=True)
 
+@st.cache_resource
+def get_job_manager():
+    """One job manager per server process, shared by all sessions and reruns"""
+    return JobManager()
+
+job_manager = get_job_manager()
+
+def format_duration(seconds):
+    """Format a number of seconds as e.g. '1h 02m', '3m 05s' or '12s'"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
 def save_uploaded_file(uploaded_file, save_dir="uploads"):
     """Save an uploaded file to the specified directory"""
     file_path = os.path.join(save_dir, uploaded_file.name)
@@ -61,8 +78,25 @@ with st.sidebar.expander("API Settings", expanded=True):
 
 # Translation settings
 with st.sidebar.expander("Translation Settings", expanded=True):
-    num_threads = st.slider("Number of Threads", min_value=1, max_value=10, value=5)
+    engine = st.radio("Translation Engine", ["threads", "async"], horizontal=True,
+                      help="'async' sends many requests concurrently from a single thread")
+    if engine == "async":
+        num_threads = 1
+        concurrency = st.number_input("Max Concurrent Requests", min_value=1, max_value=500, value=50)
+    else:
+        num_threads = st.slider("Number of Threads", min_value=1, max_value=10, value=5)
+        concurrency = num_threads
+    batch_tokens = st.number_input("Batch Token Budget (0 = one paragraph per request)", min_value=0, value=0, step=100,
+                                   help="Pack consecutive paragraphs into a single request up to this many tokens")
+    requests_per_minute = st.number_input("Requests per Minute (0 = unlimited)", min_value=0, value=0, step=10)
+    tokens_per_minute = st.number_input("Tokens per Minute (0 = unlimited)", min_value=0, value=0, step=1000)
+    mask_markup = st.checkbox("Mask inline markup", value=True,
+                              help="Send paragraph text with short placeholders instead of full inline HTML to save tokens")
     resume_translation = st.checkbox("Resume from checkpoint if available", value=True)
+    profile_stages = st.checkbox("Profile translation stages", value=False,
+                                 help="Time EPUB read, TOC, parsing, glossary, API wait and writing, and show a breakdown")
+    use_cache = st.checkbox("Use translation memory cache", value=True,
+                            help="Reuse translations of identical segments from previous runs instead of calling the API again")
 
 # Main app area
 st.title("EPUB Translator")
@@ -110,45 +144,66 @@ with tab1:
             input_path = save_uploaded_file(uploaded_file)
             output_path = input_path.replace('.epub', '_cn.epub')
             
-            # Create progress bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            # Initialize translator
-            translator = EpubTranslator(api_key=api_key, api_base=api_base, model_name=model_name)
-            
-            # Set book background if provided
+            # Run the translation in the background so the page stays responsive
+            job = job_manager.submit(
+                uploaded_file.name,
+                input_path,
+                output_path,
+                translator_options=dict(api_key=api_key, api_base=api_base, model_name=model_name, use_cache=use_cache,
+                                        requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                                        mask_markup=mask_markup),
+                translate_options=dict(num_threads=num_threads, user_glossary=user_glossary, resume=resume_translation,
+                                       engine=engine, concurrency=int(concurrency), batch_tokens=int(batch_tokens),
+                                       profile=profile_stages),
+                book_background=book_background or None
+            )
+            st.success(f"Queued translation job #{job.id} for {uploaded_file.name}")
             if book_background:
-                translator.book_background = book_background
                 st.info("Book background information added to translation context")
+    
+    # Background jobs survive reruns and browser refreshes
+    st.subheader("Translation Jobs")
+    jobs = job_manager.list_jobs()
+    if not jobs:
+        st.info("No translation jobs yet")
+    for job in reversed(jobs):
+        with st.container(border=True):
+            st.markdown(f"**#{job['id']} {job['name']}** — {job['status']}")
+            st.progress(job['progress'])
+            details = f"{job['completed']}/{job['total']} segments"
+            if job['status'] == "running" and job['eta'] is not None:
+                details += f", about {format_duration(job['eta'])} remaining"
+            if job['finished_at'] and job['started_at']:
+                details += f", took {format_duration(job['finished_at'] - job['started_at'])}"
+            st.caption(details)
             
-            # Start translation in a way that allows progress updates
-            status_text.text("Translation in progress...")
+            if job['status'] in ("queued", "running"):
+                if st.button("Cancel", key=f"cancel_{job['id']}"):
+                    job_manager.cancel(job['id'])
+                    st.rerun()
+            elif job['status'] == "failed":
+                st.error(f"Translation error: {job['error']}")
             
-            try:
-                output_path, tmp_output_path, translated_file_path = translator.translate_epub(
-                    input_path,
-                    output_path,
-                    num_threads=num_threads,
-                    user_glossary=user_glossary,
-                    resume=resume_translation
-                )
-                
-                # When complete
-                progress_bar.progress(100)
-                status_text.text("Translation completed!")
-                
-                # Download options
-                if os.path.exists(output_path):
-                    with open(output_path, "rb") as f:
-                        st.download_button(
-                            label="Download Translated EPUB",
-                            data=f,
-                            file_name=os.path.basename(output_path),
-                            mime="application/epub+zip"
-                        )
-            except Exception as e:
-                st.error(f"Translation error: {e}")
+            if job['status'] == "completed" and os.path.exists(job['output_path']):
+                with open(job['output_path'], "rb") as f:
+                    st.download_button(
+                        label="Download Translated EPUB",
+                        data=f,
+                        file_name=os.path.basename(job['output_path']),
+                        mime="application/epub+zip",
+                        key=f"download_{job['id']}"
+                    )
+            if job['report']:
+                with st.expander("Run report"):
+                    st.json(job['report'])
+            if job['profile']:
+                with st.expander("Stage timings"):
+                    st.json(job['profile'])
+    
+    if any(job['status'] in ("completed", "failed", "cancelled") for job in jobs):
+        if st.button("Clear finished jobs"):
+            job_manager.clear_finished()
+            st.rerun()
 
 # Extract Terms tab
 with tab2:
@@ -164,13 +219,15 @@ with tab2:
                                      key="term_background")
     
     export_excel = st.checkbox("Export terms to Excel", value=True)
+    min_freq = st.number_input("Minimum occurrences", min_value=1, value=1,
+                               help="Discard candidate terms that appear fewer times than this")
     
     if term_file and st.button("Extract Terms"):
         # Save uploaded file
         input_path = save_uploaded_file(term_file)
         
         # Initialize translator
-        translator = EpubTranslator(api_key=api_key, api_base=api_base, model_name=model_name)
+        translator = EpubTranslator(api_key=api_key, api_base=api_base, model_name=model_name, use_cache=False)
         
         # Set book background if provided
         if term_book_background:
@@ -179,11 +236,17 @@ with tab2:
         
         try:
             with st.spinner("Extracting terms..."):
-                terms, excel_path = translator.extract_terms(input_path, export_excel=export_excel)
+                terms, excel_path, term_stats = translator.extract_terms(input_path, export_excel=export_excel,
+                                                                         min_freq=int(min_freq))
                 
-                # Display extracted terms
+                # Display extracted terms ranked by frequency
                 st.success(f"Extracted {len(terms)} terms")
-                st.json(terms)
+                st.dataframe(pd.DataFrame({
+                    "Term": terms,
+                    "Count": [term_stats[term]["count"] for term in terms],
+                    "First Seen": [term_stats[term]["first_seen"]["doc"] for term in terms],
+                    "Context": [term_stats[term]["first_seen"]["context"] for term in terms]
+                }))
                 
                 # Save terms to JSON
                 base_name = os.path.splitext(os.path.basename(input_path))[0]
@@ -275,7 +338,7 @@ with tab3:
                             mime="application/json"
                         )
                 else:  # Excel format
-                    translator = EpubTranslator()
+                    translator = EpubTranslator(use_cache=False)
                     excel_path = translator.export_glossary_to_excel(glossary_data)
                     
                     if excel_path and os.path.exists(excel_path):
@@ -297,3 +360,8 @@ with tab3:
 # Footer
 st.markdown("---")
 st.markdown("EPUB Translator - Powered by OpenAI API")
+
+# Poll for progress while background jobs are running
+if job_manager.has_active_jobs():
+    time.sleep(2)
+    st.rerun()
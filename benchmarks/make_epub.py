@@ -0,0 +1,85 @@
+"""生成用于基准测试的合成EPUB
+
+段落中带有 <i>、<a>、<span> 等行内标签、专有名词和引用块，结构接近真实小说。
+
+    python benchmarks/make_epub.py out.epub --chapters 20 --paragraphs 50
+"""
+import argparse
+import random
+
+from ebooklib import epub
+
+# 预设的书籍规模：(章节数, 每章段落数)
+SIZES = {
+    'small': (5, 20),
+    'medium': (20, 60),
+    'large': (60, 120),
+}
+
+WORDS = ("the of and to in was he that it his her with as for had you not be on at by which have or from "
+         "this him but all she they were my are me one their so an said them we who would been will no when "
+         "there if more out up into do any your what has man could other than our some very time upon about "
+         "may its only now like little then can should made did us such great before must two these see "
+         "know over much down after first good men own never most old shall day where those came come").split()
+NAMES = ["Gandalf", "Rivendell", "Elrond", "Minas Tirith", "Aragorn", "Lothlorien", "Galadriel", "Mordor"]
+
+
+def sentence(rng, min_words=8, max_words=20):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    words.insert(rng.randrange(len(words)), rng.choice(NAMES))
+    return " ".join(words).capitalize() + "."
+
+
+def paragraph(rng, index):
+    sentences = [sentence(rng) for _ in range(rng.randint(2, 5))]
+    if index % 3 == 0:
+        sentences[0] = f'<i>{sentences[0]}</i>'
+    if index % 5 == 0:
+        sentences[-1] = f'<span class="smallcaps">{sentences[-1]}</span>'
+    if index % 7 == 0:
+        sentences.append(f'<a id="note{index}" href="#fn{index}"><sup>{index}</sup></a>')
+    return f'<p class="text">{" ".join(sentences)}</p>'
+
+
+def make_epub(path, chapters=5, paragraphs=20, seed=0):
+    """生成一本合成EPUB，返回其中的段落总数"""
+    rng = random.Random(seed)
+    book = epub.EpubBook()
+    book.set_identifier(f'benchmark-{chapters}x{paragraphs}-{seed}')
+    book.set_title('Benchmark Book')
+    book.set_language('en')
+    book.add_item(epub.EpubItem(uid='css', file_name='style.css', media_type='text/css',
+                                content=b'p.text { text-indent: 1em; }'))
+
+    items = []
+    for chapter in range(chapters):
+        item = epub.EpubHtml(title=f'Chapter {chapter + 1}', file_name=f'chapter_{chapter + 1:03d}.xhtml', lang='en')
+        body = [f'<h1>Chapter {chapter + 1}</h1>']
+        for index in range(paragraphs):
+            body.append(paragraph(rng, index))
+            if index % 15 == 14:
+                body.append(f'<blockquote class="quote">{sentence(rng)}</blockquote>')
+        item.content = "\n".join(body)
+        book.add_item(item)
+        items.append(item)
+
+    book.toc = [epub.Link(item.file_name, item.title, f'chapter_{index + 1}') for index, item in enumerate(items)]
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ['nav'] + items
+    epub.write_epub(path, book)
+    return chapters * (paragraphs + paragraphs // 15)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成用于基准测试的合成EPUB')
+    parser.add_argument('output', help='输出的 EPUB 文件路径')
+    parser.add_argument('--size', choices=sorted(SIZES), default=None, help='预设规模，指定后忽略章节数和段落数')
+    parser.add_argument('--chapters', type=int, default=5, help='章节数 (默认: 5)')
+    parser.add_argument('--paragraphs', type=int, default=20, help='每章段落数 (默认: 20)')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子 (默认: 0)')
+    args = parser.parse_args()
+
+    chapters, paragraphs = SIZES[args.size] if args.size else (args.chapters, args.paragraphs)
+    segments = make_epub(args.output, chapters, paragraphs, args.seed)
+    print(f"已生成 {args.output}: {chapters} 章，约 {segments} 个片段")
@@ -0,0 +1,220 @@
+"""本地模拟的 OpenAI 兼容聊天补全服务，用于在不调用真实服务的情况下测量吞吐量
+
+"翻译"结果直接回显最后一条用户消息，因此HTML、占位符和批量JSON数组都能原样通过校验。
+回显内容超过请求的 max_tokens 时与真实服务一样截断，并返回 finish_reason "length"。
+可以配置响应延迟的分布，并按比例注入 429 限流、500 错误和超时。
+
+    python benchmarks/mock_server.py --port 8765 --latency 200 --distribution lognormal --rate-429 0.02
+
+GET /stats 返回已处理的请求数，POST /reset 清零计数。
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockState:
+    """服务端配置和请求计数"""
+    def __init__(self, latency_ms=200, jitter_ms=50, distribution="fixed", rate_429=0.0, rate_timeout=0.0,
+                 timeout_delay=35.0, retry_after=1.0, seed=None, rate_500=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.distribution = distribution
+        self.rate_429 = rate_429
+        self.rate_timeout = rate_timeout
+        self.rate_500 = rate_500
+        self.timeout_delay = timeout_delay
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'completions': 0, 'rate_limited': 0, 'timeouts': 0, 'server_errors': 0,
+                       'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def sample_latency(self):
+        """按配置的分布抽取一次响应延迟（秒）"""
+        with self.lock:
+            if self.distribution == "uniform":
+                value = self.random.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+            elif self.distribution == "lognormal":
+                # 均值为 latency_ms、有长尾的对数正态分布，更接近真实服务的延迟
+                sigma = 0.5
+                value = self.random.lognormvariate(0, sigma) * self.latency_ms / math.exp(sigma * sigma / 2)
+            else:
+                value = self.latency_ms
+        return max(0.0, value) / 1000
+
+    def pick_fault(self):
+        """决定本次请求是否注入故障，返回 "429"、"500"、"timeout" 或 None"""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_429:
+            return "429"
+        if roll < self.rate_429 + self.rate_timeout:
+            return "timeout"
+        if roll < self.rate_429 + self.rate_timeout + self.rate_500:
+            return "500"
+        return None
+
+    def count(self, **increments):
+        with self.lock:
+            for key, value in increments.items():
+                self.counts[key] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self.lock:
+            for key in self.counts:
+                self.counts[key] = 0
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_json(200, self.state.snapshot())
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/').endswith('/reset'):
+            self.state.reset()
+            self.send_json(200, {'reset': True})
+            return
+
+        self.state.count(requests=1)
+        fault = self.state.pick_fault()
+        if fault == "429":
+            self.state.count(rate_limited=1)
+            self.send_json(429, {'error': {'message': 'Rate limit reached (mock)', 'type': 'requests',
+                                           'code': 'rate_limit_exceeded'}},
+                           headers={'Retry-After': str(self.state.retry_after)})
+            return
+        if fault == "500":
+            self.state.count(server_errors=1)
+            self.send_json(500, {'error': {'message': 'Internal server error (mock)', 'type': 'server_error'}})
+            return
+        if fault == "timeout":
+            # 超过客户端的超时时间后才返回，模拟服务端卡住
+            self.state.count(timeouts=1)
+            time.sleep(self.state.timeout_delay)
+
+        time.sleep(self.state.sample_latency())
+        messages = payload.get('messages') or [{}]
+        content = messages[-1].get('content', '')
+        finish_reason = 'stop'
+        max_tokens = payload.get('max_tokens')
+        if max_tokens and estimate_tokens(content) > max_tokens:
+            content = content[:max_tokens * 4]
+            finish_reason = 'length'
+        prompt_tokens = sum(estimate_tokens(message.get('content', '')) for message in messages)
+        completion_tokens = estimate_tokens(content)
+        self.state.count(completions=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                 'total_tokens': prompt_tokens + completion_tokens}
+        model = payload.get('model', 'mock')
+
+        if payload.get('stream'):
+            self.send_stream(content, model, usage, finish_reason)
+            return
+        self.send_json(200, {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': finish_reason}],
+            'usage': usage,
+        })
+
+    def send_stream(self, content, model, usage, finish_reason='stop'):
+        """以 server-sent events 的形式逐段返回内容"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None, **extra):
+            chunk = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}], **extra}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        event({'role': 'assistant', 'content': ''})
+        for start in range(0, len(content), 16):
+            event({'content': content[start:start + 16]})
+        # 与 stream_options.include_usage 一致，在最后一个分片中附带用量
+        event({}, finish_reason=finish_reason, usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(port=8765, host="127.0.0.1", **options):
+    """在后台线程中启动模拟服务，返回 (server, state)"""
+    state = MockState(**options)
+    handler = type('BoundMockHandler', (MockHandler,), {'state': state})
+    # 默认的监听队列只有5个，高并发时新连接会被重置
+    server_class = type('MockHTTPServer', (ThreadingHTTPServer,), {'request_queue_size': 256})
+    server = server_class((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MockServer", daemon=True).start()
+    return server, state
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--latency', type=float, default=200, help='平均响应延迟，毫秒 (默认: 200)')
+    parser.add_argument('--jitter', type=float, default=50, help='uniform 分布的抖动范围，毫秒 (默认: 50)')
+    parser.add_argument('--distribution', choices=['fixed', 'uniform', 'lognormal'], default='fixed',
+                        help='延迟分布 (默认: fixed)')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='返回 429 的请求比例 (默认: 0)')
+    parser.add_argument('--rate-500', type=float, default=0.0, help='返回 500 的请求比例 (默认: 0)')
+    parser.add_argument('--rate-timeout', type=float, default=0.0, help='模拟超时的请求比例 (默认: 0)')
+    parser.add_argument('--timeout-delay', type=float, default=35.0, help='模拟超时时的响应延迟，秒 (默认: 35)')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='429 响应中的 Retry-After 秒数 (默认: 1)')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子，便于复现')
+
+
+def server_options(args):
+    return dict(latency_ms=args.latency, jitter_ms=args.jitter, distribution=args.distribution,
+                rate_429=args.rate_429, rate_timeout=args.rate_timeout, timeout_delay=args.timeout_delay,
+                retry_after=args.retry_after, seed=args.seed, rate_500=args.rate_500)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟的 OpenAI 兼容聊天补全服务')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口 (默认: 8765)')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server, _state = start_server(args.port, args.host, **server_options(args))
+    print(f"模拟服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,187 @@
+"""在本地模拟服务上测量 translate_epub 的吞吐量
+
+对每个 (书籍规模, 引擎, 线程数/并发数) 组合在独立的子进程中完整翻译一次合成EPUB，
+报告耗时、每秒片段数、峰值内存(RSS)和API调用次数。翻译记忆和断点续传都被关闭，
+每次运行互不影响。
+
+    python benchmarks/run_benchmarks.py --sizes small,medium --engines threads,async --threads 1,5,10 --concurrency 50
+
+--parsers html.parser,lxml-xml 比较章节解析器，--profile 在报告中附带各阶段耗时（parse、serialize 等）。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from make_epub import SIZES, make_epub
+from mock_server import add_server_arguments, server_options, start_server
+
+
+def run_child(config):
+    """子进程入口：翻译一本书并把运行报告写到 config['report']"""
+    sys.path.insert(0, ROOT_DIR)
+    os.chdir(config['workdir'])
+    from epubtranslator import EpubTranslator
+
+    # 生成的词汇表、日志和结果副本都放在基准测试的工作目录中
+    EpubTranslator.TMP_DIR = config['workdir']
+    EpubTranslator.TRANSLATED_FILES_DIR = config['workdir']
+    translator = EpubTranslator(api_key="benchmark", api_base=config['api_base'], model_name="mock",
+                                common_words_path=os.path.join(ROOT_DIR, 'commonwords', 'google-10000-english.txt'),
+                                use_cache=False, mask_markup=config['mask'], html_parser=config['parser'])
+    translator.translate_epub(config['input'], config['output'], num_threads=config['threads'], resume=False,
+                              engine=config['engine'], concurrency=config['concurrency'],
+                              batch_tokens=config['batch_tokens'], report_path=config['report'],
+                              profile=config['profile'])
+
+
+def fetch_stats(api_base):
+    with urllib.request.urlopen(api_base.rstrip('/') + "/stats") as response:
+        return json.loads(response.read())
+
+
+def run_case(config, api_base):
+    """在子进程中运行一个组合，返回测量结果"""
+    before = fetch_stats(api_base)
+    log_path = os.path.join(config['workdir'], f"{config['name']}.log")
+    started = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', json.dumps(config)],
+                                   stdout=log, stderr=subprocess.STDOUT)
+        # wait4 只返回这个子进程自身的资源占用，RUSAGE_CHILDREN 则会累计所有子进程的最大值
+        _pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.perf_counter() - started
+    after = fetch_stats(api_base)
+
+    report = {}
+    if os.path.exists(config['report']):
+        with open(config['report'], 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    # Linux 上 ru_maxrss 以KB为单位，macOS 上以字节为单位
+    peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    segments = report.get('segments', 0)
+    return {
+        'name': config['name'],
+        'size': config['size'],
+        'engine': config['engine'],
+        'workers': config['concurrency'] if config['engine'] == 'async' else config['threads'],
+        'batch_tokens': config['batch_tokens'],
+        'parser': config['parser'],
+        'exit_code': process.returncode,
+        'wall_seconds': round(wall_time, 3),
+        'segments': segments,
+        'segments_per_second': round(segments / wall_time, 2) if wall_time > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'api_calls': after['requests'] - before['requests'],
+        'rate_limited': after['rate_limited'] - before['rate_limited'],
+        'latency_p95': report.get('latency_seconds', {}).get('p95'),
+        'parse_seconds': stage_seconds(config, 'parse'),
+        'serialize_seconds': stage_seconds(config, 'serialize'),
+        'log': log_path,
+    }
+
+
+def stage_seconds(config, stage):
+    """启用 --profile 时从耗时汇总中读取一个阶段的总耗时"""
+    path = os.path.join(config['workdir'], f"{config['size']}_profile.json")
+    if not config['profile'] or not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        stages = json.load(f).get('stages', {})
+    return stages.get(stage, {}).get('total_seconds')
+
+
+def display_width(text):
+    """终端中的显示宽度，中文字符占两列"""
+    return sum(2 if ord(char) >= 0x2e80 else 1 for char in text)
+
+
+def print_table(results):
+    columns = [('size', '规模'), ('engine', '引擎'), ('workers', '线程/并发'), ('batch_tokens', '批量预算'), ('parser', '解析器'),
+               ('wall_seconds', '耗时(s)'), ('segments', '片段'), ('segments_per_second', '片段/s'),
+               ('peak_rss_mb', '峰值RSS(MB)'), ('api_calls', 'API调用'), ('rate_limited', '429'),
+               ('parse_seconds', '解析(s)'), ('serialize_seconds', '序列化(s)'), ('exit_code', '退出码')]
+    rows = [[title for _key, title in columns]] + [[str(result[key]) for key, _title in columns] for result in results]
+    widths = [max(display_width(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        print("  ".join(value + " " * (width - display_width(value)) for value, width in zip(row, widths)))
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在本地模拟服务上测量 translate_epub 的吞吐量')
+    parser.add_argument('--sizes', default='small,medium', help=f"书籍规模，逗号分隔，可选 {','.join(SIZES)} (默认: small,medium)")
+    parser.add_argument('--engines', default='threads,async', help='翻译引擎，逗号分隔 (默认: threads,async)')
+    parser.add_argument('--threads', default='1,5,10', help='threads 引擎的线程数，逗号分隔 (默认: 1,5,10)')
+    parser.add_argument('--concurrency', default='50', help='async 引擎的并发数，逗号分隔 (默认: 50)')
+    parser.add_argument('--batch-tokens', default='0', help='批量token预算，逗号分隔 (默认: 0)')
+    parser.add_argument('--no-mask', action='store_true', help='发送完整HTML，不使用行内标签占位符')
+    parser.add_argument('--parsers', default='lxml-xml', help='章节解析器，逗号分隔，可选 lxml-xml,html.parser (默认: lxml-xml)')
+    parser.add_argument('--profile', action='store_true', help='统计各阶段耗时，结果中附带解析和序列化的总耗时')
+    parser.add_argument('--port', type=int, default=8765, help='模拟服务端口 (默认: 8765)')
+    parser.add_argument('--workdir', help='保存合成书籍、日志和报告的目录 (默认: 新建临时目录)')
+    parser.add_argument('--json', dest='json_path', help='把结果另存为JSON文件')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="epub-benchmark-"))
+    os.makedirs(workdir, exist_ok=True)
+    server, _state = start_server(args.port, **server_options(args))
+    api_base = f"http://127.0.0.1:{args.port}/v1"
+    print(f"模拟服务: {api_base}，工作目录: {workdir}")
+
+    results = []
+    try:
+        for size in parse_list(args.sizes):
+            chapters, paragraphs = SIZES[size]
+            book = os.path.join(workdir, f"{size}.epub")
+            if not os.path.exists(book):
+                make_epub(book, chapters, paragraphs)
+            for engine in parse_list(args.engines):
+                workers = parse_list(args.concurrency if engine == 'async' else args.threads, int)
+                for count in workers:
+                    for batch_tokens in parse_list(args.batch_tokens, int):
+                        for html_parser in parse_list(args.parsers):
+                            name = f"{size}-{engine}-{count}-b{batch_tokens}-{html_parser}"
+                            config = {
+                                'name': name, 'size': size, 'engine': engine, 'workdir': workdir, 'api_base': api_base,
+                                'input': book, 'output': os.path.join(workdir, f"{name}_cn.epub"),
+                                'report': os.path.join(workdir, f"{name}_report.json"),
+                                'threads': count, 'concurrency': count, 'batch_tokens': batch_tokens,
+                                'mask': not args.no_mask, 'parser': html_parser, 'profile': args.profile,
+                            }
+                            print(f"运行 {name} ...")
+                            result = run_case(config, api_base)
+                            print(f"  {result['wall_seconds']}s，{result['segments_per_second']} 片段/s，"
+                                  f"峰值RSS {result['peak_rss_mb']}MB，API调用 {result['api_calls']} 次")
+                            results.append(result)
+    finally:
+        server.shutdown()
+
+    print()
+    print_table(results)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'server': server_options(args), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
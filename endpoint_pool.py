@@ -0,0 +1,205 @@
+"""多个API端点（不同的密钥、地址、模型和限流额度）组成的端点池
+
+请求按加权最少未完成请求数分配到端点；连续出错或延迟明显高于其他端点的端点被暂时剔除，
+剔除期间的请求自动转到其他端点，到期后重新参与分配。所有端点都被剔除时仍选择最早恢复的端点，
+请求不会因此卡住。
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+from rate_limiter import RateLimiter
+
+# 判断端点延迟时使用的最近请求数
+LATENCY_WINDOW = 50
+
+
+class Endpoint:
+    """一个API端点：连接参数、独立的限流器和健康状态"""
+    def __init__(self, name, api_key=None, base_url=None, model=None, weight=1.0, requests_per_minute=None,
+                 tokens_per_minute=None):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.weight = float(weight or 1.0)
+        # 端点自身的额度；未配置时只受翻译器共享的限流器限制
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # 同步客户端和异步引擎运行期间的异步客户端，由翻译器创建
+        self.client = None
+        self.async_client = None
+        self.outstanding = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # 最近成功请求的延迟，取中位数判断端点是否明显变慢，个别长请求不会造成误判
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def latency(self):
+        """最近请求延迟的中位数，没有样本时为 None"""
+        if not self.latencies:
+            return None
+        return sorted(self.latencies)[len(self.latencies) // 2]
+
+    def ejected(self, now=None):
+        return (now or time.monotonic()) < self.ejected_until
+
+    def describe(self):
+        return f"{self.name}（{self.base_url or '默认地址'}，模型 {self.model}，权重 {self.weight:g}）"
+
+
+class EndpointPool:
+    """按健康状态和负载分配请求的端点池
+
+    eject_failures: 连续失败多少次后剔除端点
+    eject_seconds: 第一次剔除的时长，同一端点再次被剔除时加倍，不超过 max_eject_seconds
+    latency_factor / latency_margin / min_samples: 端点延迟的中位数既超过其他健康端点中最低值的 latency_factor 倍、
+        又比它多出 latency_margin 秒时剔除，样本数不足时不判断
+    """
+    def __init__(self, endpoints, eject_failures=3, eject_seconds=30.0, max_eject_seconds=300.0, latency_factor=3.0,
+                 latency_margin=1.0, min_samples=10):
+        if not endpoints:
+            raise ValueError("端点池中至少需要一个端点")
+        self.endpoints = list(endpoints)
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.latency_factor = latency_factor
+        self.latency_margin = latency_margin
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def __iter__(self):
+        return iter(self.endpoints)
+
+    @property
+    def primary(self):
+        return self.endpoints[0]
+
+    def acquire(self, exclude=None):
+        """选择加权未完成请求数最少的健康端点并登记一个未完成请求
+
+        exclude: 尽量避开的端点（例如重试避开刚出错的端点、对冲请求避开原请求的端点），
+            没有其他健康端点时仍可能选中
+        """
+        with self.lock:
+            now = time.monotonic()
+            healthy = [endpoint for endpoint in self.endpoints if not endpoint.ejected(now)]
+            candidates = [endpoint for endpoint in healthy if endpoint is not exclude] or healthy
+            if candidates:
+                endpoint = min(candidates, key=lambda endpoint: ((endpoint.outstanding + 1) / endpoint.weight,
+                                                                   endpoint.latency or 0.0))
+            else:
+                endpoint = min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def has_alternative(self, endpoint):
+        """除 endpoint 外是否还有未被剔除的端点，有时失败的请求可以立即转到其他端点"""
+        now = time.monotonic()
+        with self.lock:
+            return any(other is not endpoint and not other.ejected(now) for other in self.endpoints)
+
+    def release(self, endpoint, latency=None, failed=False):
+        """请求结束：成功时记录延迟，失败时累计连续失败次数，返回端点是否因此被剔除
+
+        既没有失败也没有延迟（例如落选后被取消的对冲请求）时只结束登记，不算作一次成功
+        """
+        with self.lock:
+            endpoint.outstanding -= 1
+            if failed and endpoint.ejected():
+                return False
+            if failed:
+                endpoint.failures += 1
+                if endpoint.failures >= self.eject_failures:
+                    return self._eject(endpoint, f"连续失败 {endpoint.failures} 次")
+                return False
+            if latency is None:
+                return False
+            endpoint.failures = 0
+            # 剔除前已经发出的请求陆续返回，不再计入延迟，避免同一端点被重复剔除
+            if endpoint.ejected():
+                return False
+            endpoint.latencies.append(latency)
+            return self._check_latency(endpoint)
+
+    def eject(self, endpoint, reason, seconds=None):
+        with self.lock:
+            return self._eject(endpoint, reason, seconds)
+
+    def _check_latency(self, endpoint):
+        if len(endpoint.latencies) < self.min_samples:
+            return False
+        now = time.monotonic()
+        others = [other.latency for other in self.endpoints
+                  if other is not endpoint and not other.ejected(now) and len(other.latencies) >= self.min_samples]
+        latency = endpoint.latency
+        if others and latency > max(self.latency_factor * min(others), min(others) + self.latency_margin):
+            return self._eject(endpoint, f"延迟中位数 {latency:.1f} 秒，明显高于其他端点")
+        if endpoint.ejections and not endpoint.ejected(now):
+            # 恢复后表现正常，下次剔除重新从最短时长开始
+            endpoint.ejections = 0
+        return False
+
+    def _eject(self, endpoint, reason, seconds=None):
+        if seconds is None:
+            seconds = min(self.max_eject_seconds, self.eject_seconds * 2 ** endpoint.ejections)
+        endpoint.ejected_until = time.monotonic() + seconds
+        endpoint.ejections += 1
+        endpoint.failures = 0
+        # 恢复后重新采集延迟样本
+        endpoint.latencies.clear()
+        print(f"端点 {endpoint.name} {reason}，暂停使用 {seconds:.0f} 秒")
+        return True
+
+
+def load_endpoints(path):
+    """从JSON文件读取端点配置列表
+
+    每一项可包含 name、api_key、base_url、model、weight、requests_per_minute、tokens_per_minute；
+    api_key_env 可以代替 api_key，从指定的环境变量读取密钥。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        configs = json.load(f)
+    if isinstance(configs, dict):
+        configs = configs.get('endpoints', [])
+    for config in configs:
+        if 'api_key_env' in config:
+            config['api_key'] = os.getenv(config.pop('api_key_env'))
+    return configs
+
+
+def endpoints_from_env(api_key=None, base_url=None, model=None):
+    """从环境变量读取端点配置：不带编号的 API_KEY / BASE_URL / MODEL_NAME 是第一个端点，
+    API_KEY_2、BASE_URL_2、MODEL_NAME_2、RATE_LIMIT_RPM_2、RATE_LIMIT_TPM_2、ENDPOINT_WEIGHT_2 等依次是其余端点，
+    编号端点没有设置的地址和模型沿用第一个端点的值
+    """
+    configs = [{'name': "default", 'api_key': api_key, 'base_url': base_url, 'model': model,
+                'weight': os.getenv('ENDPOINT_WEIGHT')}]
+    index = 2
+    while os.getenv(f'API_KEY_{index}') or os.getenv(f'BASE_URL_{index}'):
+        configs.append({
+            'name': f"endpoint{index}",
+            'api_key': os.getenv(f'API_KEY_{index}') or api_key,
+            'base_url': os.getenv(f'BASE_URL_{index}') or base_url,
+            'model': os.getenv(f'MODEL_NAME_{index}') or model,
+            'weight': os.getenv(f'ENDPOINT_WEIGHT_{index}'),
+            'requests_per_minute': float(os.getenv(f'RATE_LIMIT_RPM_{index}') or 0),
+            'tokens_per_minute': float(os.getenv(f'RATE_LIMIT_TPM_{index}') or 0),
+        })
+        index += 1
+    return configs
+
+
+def create_endpoints(configs, default_model=None):
+    """按配置列表创建端点，未命名的端点按顺序编号"""
+    return [Endpoint(config.get('name') or f"endpoint{index}", config.get('api_key'), config.get('base_url'),
+                     config.get('model') or default_model, config.get('weight') or 1.0,
+                     config.get('requests_per_minute'), config.get('tokens_per_minute'))
+            for index, config in enumerate(configs, 1)]
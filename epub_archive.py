@@ -0,0 +1,185 @@
+import posixpath
+import struct
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
+
+CONTAINER_PATH = "META-INF/container.xml"
+CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+OPF_NS = "{http://www.idpf.org/2007/opf}"
+
+# 需要翻译的文档类型
+DOCUMENT_MEDIA_TYPES = ("application/xhtml+xml", "text/html")
+NCX_MEDIA_TYPE = "application/x-dtbncx+xml"
+MIMETYPE_NAME = "mimetype"
+
+# 本地文件头的固定部分长度，之后是文件名和扩展字段
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+# 原样复制压缩数据时每次读写的字节数
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def copy_raw_entry(source_path, info, target, name=None):
+    """把源压缩包中的条目以原始压缩数据复制到正在写入的 ZipFile，不解压也不重新压缩
+
+    压缩数据按块从源文件直接拷贝到目标文件，不会整体读入内存。zipfile 没有公开的原样复制接口，
+    这里按 ZipFile.writestr 的方式维护它的 fp、start_dir、filelist 和 NameToInfo。
+    加密的条目无法原样复制，返回 False，由调用方改用普通方式复制。
+    """
+    if info.flag_bits & 0x1:
+        return False
+    zinfo = zipfile.ZipInfo(name or info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.create_system = info.create_system
+    zinfo.external_attr = info.external_attr
+    # 只保留压缩级别标志；大小写在本地文件头中，不再需要数据描述符
+    zinfo.flag_bits = info.flag_bits & 0x6
+
+    with open(source_path, 'rb') as source:
+        source.seek(info.header_offset)
+        header = source.read(LOCAL_HEADER_SIZE)
+        if len(header) < LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"条目 {info.filename} 的本地文件头损坏")
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        source.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+
+        target.fp.seek(target.start_dir)
+        zinfo.header_offset = target.fp.tell()
+        target.fp.write(zinfo.FileHeader())
+        remaining = info.compress_size
+        while remaining:
+            chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"条目 {info.filename} 的数据不完整")
+            target.fp.write(chunk)
+            remaining -= len(chunk)
+        target.start_dir = target.fp.tell()
+    target.filelist.append(zinfo)
+    target.NameToInfo[zinfo.filename] = zinfo
+    target._didModify = True
+    return True
+
+
+class ManifestItem:
+    """OPF清单中的一项"""
+    def __init__(self, item_id, href, media_type, zip_name, properties=""):
+        self.id = item_id
+        self.href = href
+        self.media_type = media_type
+        self.zip_name = zip_name
+        self.properties = properties
+
+    @property
+    def is_document(self):
+        return self.media_type in DOCUMENT_MEDIA_TYPES
+
+    @property
+    def is_nav(self):
+        return "nav" in self.properties.split()
+
+
+class EpubArchive:
+    """直接读取EPUB压缩包的轻量封装
+
+    只解析 container.xml 和 OPF 清单，条目内容按需逐个读取，
+    不像 epub.read_epub 那样把整本书加载到内存中。
+    """
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        container = ET.fromstring(self.zip.read(CONTAINER_PATH))
+        rootfile = container.find(f"{CONTAINER_NS}rootfiles/{CONTAINER_NS}rootfile")
+        self.opf_path = rootfile.get("full-path")
+        self.opf_dir = posixpath.dirname(self.opf_path)
+
+        opf = ET.fromstring(self.zip.read(self.opf_path))
+        self.manifest = []
+        for element in opf.iter(f"{OPF_NS}item"):
+            href = element.get("href", "")
+            self.manifest.append(ManifestItem(
+                element.get("id"), href, element.get("media-type", ""),
+                self.resolve(href), element.get("properties", "")
+            ))
+        self.spine = [element.get("idref") for element in opf.iter(f"{OPF_NS}itemref")]
+
+    def resolve(self, href):
+        """把OPF中的相对href转换为压缩包内的条目名"""
+        return posixpath.normpath(posixpath.join(self.opf_dir, unquote(href.split("#")[0])))
+
+    def documents(self):
+        """按阅读顺序返回所有文档，不在书脊中的文档排在最后"""
+        documents = {item.id: item for item in self.manifest if item.is_document}
+        ordered = [documents.pop(idref) for idref in self.spine if idref in documents]
+        return ordered + list(documents.values())
+
+    def read(self, name):
+        return self.zip.read(name)
+
+    def entries(self):
+        """压缩包中的所有条目（ZipInfo），按存储顺序"""
+        return self.zip.infolist()
+
+    def find(self, media_type=None, nav=False):
+        """返回第一个符合条件的清单项，没有时返回 None"""
+        for item in self.manifest:
+            if (media_type is None or item.media_type == media_type) and (not nav or item.is_nav):
+                return item
+        return None
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class EpubWriter:
+    """逐个条目写出EPUB压缩包
+
+    条目写出后不再保留在内存中，多个线程可以同时写入。
+    mimetype 按规范作为第一个不压缩的条目写出。
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.names = set()
+        self.zip = zipfile.ZipFile(path, 'w')
+        self.zip.writestr(zipfile.ZipInfo(MIMETYPE_NAME), b"application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self.names.add(MIMETYPE_NAME)
+
+    def write(self, name, data, compress_type=zipfile.ZIP_DEFLATED):
+        """写出一个条目，同名条目只写出第一次"""
+        with self.lock:
+            if name in self.names:
+                return False
+            self.names.add(name)
+            self.zip.writestr(name, data, compress_type=compress_type)
+            return True
+
+    def copy(self, archive, info):
+        """把源压缩包中的条目原样复制到输出，不解压也不重新压缩"""
+        with self.lock:
+            if info.filename in self.names:
+                return False
+            self.names.add(info.filename)
+            if not copy_raw_entry(archive.path, info, self.zip):
+                self.zip.writestr(info, archive.read(info.filename))
+            return True
+
+    def close(self):
+        with self.lock:
+            self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
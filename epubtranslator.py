@@ -1,21 +1,49 @@
 import sys
-import openai
+import httpx
+from openai import OpenAI, AsyncOpenAI
 import ebooklib
 from ebooklib import epub
 from bs4 import BeautifulSoup,NavigableString
+from bs4.dammit import EntitySubstitution
+from bs4.formatter import HTMLFormatter
 import threading
-from queue import Queue
 import traceback
 import time
-from collections import deque
+from collections import deque, Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 import re
 import os
 from dotenv import load_dotenv
 import json
-import pickle
 import argparse
 import tempfile
 import shutil
+import hashlib
+import asyncio
+import contextlib
+import importlib.util
+import posixpath
+import zipfile
+import html
+import html.entities
+from urllib.parse import unquote
+from xml.sax.saxutils import escape as xml_escape
+
+from epub_archive import DOCUMENT_MEDIA_TYPES, NCX_MEDIA_TYPE, EpubArchive, EpubWriter, copy_raw_entry
+from glossary_matcher import GlossaryMatcher
+from hedging import HedgePolicy, HedgeTimer
+from job_store import JobStore, default_worker_id
+from endpoint_pool import EndpointPool, create_endpoints, endpoints_from_env, load_endpoints
+from markup_mask import MaskedSegment
+from rate_limiter import RateLimiter, estimate_tokens
+from retry_policy import FATAL, RATE_LIMITED, RETRYABLE, RetryPolicy, classify_error, endpoint_error
+from run_metrics import RunMetrics, current_chapter
+from segment_classifier import CHINESE_RATIO, GLOSSARY_ONLY, SKIP, TRANSLATE, chinese_ratio, has_latin, skip_reason
+from segment_journal import SegmentJournal, segment_hash
+from segment_pool import SegmentPool
+from segment_splitter import estimate_output_tokens, output_too_short, split_text
+from stage_profiler import StageProfiler
+from translation_memory import TranslationMemory
 
 # 加载环境变量
 load_dotenv()
@@ -27,24 +55,442 @@ except ImportError:
     print("警告: pandas库未安装，无法导出Excel文件")
     pd = None
 
+# 可选的C实现HTML/XML解析器，用于加速纯文本提取和章节解析
+try:
+    import lxml.html as lxml_html
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_html = None
+    lxml_etree = None
+
+# 默认的章节解析器：安装了 lxml 时用C实现的 XML 解析器（"lxml-xml"）解析 XHTML 章节，
+# 不是格式良好的 XHTML 的章节（见 well_formed_xhtml）仍然用 html.parser
+DEFAULT_HTML_PARSER = "lxml-xml" if lxml_etree is not None else "html.parser"
+HTML_PARSERS = ("lxml-xml", "html.parser")
+# XML 只预定义了这五个命名实体，其余HTML命名实体（&nbsp;、&mdash; 等）需要换成数字字符引用
+XML_PREDEFINED_ENTITIES = {b'amp', b'lt', b'gt', b'quot', b'apos'}
+NAMED_ENTITY_PATTERN = re.compile(rb'&([A-Za-z][A-Za-z0-9]*);')
+
+# HTTP/2 需要安装可选的 h2 包（pip install httpx[http2]）
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 单次请求的默认输出token上限，以及放大上限时不超过的常见模型输出上限
+DEFAULT_MAX_OUTPUT_TOKENS = 1024
+MAX_COMPLETION_TOKENS = 4096
+
+# 匹配可能的专有名词（首字母大写的词组，允许1-3个词）
+TERM_PATTERN = re.compile(r'\b([A-Z][a-z]+(?:\s+[A-Z][a-z]+){0,2})\b')
+
+# 术语扫描子进程使用的常用词表，由 init_term_worker 设置
+_term_common_words = set()
+
+def is_valid_term(term, common_words):
+    """判断一个词组是否可能是一个有效的专有名词"""
+    # 如果是空或只有一个字符，不是有效术语
+    if not term or len(term) <= 1:
+        return False
+        
+    # 分割成单词
+    words = term.split()
+    
+    # 如果只有一个单词
+    if len(words) == 1:
+        # 如果是常见单词（不区分大小写），排除
+        if words[0].lower() in common_words:
+            return False
+        
+        # 如果只有一个单词且长度小于4，可能不够特殊，除非它可能是缩写（全大写）
+        if len(words[0]) < 4 and not words[0].isupper():
+            return False
+    
+    # 检查多词组合是否全是常用词
+    all_common = all(word.lower() in common_words for word in words)
+    if all_common:
+        return False
+    
+    # 可能是有意义的专有名词
+    return True
+
+def well_formed_xhtml(content):
+    """为 lxml-xml 准备章节内容，返回可以交给 XML 解析器的字节串；不适合用 XML 解析器时返回 None
+
+    XML 解析器会删除未定义的实体，遇到标签不配对等错误时还会在容错模式下丢弃内容，
+    因此先把HTML命名实体换成数字字符引用，再严格解析一遍（不加载DTD、不展开外部实体），
+    有语法错误、未知实体或带有内部 DTD 子集的文档都退回 html.parser。
+    """
+    if lxml_etree is None or not isinstance(content, bytes):
+        return None
+
+    def numeric_reference(match):
+        name = match.group(1)
+        text = None if name in XML_PREDEFINED_ENTITIES else html.entities.html5.get(name.decode('ascii') + ';')
+        if text is None:
+            return match.group(0)
+        return "".join(f"&#{ord(char)};" for char in text).encode('ascii')
+
+    content = NAMED_ENTITY_PATTERN.sub(numeric_reference, content)
+    try:
+        root = lxml_etree.fromstring(content, lxml_etree.XMLParser(resolve_entities=False, no_network=True))
+    except (lxml_etree.XMLSyntaxError, ValueError):
+        return None
+    dtd = root.getroottree().docinfo.internalDTD
+    if dtd is not None and (any(True for _ in dtd.iterentities()) or any(True for _ in dtd.iterelements())):
+        return None
+    return content
+
+def html_to_text(content):
+    """提取HTML文档的纯文本，优先使用C实现的lxml解析器"""
+    if lxml_html is not None:
+        try:
+            return lxml_html.document_fromstring(content).text_content()
+        except Exception:
+            pass
+    return BeautifulSoup(content, 'html.parser').get_text()
+
+def init_term_worker(common_words):
+    """术语扫描子进程的初始化函数，每个进程只接收一次常用词表"""
+    global _term_common_words
+    _term_common_words = common_words
+
+def scan_document_terms(name, content, common_words=None):
+    """统计一个文档中可能的专有名词，返回 (文档名, 出现次数, {术语: (首次出现位置, 上下文)})"""
+    if common_words is None:
+        common_words = _term_common_words
+    text = html_to_text(content)
+    counts = Counter()
+    first_seen = {}
+    validity = {}
+    for match in TERM_PATTERN.finditer(text):
+        term = match.group(1)
+        valid = validity.get(term)
+        if valid is None:
+            # 同一文档中重复出现的词只判断一次
+            valid = validity[term] = is_valid_term(term, common_words)
+        if not valid:
+            continue
+        counts[term] += 1
+        if term not in first_seen:
+            context = " ".join(text[max(0, match.start() - 40):match.end() + 40].split())
+            first_seen[term] = (match.start(), context)
+    return name, counts, first_seen
+
 class TranslationResult:
-    def __init__(self, result, errorcode, data):
+    # 遮蔽占位符在译文中缺失或结构错乱，需要改用完整HTML重新翻译
+    MASK_MISMATCH = 1002
+    # 译文达到输出token上限被截断（finish_reason 为 "length"），需要切分后重新翻译
+    TRUNCATED = 1003
+    # 切分后拼接的译文明显短于原文，可能有块的译文丢失
+    INCOMPLETE = 1004
+
+    def __init__(self, result, errorcode, data, node=None, model=None):
         self.result = result
         self.errorcode = errorcode
         self.data = data
+        # 由占位符还原出的译文节点，为 None 时需要解析 data
+        self.node = node
+        # 给出译文的模型，译文按它写入翻译记忆；为 None 时（例如各块由不同模型翻译）不写入
+        self.model = model
+
+class StreamedCompletion:
+    """把流式响应的分片拼接成完整译文，同时记下结束原因和用量"""
+    def __init__(self):
+        self.parts = []
+        self.finish_reason = None
+        self.usage = None
+
+    def add(self, chunk):
+        if chunk.choices:
+            choice = chunk.choices[0]
+            if choice.delta is not None and choice.delta.content:
+                self.parts.append(choice.delta.content)
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+        if getattr(chunk, 'usage', None) is not None:
+            self.usage = chunk.usage
+
+    def output(self):
+        """返回 (译文, 结束原因, 用量)"""
+        return "".join(self.parts), self.finish_reason, self.usage
+
+class GlossaryFormatter(HTMLFormatter):
+    """在序列化节点时顺带替换文本节点中的术语
+
+    不修改节点本身，也不需要为了应用词汇表把节点转成字符串再解析一次。
+    属性值（class、href等）不做替换。
+    """
+    def __init__(self, matcher):
+        super().__init__(entity_substitution=EntitySubstitution.substitute_xml)
+        self.matcher = matcher
+        self.replaced = []
+
+    def substitute(self, ns):
+        if isinstance(ns, NavigableString) and not (ns.parent is not None and ns.parent.name in self.cdata_containing_tags):
+            text, replaced = self.matcher.replace(str(ns))
+            self.replaced.extend(replaced)
+            return self.entity_substitution(text)
+        return super().substitute(ns)
+
+def completion_output(response):
+    """从非流式响应中取出 (译文, 结束原因, 用量)"""
+    if response is None or not response.choices:
+        return None, None, None
+    choice = response.choices[0]
+    return choice.message.content, choice.finish_reason, getattr(response, 'usage', None)
+
+async def afirst_result(tasks):
+    """等待一组请求任务，返回第一个成功的结果和它的序号；全部失败时抛出第一个任务的异常"""
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for index, task in enumerate(tasks):
+            if task in done and task.exception() is None:
+                return task.result(), index
+    raise tasks[0].exception()
+
+class TranslationRequest:
+    """经过预处理、准备发送给API的翻译请求"""
+    def __init__(self, system_prompt, source_text, content, glossary=None, label=""):
+        self.system_prompt = system_prompt
+        self.source_text = source_text
+        self.content = content
+        self.glossary = glossary
+        self.label = label
+        # 已经查询过翻译记忆，成功的译文需要写回
+        self.cacheable = False
+        # 行内标签被替换为占位符时保存还原所需的信息
+        self.masked = None
+        # 纯文本和遮蔽后的文本可以在句子边界切分；完整HTML切开后标签不再成对，不能切分
+        self.splittable = True
+
+# ebooklib 需要读取内容的项目类型；其余项目（图片、字体、样式表等）的内容不会被修改，
+# 读取时不加载，写出时直接复制源压缩包中的压缩数据
+PARSED_MEDIA_TYPES = frozenset(DOCUMENT_MEDIA_TYPES + (NCX_MEDIA_TYPE, "application/smil+xml"))
+
+class PassthroughEpubReader(epub.EpubReader):
+    """不加载原样保留项目内容的 EpubReader
+
+    这些项目的 content 为空，raw_source / raw_entry 记录源文件路径和压缩包条目，
+    由 PassthroughEpubWriter 写出。
+    """
+    def __init__(self, epub_file_name, options=None):
+        super().__init__(epub_file_name, options)
+        self.passthrough = set()
+
+    def _load_manifest(self):
+        # 以目录形式打开的EPUB没有压缩数据可以复制，按原来的方式读取
+        if isinstance(self.zf, zipfile.ZipFile):
+            for element in self.container.iter(f"{{{epub.NAMESPACES['OPF']}}}item"):
+                media_type = element.get("media-type")
+                if media_type not in PARSED_MEDIA_TYPES:
+                    self.passthrough.add(self.zip_name(unquote(element.get("href", ""))))
+        super()._load_manifest()
+        for item in self.book.get_items():
+            name = self.zip_name(item.file_name)
+            if name in self.passthrough:
+                item.raw_source = self.file_name
+                item.raw_entry = self.zf.getinfo(name)
+
+    def zip_name(self, file_name):
+        return posixpath.normpath(posixpath.join(self.opf_dir, file_name))
+
+    def read_file(self, name):
+        if posixpath.normpath(name) in self.passthrough:
+            return b""
+        return super().read_file(name)
+
+class PassthroughEpubWriter(epub.EpubWriter):
+    """把 PassthroughEpubReader 读出的原样保留项目以原始压缩数据复制到输出的 EpubWriter"""
+    def _write_items(self):
+        items = self.book.items
+        # 其余项目仍由 ebooklib 写出
+        self.book.items = [item for item in items if not self.copy_raw(item)]
+        try:
+            super()._write_items()
+        finally:
+            self.book.items = items
+
+    def copy_raw(self, item):
+        raw_entry = getattr(item, 'raw_entry', None)
+        if raw_entry is None:
+            return False
+        name = f"{self.book.FOLDER_NAME}/{item.file_name}"
+        if not copy_raw_entry(item.raw_source, raw_entry, self.out, name):
+            with zipfile.ZipFile(item.raw_source) as source:
+                self.out.writestr(name, source.read(raw_entry))
+        return True
+
+def read_epub(input_epub, options=None):
+    """与 epub.read_epub 相同，但不加载原样保留项目的内容"""
+    reader = PassthroughEpubReader(input_epub, options)
+    book = reader.load()
+    reader.process()
+    return book
+
+def write_epub(output_epub, book, options=None):
+    """与 epub.write_epub 相同，原样保留的项目直接复制源压缩包中的压缩数据"""
+    writer = PassthroughEpubWriter(output_epub, book, options)
+    writer.process()
+    writer.write()
+
+class EpubAssembler:
+    """收集翻译完成的EPUB项目，在结束时一次性写出整个文件
+
+    工作线程只需把完成的项目交给 add_item，不再每完成一项就重写整个压缩包。
+    如果设置了 flush_interval（秒），主线程会按该间隔调用 maybe_flush
+    把已完成的项目落盘，用于崩溃后保留部分结果。
+    """
+    def __init__(self, book, output_epub, flush_interval=None, epub_options=None, profiler=None):
+        self.book = book
+        self.output_epub = output_epub
+        self.flush_interval = flush_interval
+        self.epub_options = epub_options or {'ignore_ncx': False}
+        self.lock = threading.Lock()
+        self.pending_items = []
+        self.last_flush = time.time()
+        self.profiler = profiler or StageProfiler()
+
+    def add_item(self, item):
+        """登记一个已完成的项目（只在内存中排队，不写文件）"""
+        with self.lock:
+            self.pending_items.append(item)
+
+    def maybe_flush(self):
+        """距离上次写出超过 flush_interval 时落盘一次"""
+        if not self.flush_interval:
+            return False
+        if time.time() - self.last_flush < self.flush_interval:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        """把排队的项目加入书籍并写出EPUB文件"""
+        with self.lock, self.profiler.span("write"):
+            for item in self.pending_items:
+                self.book.add_item(item)
+            self.pending_items = []
+            write_epub(self.output_epub, self.book, self.epub_options)
+            self.last_flush = time.time()
+        print(f"已写出EPUB文件: {self.output_epub}")
+
+class StreamingAssembler:
+    """流式模式的输出装配器：文档完成后立即写入输出压缩包，不在内存中保留"""
+    def __init__(self, writer, profiler=None):
+        self.writer = writer
+        self.profiler = profiler or StageProfiler()
+
+    def add_item(self, item):
+        with self.profiler.span("write"):
+            self.writer.write(item.zip_name, item.get_content())
+
+    def maybe_flush(self):
+        return False
+
+    def flush(self):
+        pass
+
+class DocumentJob:
+    """一个待翻译的文档：保存解析后的soup和待完成的片段数"""
+    def __init__(self, item, soup, nodes):
+        self.item = item
+        # 指标中用于区分章节的名称，批量模式下带上书名
+        self.name = item.file_name
+        self.soup = soup
+        self.lock = threading.Lock()
+        self.segments = [SegmentTask(self, index, node) for index, node in enumerate(nodes)]
+        self.pending = len(self.segments)
+        self.finished = False
+        self.journal = None
+
+    def finish_segment(self):
+        """标记一个片段完成，返回该文档是否已全部完成"""
+        with self.lock:
+            self.pending -= 1
+            self.finished = self.pending == 0
+            return self.finished
+
+class BookJob:
+    """一本正在翻译的书：输出装配器、片段日志、词汇表以及尚未提交给工作池的批次"""
+    def __init__(self, input_epub, output_epub, glossary, journal, assembler, documents, batches):
+        self.input_epub = input_epub
+        self.output_epub = output_epub
+        self.glossary = glossary
+        self.journal = journal
+        self.assembler = assembler
+        self.documents = documents
+        self.batches = deque(batches)
+        self.total_segments = sum(len(document.segments) for document in documents)
+        self.restored_segments = self.total_segments - sum(len(batch) for batch in batches)
+        self.started = time.time()
+
+    def next_work(self):
+        """取出下一个待提交给工作池的工作项 (批次, 装配器, 词汇表)，没有时返回 None"""
+        if not self.batches:
+            return None
+        return self.batches.popleft(), self.assembler, self.glossary
+
+class SegmentTask:
+    """工作池中的最小翻译单元：文档中的一个段落或引用块"""
+    def __init__(self, document, index, node):
+        self.document = document
+        self.index = index
+        self.node = node
+        self.source = str(node)
+        self.source_hash = segment_hash(self.source)
 
 class EpubTranslator:
-    # 用于保存翻译进度的文件名模板
-    CHECKPOINT_FILE = "{}_translation_checkpoint.pkl"
+    # 用于保存翻译进度的片段日志文件名模板
+    JOURNAL_FILE = "{}_segments.jsonl"
     # 保存专有名词词典的文件名
     GLOSSARY_FILE = "{}_glossary.json"
     # 临时目录，用于存放导出的文件
     TMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
     # 永久性存储目录，用于保存翻译后的文件
     TRANSLATED_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "translated_files")
+    # 翻译记忆数据库，跨运行复用已有译文
+    TRANSLATION_MEMORY_FILE = os.path.join(TMP_DIR, "translation_memory.sqlite3")
+    # 同时缓存的词汇表匹配器数量（批量模式下每本书各有一个词汇表）
+    GLOSSARY_CACHE_SIZE = 16
+    # 批量模式的状态汇总文件名
+    BATCH_SUMMARY_FILE = "batch_summary.json"
+    # 运行期间输出进度的间隔（秒）
+    PROGRESS_INTERVAL = 5
 
-    def __init__(self, api_key=None, api_base=None, model_name=None, common_words_path='./commonwords/google-10000-english.txt'):
-        """初始化翻译器"""
+    def __init__(self, api_key=None, api_base=None, model_name=None, common_words_path='./commonwords/google-10000-english.txt',
+                 use_cache=True, cache_path=None, cache_max_mb=200, requests_per_minute=None, tokens_per_minute=None,
+                 html_parser=None, mask_markup=True, rate_limiter=None, max_connections=None, http2=None,
+                 connect_timeout=None, read_timeout=None, stream_completions=None, max_output_tokens=None,
+                 retry_policy=None, hedge=None, hedge_max_fraction=None, endpoints=None):
+        """初始化翻译器
+
+        use_cache: 是否启用持久化翻译记忆
+        cache_path: 翻译记忆数据库路径，默认保存在临时目录
+        cache_max_mb: 翻译记忆容量上限（MB），超过后淘汰最久未使用的条目
+        requests_per_minute / tokens_per_minute: 共享限流器的每分钟请求数和token数上限，
+            未指定时读取环境变量 RATE_LIMIT_RPM / RATE_LIMIT_TPM，均为空表示不限流；
+            有多个端点时是第一个端点的额度（第一个端点自己配置了额度时忽略），各端点的速率互不限制
+        html_parser: 解析章节使用的 BeautifulSoup 解析器，默认读取环境变量 HTML_PARSER，未设置时安装了 lxml
+            就使用 "lxml-xml"（只用于格式良好的 XHTML 章节，其余章节使用 "html.parser"），否则使用 "html.parser"
+        mask_markup: 是否把段落中的行内标签替换为占位符后只发送文本，减少每段的token数
+        rate_limiter: 与其他翻译器共享的限流器，提供时忽略 requests_per_minute / tokens_per_minute；
+            有多个端点时同样只用于第一个端点
+        max_connections: 保持长连接的连接池大小，默认按工作线程数或异步并发数自动设置
+        http2: 是否使用 HTTP/2（需要安装 h2），默认读取环境变量 HTTP2
+        connect_timeout / read_timeout: 建立连接和等待响应的超时秒数，默认读取环境变量
+            CONNECT_TIMEOUT / READ_TIMEOUT，未设置时分别为 10 和 30 秒
+        stream_completions: 是否以流式接收响应，默认读取环境变量 STREAM_COMPLETIONS，未设置时启用；
+            流式响应只要服务端持续返回数据就不会触发读取超时
+        max_output_tokens: 单次请求的输出token上限，预计译文超过上限的片段在句子边界切分后分别翻译，
+            默认读取环境变量 MAX_OUTPUT_TOKENS，未设置时为 1024
+        retry_policy: API调用失败后的重试策略，默认按环境变量 RETRY_BUDGET（可重试错误的重试次数
+            占请求数的比例，未设置时为 0.2）创建
+        hedge: 请求等待超过近期延迟的 p95 时是否再发送一份相同的请求，先返回的结果胜出，
+            默认读取环境变量 HEDGE_REQUESTS
+        hedge_max_fraction: 被对冲的请求占全部请求的比例上限，默认读取环境变量 HEDGE_MAX_FRACTION，未设置时为 0.05
+        endpoints: 端点配置列表（见 endpoint_pool.load_endpoints），每个端点有自己的密钥、地址、模型和限流额度，
+            请求按负载分配到健康的端点；未提供时由 api_key / api_base / model_name 和带编号的环境变量
+            API_KEY_2、BASE_URL_2 等组成端点池；也可以通过环境变量 ENDPOINTS_FILE 指定端点配置文件
+        """
         # 确保临时目录和永久性存储目录存在
         os.makedirs(self.TMP_DIR, exist_ok=True)
         os.makedirs(self.TRANSLATED_FILES_DIR, exist_ok=True)
@@ -54,14 +500,49 @@ class EpubTranslator:
         self.api_base = api_base or os.getenv('BASE_URL')
         self.model_name = model_name or os.getenv('MODEL_NAME')
         
-        # 初始化OpenAI API
-        openai.api_key = self.api_key
-        if self.api_base:
-            openai.api_base = self.api_base
+        # 每个翻译器使用自己的API客户端，同一进程中不同密钥的翻译器互不影响
+        self.http2 = http2 if http2 is not None else os.getenv('HTTP2', '').lower() in ('1', 'true', 'yes')
+        if self.http2 and not HTTP2_AVAILABLE:
+            print("警告: 未安装 h2，无法使用 HTTP/2，改用 HTTP/1.1")
+            self.http2 = False
+        # 过长片段切出的块会同时请求，可能超过连接池大小，等待空闲连接不计入超时
+        self.timeout = httpx.Timeout(read_timeout or float(os.getenv('READ_TIMEOUT') or 30),
+                                     connect=connect_timeout or float(os.getenv('CONNECT_TIMEOUT') or 10), pool=None)
+        self.stream_completions = (stream_completions if stream_completions is not None
+                                   else os.getenv('STREAM_COMPLETIONS', 'true').lower() not in ('0', 'false', 'no'))
+        self.max_output_tokens = max_output_tokens or int(os.getenv('MAX_OUTPUT_TOKENS') or DEFAULT_MAX_OUTPUT_TOKENS)
+        hedge = hedge if hedge is not None else os.getenv('HEDGE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+        self.hedge_policy = None
+        self.hedge_executor = None
+        self.hedge_timer = None
+        if hedge:
+            self.hedge_policy = HedgePolicy(max_fraction=hedge_max_fraction or float(os.getenv('HEDGE_MAX_FRACTION') or 0.05))
+            # 同步引擎的原请求在工作线程中直接发送，只有对冲请求在这里的线程中发送，线程按需创建
+            self.hedge_executor = ThreadPoolExecutor(max_workers=256, thread_name_prefix="Hedge")
+            self.hedge_timer = HedgeTimer()
+        if endpoints is None and os.getenv('ENDPOINTS_FILE'):
+            endpoints = load_endpoints(os.getenv('ENDPOINTS_FILE'))
+        self.endpoints = EndpointPool(create_endpoints(
+            endpoints or endpoints_from_env(self.api_key, self.api_base, self.model_name), self.model_name))
+        # 第一个端点的模型，作为未指定模型的请求参数和显示用；翻译记忆按实际给出译文的模型存取
+        self.model_name = self.endpoints.primary.model
+        self.max_connections = max_connections
+        self.pool_size = 0
+        self.resize_client(max_connections or 10)
             
         print(f"model_name: {self.model_name}")
-        print(f"openai.api_key: {openai.api_key}")
-        print(f"openai.api_base: {openai.api_base}")
+        print(f"api_base: {self.endpoints.primary.client.base_url}")
+        if len(self.endpoints) > 1:
+            print(f"已启用 {len(self.endpoints)} 个端点: " + "，".join(endpoint.describe() for endpoint in self.endpoints))
+        
+        # 章节解析器
+        self.html_parser = html_parser or os.getenv('HTML_PARSER') or DEFAULT_HTML_PARSER
+        if self.html_parser not in HTML_PARSERS:
+            # lxml 的HTML解析器会把 <a id="x"/> 这样的自闭合标签当成开始标签，改坏没有翻译的正文
+            print(f"不支持的章节解析器 {self.html_parser}，改用 {DEFAULT_HTML_PARSER}")
+            self.html_parser = DEFAULT_HTML_PARSER
+        print(f"章节解析器: {self.html_parser}")
+        self.mask_markup = mask_markup
         
         # 加载常用词列表
         self.common_words = self.load_common_words(common_words_path)
@@ -71,6 +552,40 @@ class EpubTranslator:
         
         # 书籍背景信息
         self.book_background = None
+        
+        # 初始化翻译记忆
+        self.translation_memory = None
+        if use_cache:
+            self.translation_memory = TranslationMemory(cache_path or self.TRANSLATION_MEMORY_FILE,
+                                                        max_bytes=int(cache_max_mb * 1024 * 1024))
+        # 每次API调用的延迟、token用量和重试次数，每次翻译EPUB时重新开始统计
+        self.metrics = RunMetrics()
+        # 各阶段耗时分析，默认关闭，translate_epub(profile=True) 时启用
+        self.profiler = StageProfiler()
+        # 上次输出运行进度的时间，见 progress_due
+        self.last_progress_report = time.time()
+        # 词汇表内容指纹 -> 编译后的匹配器，按最近使用的顺序排列
+        self._glossary_matchers = OrderedDict()
+        self._glossary_matcher_lock = threading.Lock()
+        
+        # 所有线程和协程共享的限流器，取代每次请求后固定休眠
+        limits = (requests_per_minute or float(os.getenv('RATE_LIMIT_RPM') or 0),
+                  tokens_per_minute or float(os.getenv('RATE_LIMIT_TPM') or 0))
+        if len(self.endpoints) > 1:
+            # 多端点时 RATE_LIMIT_RPM / RATE_LIMIT_TPM（或传入的共享限流器）是第一个端点密钥的额度，
+            # 每个端点只受自己的额度限制，总速率可以达到各密钥额度之和
+            primary = self.endpoints.primary
+            if not primary.rate_limiter.enabled:
+                primary.rate_limiter = rate_limiter or RateLimiter(*limits)
+            self.rate_limiter = RateLimiter()
+        else:
+            self.rate_limiter = rate_limiter or RateLimiter(*limits)
+        self.retry_policy = retry_policy or RetryPolicy(budget_ratio=float(os.getenv('RETRY_BUDGET') or 0.2))
+        for name, limiter in [(None, self.rate_limiter)] + [(endpoint.name, endpoint.rate_limiter)
+                                                            for endpoint in self.endpoints if len(self.endpoints) > 1]:
+            if limiter.enabled:
+                print(f"已启用限流{f'（端点 {name}）' if name else ''}: "
+                      f"每分钟请求数 {limiter.requests_per_minute or '不限'}，每分钟token数 {limiter.tokens_per_minute or '不限'}")
 
     def load_common_words(self, file_path):
         """从文件中加载常用词列表"""
@@ -99,293 +614,907 @@ class EpubTranslator:
         return match is not None
         
     def contains_chinese(self, s):
-        """检查字符串中间及周围是否包含中文字符"""
-        if not s or len(s) < 3:  # 至少需要3个字符才有中间位置
-            return False
-            
-        # 找到字符串的中间位置
-        mid_point = len(s) // 2
-        
-        # 定义检查范围（向左和向右各检查几个字符）
-        check_range = min(15, len(s) // 2)  # 每个方向最多检查15个字符
-        
-        # 使用Unicode范围检查是否是中文字符
-        def is_chinese_char(char):
-            # 中文字符的Unicode范围
-            return '\u4e00' <= char <= '\u9fff'
-        
-        # 检查中间向左的字符
-        for i in range(max(0, mid_point - check_range), mid_point):
-            if is_chinese_char(s[i]):
-                return True
-                
-        # 检查中间向右的字符
-        for i in range(mid_point, min(len(s), mid_point + check_range)):
-            if is_chinese_char(s[i]):
-                return True
-                
-        return False
+        """检查字符串是否主要由中文组成（按整段文字中中文字符与英文字母的比例判断）"""
+        return bool(s) and chinese_ratio(s) >= CHINESE_RATIO
 
     def is_valid_term(self, term):
         """判断一个词组是否可能是一个有效的专有名词"""
-        # 如果是空或只有一个字符，不是有效术语
-        if not term or len(term) <= 1:
-            return False
-            
-        # 分割成单词
-        words = term.split()
-        
-        # 如果只有一个单词
-        if len(words) == 1:
-            # 如果是常见单词（不区分大小写），排除
-            if words[0].lower() in self.common_words:
-                return False
-            
-            # 如果只有一个单词且长度小于4，可能不够特殊，除非它可能是缩写（全大写）
-            if len(words[0]) < 4 and not words[0].isupper():
-                return False
-        
-        # 检查多词组合是否全是常用词
-        all_common = all(word.lower() in self.common_words for word in words)
-        if all_common:
-            return False
-        
-        # 可能是有意义的专有名词
-        return True
+        return is_valid_term(term, self.common_words)
+
+    def extract_terms(self, input_epub, export_excel=False, min_freq=1, workers=None):
+        """从EPUB文件中提取可能的专有名词、人名、地名等
 
-    def extract_terms(self, input_epub, export_excel=False):
-        """从EPUB文件中提取可能的专有名词、人名、地名等"""
+        各文档在多个进程中并行扫描并统计出现次数。
+        min_freq: 出现次数低于该值的候选词被丢弃
+        workers: 扫描进程数，默认使用全部CPU核心，为1时在当前进程中串行扫描
+        返回 (按出现次数从高到低排序的术语列表, Excel文件路径, 术语统计)，
+        术语统计为 {术语: {"count": 出现次数, "first_seen": {"doc": 文档, "offset": 位置, "context": 上下文}}}
+        """
         print("开始提取专有名词...")
-        book = epub.read_epub(input_epub)
-        terms = set()
-        
-        # 正则表达式用于匹配可能的专有名词（首字母大写的词组，允许1-3个词）
-        term_pattern = re.compile(r'\b([A-Z][a-z]+(?:\s+[A-Z][a-z]+){0,2})\b')
+        counts = Counter()
+        first_seen = {}
         
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                content = item.get_content().decode('utf-8')
-                soup = BeautifulSoup(content, 'html.parser')
-                text = soup.get_text()
-                
-                # 提取匹配的词组
-                matches = term_pattern.findall(text)
-                for term in matches:
-                    # 使用增强的过滤规则
-                    if self.is_valid_term(term):
-                        terms.add(term)
+        with EpubArchive(input_epub) as archive:
+            documents = archive.documents()
+            order = {document.zip_name: index for index, document in enumerate(documents)}
+            for name, doc_counts, doc_first_seen in self.scan_documents_for_terms(archive, documents, workers):
+                counts.update(doc_counts)
+                # 结果按完成顺序返回，按文档阅读顺序确定首次出现位置
+                for term, (offset, context) in doc_first_seen.items():
+                    location = (order[name], offset)
+                    if term not in first_seen or location < first_seen[term][0]:
+                        first_seen[term] = (location, name, offset, context)
         
-        sorted_terms = sorted(list(terms))
-        print(f"提取了 {len(sorted_terms)} 个可能的专有名词")
+        ranked_terms = sorted((term for term, count in counts.items() if count >= min_freq),
+                              key=lambda term: (-counts[term], term))
+        term_stats = {}
+        for term in ranked_terms:
+            _, name, offset, context = first_seen[term]
+            term_stats[term] = {
+                "count": counts[term],
+                "first_seen": {"doc": name, "offset": offset, "context": context}
+            }
+        print(f"提取了 {len(ranked_terms)} 个可能的专有名词（共 {len(counts)} 个候选，最少出现 {min_freq} 次）")
         
         # 如果需要导出Excel，生成Excel文件并返回文件路径
         excel_path = None
-        if export_excel and sorted_terms:
+        if export_excel and ranked_terms:
             base_name = os.path.splitext(os.path.basename(input_epub))[0]
-            excel_path = self.export_terms_to_excel(sorted_terms, base_filename=base_name)
+            excel_path = self.export_terms_to_excel(ranked_terms, base_filename=base_name, stats=term_stats)
         
-        return sorted_terms, excel_path
+        return ranked_terms, excel_path, term_stats
+
+    def scan_documents_for_terms(self, archive, documents, workers=None):
+        """逐个读取文档并交给进程池扫描，同时在途的文档数有上限，避免整本书驻留内存"""
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(documents) <= 1:
+            for document in documents:
+                yield scan_document_terms(document.zip_name, archive.read(document.zip_name), self.common_words)
+            return
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_term_worker,
+                                 initargs=(self.common_words,)) as executor:
+            pending = set()
+            for document in documents:
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(scan_document_terms, document.zip_name, archive.read(document.zip_name)))
+            for future in as_completed(pending):
+                yield future.result()
 
     def translate_text(self, text, glossary=None, max_retries=3):
         """翻译文本，支持重试和术语替换"""
-        # 检查是否已包含中文，如果是则直接返回
-        if self.contains_chinese(text):
-            print("文本已包含中文，无需翻译！")
-            return TranslationResult(True, 0, text)
+        tresult, request = self.prepare_text_request(text, glossary)
+        if tresult is not None:
+            return tresult
+        return self.cached_completion(request, max_retries)
+
+    async def atranslate_text(self, text, glossary=None, max_retries=3):
+        """translate_text 的异步版本"""
+        tresult, request = self.prepare_text_request(text, glossary)
+        if tresult is not None:
+            return tresult
+        return await self.acached_completion(request, max_retries)
+
+    def translate_html(self, text, glossary=None, max_retries=3, node=None, mask=None):
+        """翻译HTML内容，支持重试和术语替换；占位符无法还原时改用完整HTML重新翻译"""
+        tresult, request = self.prepare_html_request(text, glossary, node, mask)
+        if tresult is None:
+            tresult = self.cached_completion(request, max_retries)
+        if tresult.errorcode == TranslationResult.MASK_MISMATCH:
+            print("译文中的占位符无法还原，改为发送完整HTML重新翻译")
+            return self.translate_html(text, glossary, max_retries, node, mask=False)
+        return tresult
+
+    async def atranslate_html(self, text, glossary=None, max_retries=3, node=None, mask=None):
+        """translate_html 的异步版本"""
+        tresult, request = self.prepare_html_request(text, glossary, node, mask)
+        if tresult is None:
+            tresult = await self.acached_completion(request, max_retries)
+        if tresult.errorcode == TranslationResult.MASK_MISMATCH:
+            print("译文中的占位符无法还原，改为发送完整HTML重新翻译")
+            return await self.atranslate_html(text, glossary, max_retries, node, mask=False)
+        return tresult
+
+    def prepare_text_request(self, text, glossary=None):
+        """文本翻译的预处理：返回 (直接可用的结果, None) 或 (None, 待发送的请求)"""
+        # 数字、分隔符、网址、已是中文等片段不需要翻译
+        reason = skip_reason(text)
+        if reason is not None:
+            return self.classified(SKIP, TranslationResult(True, 0, text), reason)
             
         # 先检查词汇表中是否有对应的翻译
         if glossary and text in glossary:
             print(f"使用词汇表翻译: {text} -> {glossary[text]}")
-            return TranslationResult(True, 0, glossary[text])
+            return self.classified(GLOSSARY_ONLY, TranslationResult(True, 0, glossary[text]))
         
         # 预处理：在发送前替换文本中的术语
         preprocessed_text = text
         if glossary:
-            # 按长度排序术语，优先替换长词，避免部分替换问题
-            sorted_terms = sorted(glossary.items(), key=lambda x: len(x[0]), reverse=True)
-            replaced_terms = []
-            
-            for term, translation in sorted_terms:
-                if term in preprocessed_text:
-                    # 简单字符串替换
-                    preprocessed_text = preprocessed_text.replace(term, translation)
-                    replaced_terms.append(f"{term} -> {translation}")
+            # 编译好的匹配器一次扫描完成最左最长替换，避免部分替换问题
+            with self.profiler.span("glossary"):
+                preprocessed_text, replaced = self.glossary_matcher(glossary).replace(text)
+            replaced_terms = [f"{term} -> {translation}" for term, translation in replaced]
             
             if replaced_terms:
                 print(f"预处理替换了 {len(replaced_terms)} 个术语: {', '.join(replaced_terms[:3])}")
                 if len(replaced_terms) > 3:
                     print(f"...等共 {len(replaced_terms)} 个术语")
         
-        # 调用OpenAI的API进行翻译，添加重试机制
-        retries = 0
-        while retries <= max_retries:
-            try:
-                if not self.check_string(preprocessed_text):
-                    print("不需要翻译！")
-                    return TranslationResult(True, 0, text)
-                
-                # 创建系统提示，添加背景信息
-                system_prompt = "从现在开始，您是一名翻译。你不会与我进行任何对话;你只会将我的话从英语翻译成中文，无论或长或短都翻译。您将返回纯翻译结果，无需添加任何其他内容与解释，包括中文拼音。"
-                
-                # 如果有书籍背景信息，添加到系统提示中
-                if self.book_background:
-                    system_prompt += f"\n\n关于本书背景：{self.book_background}\n\n请根据上述背景信息进行专业、准确的翻译。"
-                
-                response = openai.ChatCompletion.create(
-                    model=self.model_name,
-                    messages=[
-                        {
-                            "role":"system",
-                            "content": system_prompt
-                        },  
-                        {
-                            "role": "user", 
-                            "content": f"{preprocessed_text}"
-                        }
-                    ],
-                    max_tokens=1024,
-                    temperature=0.0,
-                    request_timeout=30,  # 增加超时时间到30秒
-                )
-                    
-                if response is None:
-                    print("翻译失败！")
-                    return text
-                
-                translated_text = response.choices[0].message['content']
-                
-                # 每个请求后休息3秒，避免请求过于频繁
-                time.sleep(3)
-                
-                return TranslationResult(True, 0, translated_text)
-                
-            except Exception as e:
-                print("发生异常：", e)
-                error_msg = str(e).lower()
-                # 判断是否为超时异常
-                if "timeout" in error_msg or "timed out" in error_msg:
-                    retries += 1
-                    if retries <= max_retries:
-                        wait_time = 5  # 超时后等待5秒
-                        print(f"请求超时，等待{wait_time}秒后重试 ({retries}/{max_retries})...")
-                        time.sleep(wait_time)
-                        continue  # 继续下一次重试
-                    else:
-                        print(f"超过最大重试次数 ({max_retries})，放弃翻译")
-                
-                traceback.print_exc()
-                return TranslationResult(False, 1001, None)
-
-    def translate_html(self, text, glossary=None, max_retries=3):
-        """翻译HTML内容，支持重试和术语替换"""
-        # 检查是否已包含中文，如果是则直接返回
-        if self.contains_chinese(text):
-            print("HTML内容已包含中文，无需翻译！")
-            return TranslationResult(True, 0, text)
-            
-        # 先检查词汇表中是否有对应的翻译
-        if glossary and text in glossary:
-            print(f"使用词汇表翻译HTML: {text} -> {glossary[text]}")
-            return TranslationResult(True, 0, glossary[text])
+        # 替换术语后不再含有英文时直接使用替换结果
+        if not has_latin(preprocessed_text):
+            return self.classified(GLOSSARY_ONLY, TranslationResult(True, 0, preprocessed_text))
+        
+        self.metrics.record_classification(TRANSLATE)
+        return None, TranslationRequest(self.text_system_prompt(), text, preprocessed_text, glossary)
+
+    def prepare_html_request(self, text, glossary=None, node=None, mask=None):
+        """HTML翻译的预处理：返回 (直接可用的结果, None) 或 (None, 待发送的请求)
+
+        node: text 对应的已解析节点，提供时直接在节点上应用词汇表，不再重新解析 text
+        mask: 是否把节点中的行内标签替换为占位符，默认取 mask_markup
+        """
+        # 占位符还原失败后改发完整HTML的重试已经统计过分类
+        record = mask is not False
+        if node is None:
+            node = self.parse_fragment(text)
+        plain_text = node.get_text()
+        
+        # 数字、分隔符、网址、ISBN、代码、已是中文等片段不需要翻译
+        reason = skip_reason(plain_text, node)
+        if reason is not None:
+            return self.classified(SKIP, TranslationResult(True, 0, text), reason, record)
+        
+        if mask is None:
+            mask = self.mask_markup
+        if mask:
+            request = self.prepare_masked_request(text, glossary, node)
+            if request is not None:
+                # 占位符中没有英文字母，替换术语后不再含有英文时直接还原节点
+                if not has_latin(request.content):
+                    restored = request.masked.restore(request.content)
+                    if restored is not None:
+                        return self.classified(GLOSSARY_ONLY, TranslationResult(True, 0, str(restored), restored),
+                                               record=record)
+                if record:
+                    self.metrics.record_classification(TRANSLATE)
+                return None, request
         
         # 预处理：替换HTML中的术语
         preprocessed_text = text
+        replaced_text = plain_text
         if glossary:
             try:
-                # 解析HTML
-                soup = BeautifulSoup(text, 'html.parser')
-                
-                # 处理所有文本节点
-                def process_text_nodes(node):
-                    if isinstance(node, NavigableString):
-                        text_content = str(node)
-                        modified = False
-                        
-                        # 按长度排序术语，优先替换长词
-                        sorted_terms = sorted(glossary.items(), key=lambda x: len(x[0]), reverse=True)
-                        
-                        for term, translation in sorted_terms:
-                            if term in text_content:
-                                text_content = text_content.replace(term, translation)
-                                modified = True
-                                print(f"在HTML中替换术语: {term} -> {translation}")
-                        
-                        if modified:
-                            node.replace_with(text_content)
-                    else:
-                        # 递归处理子节点
-                        for child in list(node.children):
-                            process_text_nodes(child)
-                
-                # 处理HTML中的文本节点
-                process_text_nodes(soup)
-                
-                # 将修改后的HTML转换回字符串
-                preprocessed_text = str(soup)
+                # 序列化的同时替换文本节点中的术语，不修改节点本身
+                formatter = GlossaryFormatter(self.glossary_matcher(glossary))
+                with self.profiler.span("glossary"):
+                    preprocessed_text = node.decode(formatter=formatter)
+                    replaced_text = self.glossary_matcher(glossary).replace(plain_text)[0]
+                for term, translation in formatter.replaced:
+                    print(f"在HTML中替换术语: {term} -> {translation}")
             except Exception as e:
                 print(f"处理HTML中的术语时出错: {e}")
                 # 如果出错，继续使用原始的text
                 preprocessed_text = text
+                replaced_text = plain_text
+        
+        # 标签中的属性名不算需要翻译的英文，只看替换术语后的正文
+        if not has_latin(replaced_text):
+            return self.classified(GLOSSARY_ONLY, TranslationResult(True, 0, preprocessed_text), record=record)
+        
+        if record:
+            self.metrics.record_classification(TRANSLATE)
+        request = TranslationRequest(self.html_system_prompt(), text, preprocessed_text, glossary, label="HTML")
+        request.splittable = False
+        return None, request
+
+    def classified(self, kind, tresult, reason=None, record=True):
+        """不需要调用API的片段：统计分类并返回 (直接可用的结果, None)"""
+        if kind == SKIP:
+            print(f"不需要翻译（{reason}）！")
+        else:
+            print("只含词汇表术语，直接替换，无需翻译！")
+        if record:
+            self.metrics.record_classification(kind)
+        return tresult, None
+
+    def prepare_masked_request(self, text, glossary, node):
+        """把节点的行内标签替换为占位符并在文本节点上应用词汇表，原文含有占位符字符时返回 None"""
+        text_filter = self.glossary_matcher(glossary).replace if glossary else None
+        with self.profiler.span("mask"):
+            masked = MaskedSegment.create(node, text_filter)
+        if masked is None:
+            return None
+        for term, translation in masked.replaced:
+            print(f"在HTML中替换术语: {term} -> {translation}")
+        request = TranslationRequest(self.masked_system_prompt(), text, masked.text, glossary, label="HTML")
+        request.masked = masked
+        return request
+
+    def finish_request(self, request, tresult):
+        """把遮蔽请求的译文还原为节点，占位符结构不完整时返回 MASK_MISMATCH"""
+        if request.masked is None or not tresult.result:
+            return tresult
+        with self.profiler.span("unmask"):
+            node = request.masked.restore(tresult.data)
+        if node is None:
+            return TranslationResult(False, TranslationResult.MASK_MISMATCH, tresult.data)
+        return TranslationResult(True, tresult.errorcode, tresult.data, node, tresult.model)
+
+    def text_system_prompt(self):
+        """纯文本翻译使用的系统提示，包含书籍背景信息"""
+        system_prompt = "从现在开始，您是一名翻译。你不会与我进行任何对话;你只会将我的话从英语翻译成中文，无论或长或短都翻译。您将返回纯翻译结果，无需添加任何其他内容与解释，包括中文拼音。"
+        
+        # 如果有书籍背景信息，添加到系统提示中
+        if self.book_background:
+            system_prompt += f"\n\n关于本书背景：{self.book_background}\n\n请根据上述背景信息进行专业、准确的翻译。"
+        return system_prompt
+
+    def html_system_prompt(self):
+        """HTML翻译使用的系统提示，包含书籍背景信息"""
+        system_prompt = "我将发一段HTML代码给你，其中包含了英文文本，请根据具体情况翻译英文文本到中文，维持原有HTML格式。"
         
-        # 调用OpenAI的API进行翻译，添加重试机制
-        retries = 0
-        while retries <= max_retries:
+        # 如果有书籍背景信息，添加到系统提示中
+        if self.book_background:
+            system_prompt += f"\n\n关于本书背景：{self.book_background}\n\n请根据上述背景信息进行专业、准确的翻译，同时保持HTML标签不变。"
+        return system_prompt
+
+    def masked_system_prompt(self):
+        """行内标签替换为占位符后使用的系统提示，包含书籍背景信息"""
+        system_prompt = ("我将发一段英文文本给你，其中⟦1⟧…⟦/1⟧、⟦2/⟧这样的符号是格式占位符。"
+                         "请把英文翻译成中文，原样保留每一个占位符并把它们放在译文中对应的位置，"
+                         "只返回译文，不要添加任何其他内容与解释。")
+        
+        # 如果有书籍背景信息，添加到系统提示中
+        if self.book_background:
+            system_prompt += f"\n\n关于本书背景：{self.book_background}\n\n请根据上述背景信息进行专业、准确的翻译，同时保持占位符不变。"
+        return system_prompt
+
+    def html_batch_system_prompt(self, masked=False):
+        """批量翻译HTML使用的系统提示，包含书籍背景信息
+
+        masked: 批中是否有行内标签被替换为占位符的文本
+        """
+        if masked:
+            system_prompt = ("我将发给你一个JSON字符串数组，每个元素是一段英文文本或包含英文文本的HTML代码，"
+                             "文本中⟦1⟧…⟦/1⟧、⟦2/⟧这样的符号是格式占位符。"
+                             "请把每个元素中的英文翻译成中文，原样保留所有占位符和HTML标签，"
+                             "只返回一个元素个数和顺序都与输入相同的JSON字符串数组，不要添加任何其他内容。")
+        else:
+            system_prompt = ("我将发给你一个JSON字符串数组，每个元素是一段包含英文文本的HTML代码。"
+                             "请把每个元素中的英文文本翻译成中文并维持原有HTML格式，"
+                             "只返回一个元素个数和顺序都与输入相同的JSON字符串数组，不要添加任何其他内容。")
+        
+        # 如果有书籍背景信息，添加到系统提示中
+        if self.book_background:
+            system_prompt += f"\n\n关于本书背景：{self.book_background}\n\n请根据上述背景信息进行专业、准确的翻译，同时保持HTML标签不变。"
+        return system_prompt
+
+    def glossary_matcher(self, glossary):
+        """获取词汇表编译后的匹配器，按词汇表内容的指纹缓存，内容相同的词汇表只编译一次，编译结果缓存在临时目录"""
+        version = self.glossary_version(glossary)
+        with self._glossary_matcher_lock:
+            matcher = self._glossary_matchers.get(version)
+            if matcher is not None:
+                self._glossary_matchers.move_to_end(version)
+                return matcher
+            matcher = GlossaryMatcher.load_or_build(glossary, version, self.TMP_DIR)
+            self._glossary_matchers[version] = matcher
+            # 批量模式下多本书交替翻译，只保留最近使用的若干个
+            while len(self._glossary_matchers) > self.GLOSSARY_CACHE_SIZE:
+                self._glossary_matchers.popitem(last=False)
+        return matcher
+
+    def glossary_version(self, glossary):
+        """计算词汇表内容的指纹；词汇表在运行中被修改后指纹随之变化，不会沿用旧的匹配器和翻译记忆"""
+        if not glossary:
+            return ""
+        payload = json.dumps(glossary, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def cache_key(self, request, model):
+        return TranslationMemory.make_key(model, request.system_prompt, self.glossary_version(request.glossary),
+                                          request.source_text)
+
+    def cache_models(self):
+        """可以复用其译文的模型：端点池中的各个模型，第一个端点的模型优先"""
+        return list(dict.fromkeys(endpoint.model for endpoint in self.endpoints))
+
+    def lookup_cache(self, request):
+        """按端点池中的各个模型查询翻译记忆，命中时返回翻译结果，否则返回 None"""
+        if self.translation_memory is None:
+            return None
+        request.cacheable = True
+        cached = None
+        with self.profiler.span("cache"):
+            for model in self.cache_models():
+                cached = self.translation_memory.get(self.cache_key(request, model))
+                if cached is not None:
+                    break
+        self.metrics.record_cache(cached is not None)
+        if cached is None:
+            return None
+        print(f"命中翻译记忆{request.label}，跳过API调用")
+        return self.finish_request(request, TranslationResult(True, 0, cached, model=model))
+
+    def store_cache(self, request, tresult):
+        """把成功的译文按给出译文的模型写回翻译记忆"""
+        if tresult.result and request.cacheable and tresult.model is not None:
+            with self.profiler.span("cache"):
+                self.translation_memory.put(self.cache_key(request, tresult.model), tresult.data)
+
+    def cached_completion(self, request, max_retries=3):
+        """先查询翻译记忆，未命中时调用API并把成功的译文写回翻译记忆"""
+        tresult = self.lookup_cache(request)
+        if tresult is not None:
+            return tresult
+        return self.complete_request(request, max_retries)
+
+    async def acached_completion(self, request, max_retries=3):
+        """cached_completion 的异步版本"""
+        tresult = self.lookup_cache(request)
+        if tresult is not None:
+            return tresult
+        return await self.acomplete_request(request, max_retries)
+
+    def complete_request(self, request, max_retries=3):
+        """调用API翻译单个请求并写回翻译记忆"""
+        tresult = self.translate_content(request.system_prompt, request.content, max_retries, request.label,
+                                         request.splittable)
+        tresult = self.finish_request(request, tresult)
+        self.store_cache(request, tresult)
+        return tresult
+
+    async def acomplete_request(self, request, max_retries=3):
+        """complete_request 的异步版本"""
+        tresult = await self.atranslate_content(request.system_prompt, request.content, max_retries, request.label,
+                                                request.splittable)
+        tresult = self.finish_request(request, tresult)
+        self.store_cache(request, tresult)
+        return tresult
+
+    def translate_content(self, system_prompt, content, max_retries=3, label="", splittable=True):
+        """翻译一段内容；预计译文超过输出上限或译文被截断时，在句子边界切开并发翻译各块后拼接
+
+        splittable: 内容能否在句子边界切分；完整HTML不切分，被截断时只放大输出上限重新翻译
+        """
+        chunks = split_text(content, self.max_output_tokens) if splittable else [content]
+        if len(chunks) == 1:
+            tresult = self.chat_completion(system_prompt, content, max_retries, label)
+            if tresult.errorcode != TranslationResult.TRUNCATED:
+                return tresult
+            chunks = self.split_truncated(content, splittable)
+            if len(chunks) == 1:
+                if self.max_output_tokens >= MAX_COMPLETION_TOKENS:
+                    return tresult
+                return self.chat_completion(system_prompt, content, max_retries, label, max_tokens=MAX_COMPLETION_TOKENS)
+        self.record_split(chunks, label)
+        with ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix="Chunk") as executor:
+            results = list(executor.map(
+                lambda chunk: self.translate_content(system_prompt, chunk, max_retries, label), chunks))
+        return self.join_chunks(content, results, label)
+
+    async def atranslate_content(self, system_prompt, content, max_retries=3, label="", splittable=True):
+        """translate_content 的异步版本"""
+        chunks = split_text(content, self.max_output_tokens) if splittable else [content]
+        if len(chunks) == 1:
+            tresult = await self.achat_completion(system_prompt, content, max_retries, label)
+            if tresult.errorcode != TranslationResult.TRUNCATED:
+                return tresult
+            chunks = self.split_truncated(content, splittable)
+            if len(chunks) == 1:
+                if self.max_output_tokens >= MAX_COMPLETION_TOKENS:
+                    return tresult
+                return await self.achat_completion(system_prompt, content, max_retries, label,
+                                                   max_tokens=MAX_COMPLETION_TOKENS)
+        self.record_split(chunks, label)
+        results = await asyncio.gather(*(self.atranslate_content(system_prompt, chunk, max_retries, label)
+                                         for chunk in chunks))
+        return self.join_chunks(content, results, label)
+
+    def split_truncated(self, content, splittable=True):
+        """译文被截断说明预估偏低，按预估的一半重新切分；不能切分或没有可切分的句子边界时返回 [content]"""
+        chunks = split_text(content, estimate_output_tokens(content) // 2) if splittable else [content]
+        if len(chunks) == 1:
+            print("译文被截断且无法在句子边界切分，放大输出上限重新翻译")
+        return chunks
+
+    def record_split(self, chunks, label=""):
+        print(f"{label}片段过长，在句子边界切成 {len(chunks)} 块并发翻译")
+        self.metrics.record_split(len(chunks))
+
+    def join_chunks(self, content, results, label=""):
+        """按顺序拼接各块的译文，任意一块失败或拼接结果明显短于原文则整段失败"""
+        for tresult in results:
+            if not tresult.result:
+                return TranslationResult(False, tresult.errorcode, None)
+        translated_text = "".join(tresult.data for tresult in results)
+        if output_too_short(content, translated_text):
+            print(f"{label}切分翻译后拼接的译文明显短于原文，放弃这一段")
+            return TranslationResult(False, TranslationResult.INCOMPLETE, None)
+        # 各块由不同模型翻译时不记录模型，拼接的译文不写入翻译记忆
+        models = {tresult.model for tresult in results}
+        return TranslationResult(True, 0, translated_text, model=models.pop() if len(models) == 1 else None)
+
+    def translate_html_batch(self, texts, glossary=None, max_retries=3, nodes=None):
+        """把多段HTML打包成一个请求翻译，返回结果数量或格式不符时退回逐段翻译"""
+        results, requests = self.prepare_html_batch(texts, glossary, nodes)
+        if len(requests) > 1:
+            content = self.batch_request_content(requests)
+            tresult = self.chat_completion(self.batch_system_prompt(requests), content, max_retries, "批量HTML",
+                                           max_tokens=self.batch_max_tokens(content))
+            if self.apply_batch_response(tresult, results, requests):
+                requests = {}
+        for index, request in requests.items():
+            results[index] = self.complete_request(request, max_retries)
+        for index, tresult in enumerate(results):
+            if tresult.errorcode == TranslationResult.MASK_MISMATCH:
+                print("译文中的占位符无法还原，改为发送完整HTML重新翻译")
+                results[index] = self.translate_html(texts[index], glossary, max_retries,
+                                                       nodes[index] if nodes else None, mask=False)
+        return results
+
+    async def atranslate_html_batch(self, texts, glossary=None, max_retries=3, nodes=None):
+        """translate_html_batch 的异步版本"""
+        results, requests = self.prepare_html_batch(texts, glossary, nodes)
+        if len(requests) > 1:
+            content = self.batch_request_content(requests)
+            tresult = await self.achat_completion(self.batch_system_prompt(requests), content, max_retries, "批量HTML",
+                                                  max_tokens=self.batch_max_tokens(content))
+            if self.apply_batch_response(tresult, results, requests):
+                requests = {}
+        for index, request in requests.items():
+            results[index] = await self.acomplete_request(request, max_retries)
+        for index, tresult in enumerate(results):
+            if tresult.errorcode == TranslationResult.MASK_MISMATCH:
+                print("译文中的占位符无法还原，改为发送完整HTML重新翻译")
+                results[index] = await self.atranslate_html(texts[index], glossary, max_retries,
+                                                              nodes[index] if nodes else None, mask=False)
+        return results
+
+    def prepare_html_batch(self, texts, glossary=None, nodes=None):
+        """批量翻译的预处理：返回结果列表（需要调用API的位置为 None）和 {位置: 待发送请求}"""
+        results = [None] * len(texts)
+        requests = {}
+        for index, text in enumerate(texts):
+            tresult, request = self.prepare_html_request(text, glossary, nodes[index] if nodes else None)
+            if tresult is None:
+                tresult = self.lookup_cache(request)
+            if tresult is None:
+                requests[index] = request
+            else:
+                results[index] = tresult
+        return results, requests
+
+    def batch_system_prompt(self, requests):
+        """批量请求使用的系统提示，批中有遮蔽过的文本时说明占位符的规则"""
+        return self.html_batch_system_prompt(masked=any(request.masked is not None for request in requests.values()))
+
+    def batch_request_content(self, requests):
+        """把多个请求的内容编码为JSON数组"""
+        return json.dumps([request.content for request in requests.values()], ensure_ascii=False)
+
+    def batch_max_tokens(self, content):
+        """批量请求的输出token上限：按输入长度放大，但不超过常见模型的输出上限"""
+        return min(MAX_COMPLETION_TOKENS, max(self.max_output_tokens, 2 * estimate_tokens(content)))
+
+    def apply_batch_response(self, tresult, results, requests):
+        """校验批量翻译的返回结果并逐段写入 results，数量或格式不符时返回 False"""
+        translations = None
+        if tresult.result and tresult.data:
+            data = tresult.data.strip()
+            # 去掉模型可能包裹的代码块标记
+            fenced = re.match(r'^```(?:json)?\s*(.*?)\s*```$', data, re.S)
+            if fenced:
+                data = fenced.group(1)
             try:
-                if not self.check_string(preprocessed_text):
-                    print("不需要翻译！")
-                    return TranslationResult(True, 0, text)
-                
-                # 创建系统提示，添加背景信息
-                system_prompt = "我将发一段HTML代码给你，其中包含了英文文本，请根据具体情况翻译英文文本到中文，维持原有HTML格式。"
-                
-                # 如果有书籍背景信息，添加到系统提示中
-                if self.book_background:
-                    system_prompt += f"\n\n关于本书背景：{self.book_background}\n\n请根据上述背景信息进行专业、准确的翻译，同时保持HTML标签不变。"
-                
-                response = openai.ChatCompletion.create(
-                    model=self.model_name,
-                    messages=[
-                        {
-                            "role":"system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user", 
-                            "content": f"{preprocessed_text}"
-                        }
-                    ],
-                    max_tokens=1024,
-                    temperature=0.0,
-                    request_timeout=30  # 增加超时时间到30秒
-                )
-                
-                if response is None:
-                    print("翻译失败！")
-                    return text
-                    
-                translated_text = response.choices[0].message['content']
-                
-                # 每个请求后休息3秒，避免请求过于频繁
-                time.sleep(3)
-                
-                return TranslationResult(True, 0, translated_text)
+                translations = json.loads(data)
+            except ValueError:
+                translations = None
+        if (not isinstance(translations, list) or len(translations) != len(requests)
+                or not all(isinstance(translation, str) for translation in translations)):
+            print(f"批量翻译结果与 {len(requests)} 段原文不匹配，改为逐段翻译")
+            return False
+        for (index, request), translation in zip(requests.items(), translations):
+            results[index] = self.finish_request(request, TranslationResult(True, 0, translation, model=tresult.model))
+            self.store_cache(request, results[index])
+        return True
+
+    def create_http_client(self, connections, asynchronous=False):
+        """创建保持长连接的 httpx 客户端，连接池大小与并发数相当，避免每次请求重新握手"""
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        client_class = httpx.AsyncClient if asynchronous else httpx.Client
+        return client_class(limits=limits, timeout=self.timeout, http2=self.http2)
+
+    def create_api_client(self, connections, asynchronous=False, endpoint=None):
+        """创建绑定端点密钥和地址的API客户端，默认使用第一个端点；重试由 chat_completion 负责，客户端自身不重试"""
+        endpoint = endpoint or self.endpoints.primary
+        client_class = AsyncOpenAI if asynchronous else OpenAI
+        if self.hedge_policy is not None:
+            connections += self.hedge_policy.extra_connections(connections)
+        # 未配置密钥时推迟到调用时由服务端报错
+        return client_class(api_key=endpoint.api_key or "", base_url=endpoint.base_url or None, timeout=self.timeout,
+                            max_retries=0, http_client=self.create_http_client(connections, asynchronous))
+
+    def resize_client(self, connections):
+        """按工作线程数扩大各端点同步客户端的连接池，需要在工作线程启动前调用
+
+        其他端点被剔除时所有请求都会发往同一个端点，每个端点的连接池都按全部线程数设置。
+        """
+        connections = self.max_connections or connections
+        if self.pool_size and connections <= self.pool_size:
+            return
+        for endpoint in self.endpoints:
+            old_client = endpoint.client
+            endpoint.client = self.create_api_client(connections, endpoint=endpoint)
+            if old_client is not None:
+                old_client.close()
+        self.pool_size = connections
+
+    def close(self):
+        """关闭各端点API客户端的连接池"""
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+        if self.hedge_executor is not None:
+            self.hedge_executor.shutdown(wait=False)
+
+    def completion_params(self, system_prompt, content, max_tokens=None, model=None):
+        """构造聊天补全请求参数，model 为所选端点的模型"""
+        params = dict(
+            model=model or self.model_name,
+            messages=[
+                {
+                    "role":"system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user", 
+                    "content": f"{content}"
+                }
+            ],
+            max_tokens=max_tokens or self.max_output_tokens,
+            temperature=0.0
+        )
+        if self.stream_completions:
+            # 流式响应默认不带用量，要求服务端在最后一个分片中附带
+            params.update(stream=True, stream_options={"include_usage": True})
+        return params
+
+    def create_completion(self, params, endpoint):
+        """向端点发送请求；启用对冲时等待过久会向另一个端点再发送一份相同的请求
+
+        返回 ((译文, 结束原因, 用量), 给出结果的端点, 该请求自身的延迟)；对冲请求胜出时端点和延迟都是对冲请求的。
+        """
+        if self.hedge_policy is None:
+            return self.timed_completion(endpoint, params)
+        return self.hedged_completion(params, endpoint)
+
+    def timed_completion(self, endpoint, params, cancelled=None):
+        """向端点发送一次请求，返回 (结果, 端点, 延迟)"""
+        started = time.perf_counter()
+        output = self.read_completion(endpoint.client, params, cancelled)
+        return output, endpoint, time.perf_counter() - started
+
+    def read_completion(self, client, params, cancelled=None):
+        """发送一次请求并读取结果，流式请求逐块拼接；cancelled 被设置后提前关闭流式响应"""
+        if not params.get('stream'):
+            return completion_output(client.chat.completions.create(**params))
+        streamed = StreamedCompletion()
+        with client.chat.completions.create(**params) as stream:
+            for chunk in stream:
+                if cancelled is not None and cancelled.is_set():
+                    break
+                streamed.add(chunk)
+        return streamed.output()
+
+    def hedged_completion(self, params, endpoint):
+        """在当前线程发送请求，等待超过近期延迟的 p95 后在对冲线程池中再发送一份，返回先成功的结果
+
+        调用线程要等原请求返回才能继续，因此只对冲流式请求：对冲请求先成功时，原请求在读到下一个分片时关闭；
+        非流式请求无法中途放弃，直接发送不对冲。两份请求中先成功的一方在 lock 中设置 cancelled，另一方随后停止。
+        """
+        policy = self.hedge_policy
+        started = time.perf_counter()
+        delay = policy.delay() if params.get('stream') else None
+        if delay is None:
+            result = self.timed_completion(endpoint, params)
+            self.record_hedged(False, 0, started)
+            return result
+        
+        lock = threading.Lock()
+        cancelled = threading.Event()
+        hedges = []
+        
+        def send():
+            with lock:
+                if cancelled.is_set() or not policy.try_hedge():
+                    return
+                print(f"请求等待超过 {delay:.1f} 秒，发送对冲请求")
+                hedges.append(self.hedge_executor.submit(self.race_hedge, params, endpoint, cancelled, lock))
+        
+        timer = self.hedge_timer.schedule(delay, send)
+        error = None
+        try:
+            result = self.timed_completion(endpoint, params, cancelled)
+        except Exception as e:
+            error = e
+        with lock:
+            hedged = bool(hedges)
+            primary_won = error is None and not cancelled.is_set()
+            # 原请求成功时停止对冲请求；失败时不再发送对冲请求，但等待已经发出的那一份
+            if primary_won or not hedged:
+                cancelled.set()
+        self.hedge_timer.cancel(timer)
+        
+        if not primary_won:
+            if not hedged:
+                raise error
+            try:
+                result = hedges[0].result()
+            except Exception:
+                # 对冲请求也失败时按原请求的错误重试
+                if error is None:
+                    raise
+                raise error
+        self.record_hedged(hedged, 0 if primary_won else 1, started)
+        return result
+
+    def race_hedge(self, params, endpoint, cancelled, lock):
+        """发送对冲请求，先于原请求成功时设置 cancelled，让原请求停止读取"""
+        result = self.send_hedge(params, endpoint, cancelled)
+        with lock:
+            cancelled.set()
+        return result
+
+    def send_hedge(self, params, endpoint, cancelled):
+        """优先选择原请求之外的端点，按限流器的额度发送对冲请求，等待额度期间原请求已经返回时不再发送
+
+        对冲请求占用的端点在这里结束登记并记录延迟，胜出时调用方只把用量记在它名下。
+        """
+        other = self.endpoints.acquire(exclude=endpoint)
+        latency = None
+        failed = False
+        try:
+            tokens = self.estimate_params_tokens(params)
+            self.rate_limiter.acquire(tokens)
+            other.rate_limiter.acquire(tokens)
+            if cancelled.is_set():
+                return (None, None, None), other, None
+            output, _, elapsed = self.timed_completion(other, dict(params, model=other.model), cancelled)
+            # 落选后提前关闭的请求不代表端点的延迟
+            if not cancelled.is_set():
+                latency = elapsed
+            return output, other, elapsed
+        except Exception as e:
+            failed = classify_error(e)[0] == RETRYABLE
+            raise
+        finally:
+            self.endpoints.release(other, latency, failed)
+
+    def estimate_params_tokens(self, params):
+        messages = params['messages']
+        return self.estimate_request_tokens(messages[0]['content'], messages[-1]['content'])
+
+    def record_hedged(self, hedged, winner, started):
+        """记录从原请求发出到拿到结果的时间（对冲请求胜出时同样从原请求算起），发送过对冲请求时统计哪一份胜出"""
+        self.hedge_policy.record(time.perf_counter() - started)
+        if hedged:
+            self.metrics.record_hedge(won=winner > 0)
+
+    def chat_completion(self, system_prompt, content, max_retries=3, label="", max_tokens=None):
+        """调用OpenAI的API进行翻译，添加重试机制；失败的请求优先转到其他端点重试"""
+        estimated_tokens = self.estimate_request_tokens(system_prompt, content)
+        retry = self.retry_policy.start(max_retries)
+        started = time.perf_counter()
+        failed_endpoint = None
+        while True:
+            endpoint = self.endpoints.acquire(exclude=failed_endpoint)
+            try:
+                # 按共享限流器和端点自身的额度发送请求，额度充足时不等待
+                with self.profiler.span("rate_limit_wait"):
+                    self.rate_limiter.acquire(estimated_tokens)
+                    endpoint.rate_limiter.acquire(estimated_tokens)
+                self.retry_policy.record_attempt()
+                started = time.perf_counter()
+                with self.profiler.span("api_wait"):
+                    (translated_text, finish_reason, usage), answered, latency = self.create_completion(
+                        self.completion_params(system_prompt, content, max_tokens, endpoint.model), endpoint)
+                self.endpoint_succeeded(endpoint, answered, latency, usage, estimated_tokens)
+                return self.completion_result(translated_text, finish_reason, usage, estimated_tokens, latency,
+                                              retry.total, system_prompt, content, label, answered.model)
                 
             except Exception as e:
                 print("发生异常：", e)
-                error_msg = str(e).lower()
-                # 判断是否为超时异常
-                if "timeout" in error_msg or "timed out" in error_msg:
-                    retries += 1
-                    if retries <= max_retries:
-                        wait_time = 5  # 超时后等待5秒
-                        print(f"HTML请求超时，等待{wait_time}秒后重试 ({retries}/{max_retries})...")
-                        time.sleep(wait_time)
-                        continue  # 继续下一次重试
-                    else:
-                        print(f"HTML超过最大重试次数 ({max_retries})，放弃翻译")
+                wait_time = self.retry_delay(e, retry, label, endpoint)
+                if wait_time is None:
+                    traceback.print_exc()
+                    self.metrics.record_call(time.perf_counter() - started, retries=retry.total, ok=False)
+                    return TranslationResult(False, 1001, None)
+                failed_endpoint = endpoint
+                print(f"{label}等待{wait_time:.1f}秒后重试（第 {retry.total} 次）...")
+                time.sleep(wait_time)
+
+    async def achat_completion(self, system_prompt, content, max_retries=3, label="", max_tokens=None):
+        """chat_completion 的异步版本，等待期间不占用线程"""
+        estimated_tokens = self.estimate_request_tokens(system_prompt, content)
+        retry = self.retry_policy.start(max_retries)
+        started = time.perf_counter()
+        failed_endpoint = None
+        while True:
+            endpoint = self.endpoints.acquire(exclude=failed_endpoint)
+            try:
+                with self.profiler.span("rate_limit_wait"):
+                    await self.rate_limiter.acquire_async(estimated_tokens)
+                    await endpoint.rate_limiter.acquire_async(estimated_tokens)
+                self.retry_policy.record_attempt()
+                started = time.perf_counter()
+                with self.profiler.span("api_wait"):
+                    (translated_text, finish_reason, usage), answered, latency = await self.acreate_completion(
+                        self.completion_params(system_prompt, content, max_tokens, endpoint.model), endpoint)
+                self.endpoint_succeeded(endpoint, answered, latency, usage, estimated_tokens)
+                return self.completion_result(translated_text, finish_reason, usage, estimated_tokens, latency,
+                                              retry.total, system_prompt, content, label, answered.model)
                 
-                traceback.print_exc()
-                return TranslationResult(False, 1001, None)
+            except Exception as e:
+                print("发生异常：", e)
+                wait_time = self.retry_delay(e, retry, label, endpoint)
+                if wait_time is None:
+                    traceback.print_exc()
+                    self.metrics.record_call(time.perf_counter() - started, retries=retry.total, ok=False)
+                    return TranslationResult(False, 1001, None)
+                failed_endpoint = endpoint
+                print(f"{label}等待{wait_time:.1f}秒后重试（第 {retry.total} 次）...")
+                await asyncio.sleep(wait_time)
+
+    async def acreate_completion(self, params, endpoint):
+        """create_completion 的异步版本；启用对冲时等待超过近期延迟的 p95 后再发送一份，先成功的结果胜出，另一份被取消"""
+        if self.hedge_policy is None:
+            return await self.atimed_completion(endpoint, params)
+        policy = self.hedge_policy
+        started = time.perf_counter()
+        delay = policy.delay()
+        tasks = [asyncio.ensure_future(self.atimed_completion(endpoint, params))]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and policy.try_hedge():
+                    print(f"请求等待超过 {delay:.1f} 秒，发送对冲请求")
+                    tasks.append(asyncio.ensure_future(self.asend_hedge(params, endpoint)))
+            result, winner = await afirst_result(tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.record_hedged(len(tasks) > 1, winner, started)
+        return result
+
+    async def asend_hedge(self, params, endpoint):
+        """send_hedge 的异步版本，落选时任务被取消"""
+        other = self.endpoints.acquire(exclude=endpoint)
+        latency = None
+        failed = False
+        try:
+            tokens = self.estimate_params_tokens(params)
+            await self.rate_limiter.acquire_async(tokens)
+            await other.rate_limiter.acquire_async(tokens)
+            output, _, latency = await self.atimed_completion(other, dict(params, model=other.model))
+            return output, other, latency
+        except Exception as e:
+            failed = classify_error(e)[0] == RETRYABLE
+            raise
+        finally:
+            self.endpoints.release(other, latency, failed)
+
+    async def atimed_completion(self, endpoint, params):
+        """timed_completion 的异步版本"""
+        started = time.perf_counter()
+        output = await self.aendpoint_completion(endpoint, params)
+        return output, endpoint, time.perf_counter() - started
+
+    async def aendpoint_completion(self, endpoint, params):
+        """使用异步引擎为端点创建的共享客户端发送请求；在引擎之外单独调用时临时创建一个客户端"""
+        if endpoint.async_client is not None:
+            return await self.aread_completion(endpoint.async_client, params)
+        async with self.create_api_client(1, asynchronous=True, endpoint=endpoint) as client:
+            return await self.aread_completion(client, params)
+
+    async def aread_completion(self, client, params):
+        if not params.get('stream'):
+            return completion_output(await client.chat.completions.create(**params))
+        streamed = StreamedCompletion()
+        async with await client.chat.completions.create(**params) as stream:
+            async for chunk in stream:
+                streamed.add(chunk)
+        return streamed.output()
+
+    def completion_result(self, translated_text, finish_reason, usage, estimated_tokens, latency, retries,
+                          system_prompt, content, label="", model=None):
+        """记录一次完成的调用并转换为 TranslationResult，译文被截断时返回 TRUNCATED
+
+        model: 给出译文的端点的模型
+        """
+        if translated_text is None:
+            print("翻译失败！")
+            self.metrics.record_call(latency, retries=retries, ok=False)
+            return TranslationResult(False, 1001, None)
+        self.record_usage(usage, estimated_tokens)
+        self.record_call(usage, latency, retries, system_prompt, content, translated_text)
+        if finish_reason == "length":
+            print(f"{label}译文达到输出token上限被截断")
+            self.metrics.record_truncated()
+            return TranslationResult(False, TranslationResult.TRUNCATED, translated_text, model=model)
+        return TranslationResult(True, 0, translated_text, model=model)
+
+    def estimate_request_tokens(self, system_prompt, content):
+        """估算一次请求消耗的token数（输入加上大致等长的输出）"""
+        return estimate_tokens(system_prompt) + 2 * estimate_tokens(content)
+
+    def record_usage(self, usage, estimated_tokens):
+        """用响应中的实际token用量修正限流器"""
+        if usage is not None:
+            self.rate_limiter.record_usage(estimated_tokens, getattr(usage, 'total_tokens', None))
+
+    def record_call(self, usage, latency, retries, system_prompt, content, translated_text):
+        """记录一次成功调用的指标，服务端没有返回用量时按文本长度估算token数"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(content)
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(translated_text)
+        self.metrics.record_call(latency, prompt_tokens, completion_tokens, retries)
+
+    def endpoint_succeeded(self, endpoint, answered, latency, usage, estimated_tokens):
+        """请求成功：结束 endpoint 上登记的请求，并用实际token用量修正给出结果的端点的限流器
+
+        answered: 给出结果的端点；对冲请求胜出时是对冲请求的端点，它的登记和延迟已由对冲请求自己处理，
+            原请求落选，不计入 endpoint 的延迟
+        """
+        if answered is endpoint:
+            ejected = self.endpoints.release(endpoint, latency)
+        else:
+            ejected = self.endpoints.release(endpoint)
+        self.metrics.record_endpoint(answered.name, answered.model, ejected=ejected)
+        if usage is not None:
+            answered.rate_limiter.record_usage(estimated_tokens, getattr(usage, 'total_tokens', None))
+
+    def retry_delay(self, error, retry, label="", endpoint=None):
+        """按重试策略判断异常是否值得重试，返回重试前需要等待的秒数，不再重试时返回 None
+
+        retry: 本次调用的 RetryState
+        endpoint: 出错的端点，可重试的错误计入它的连续失败次数；还有其他健康端点时立即转到其他端点重试
+        """
+        kind, retry_after = classify_error(error)
+        pooled = endpoint is not None and len(self.endpoints) > 1
+        if endpoint is not None:
+            ejected = self.endpoints.release(endpoint, failed=kind == RETRYABLE)
+            if pooled and endpoint_error(error):
+                # 密钥、模型或额度只在这个端点上不可用，长时间剔除后换其他端点重试
+                ejected = self.endpoints.eject(endpoint, f"不可用（{type(error).__name__}）",
+                                               self.endpoints.max_eject_seconds)
+                kind = RETRYABLE
+            self.metrics.record_endpoint(endpoint.name, endpoint.model, ok=False, ejected=ejected)
+        wait_time = retry.next_delay(kind, retry_after)
+        if wait_time is None:
+            print(f"{label}{retry.reason}，放弃翻译")
+            self.metrics.record_retry(kind if kind == FATAL else "gave_up")
+            return None
+        self.metrics.record_retry(kind)
+        if kind == RATE_LIMITED:
+            pause = retry_after if retry_after is not None else wait_time
+            if pooled:
+                # 限流只针对这个端点的密钥：暂停该端点，其他端点继续处理请求
+                print(f"{label}端点 {endpoint.name} 请求被限流(429)，该端点暂停 {pause:.1f} 秒")
+                endpoint.rate_limiter.penalize(pause)
+                self.endpoints.eject(endpoint, "被限流(429)", pause)
+            else:
+                print(f"{label}请求被限流(429)，所有请求暂停 {pause:.1f} 秒")
+                # 让共享的限流器暂停所有请求，其他线程不会在暂停期间继续触发限流
+                self.rate_limiter.penalize(pause)
+        if pooled and self.endpoints.has_alternative(endpoint):
+            return 0.0
+        return wait_time
 
     def update_epub_title(self, epub_path, new_title):
         """更新EPUB标题"""
@@ -403,76 +1532,191 @@ class EpubTranslator:
         updated_book = epub.read_epub(epub_path)
         print("更新后的标题:", updated_book.get_metadata('DC', 'title')[0][0])
 
-    def worker(self, queue, output_epub, new_book, lock, glossary=None):
-        """线程工作函数，用于并行翻译"""
+    def segment_item(self, item):
+        """解析文档并切分出需要翻译的段落和引用块，没有可翻译内容时返回 None"""
+        if item.get_type() != ebooklib.ITEM_DOCUMENT:
+            return None
+        return self.segment_document(item)
+
+    def segment_document(self, item):
+        """segment_item 的切分部分，调用方已确认 item 是文档"""
+        with self.profiler.span("parse"):
+            soup = self.parse_document(item.get_content(), item.media_type)
+        nodes = []
+        for node in soup.find_all(["p", "blockquote"]):
+            # 包含段落的引用块由其中的段落分别翻译
+            if node.name == "blockquote" and node.find("p") is not None:
+                continue
+            nodes.append(node)
+        if not nodes:
+            return None
+        return DocumentJob(item, soup, nodes)
+
+    def parse_document(self, content, media_type=None):
+        """用配置的解析器解析整个章节；lxml-xml 只用于格式良好的 XHTML 章节，其余章节用 html.parser
+
+        media_type: 文档的媒体类型，text/html 文档不是XML，不使用 XML 解析器
+        """
+        if self.html_parser == 'lxml-xml' and media_type != 'text/html':
+            xml_content = well_formed_xhtml(content)
+            if xml_content is not None:
+                return BeautifulSoup(xml_content, 'lxml-xml')
+        return BeautifulSoup(content, 'html.parser')
+
+    def parse_fragment(self, text):
+        """解析模型返回的HTML片段
+
+        模型的输出不保证是合法的XML（例如 &nbsp;），所以片段统一用宽松的 html.parser，
+        它同时能正确处理 <span/> 这类自闭合写法。片段很短，解析开销可以忽略。
+        """
+        return BeautifulSoup(text, 'html.parser')
+
+    def translate_segment(self, segment, assembler, glossary=None):
+        """翻译一个片段，并在所属文档的所有片段完成后把文档交给输出装配器"""
+        chapter = current_chapter.set(segment.document.name)
         try:
-            while True:
-                if self.stop_event.is_set():
-                    break
-                item = queue.get()
-                if item is None:
-                    break
-                current_thread = threading.current_thread()
-                if item.get_type() == 4 or item.get_type() == 9:
-                    print(f"{current_thread.name} 正在处理 {item.file_name}")
-                self.translate_and_save_item(item, output_epub, new_book, lock, glossary)
-                queue.task_done()
-        except Exception as e:
-            print(f"{current_thread.name}发生异常")
-            traceback.print_exc()
-            queue.task_done()
-            quit()
+            print(f"翻前HTML ({segment.node.name})：", segment.source)
+            tresult = self.translate_html(segment.source, glossary, node=segment.node)
+            self.apply_segment_result(segment, tresult)
+        finally:
+            current_chapter.reset(chapter)
+            self.complete_segment(segment, assembler)
 
-    def translate_and_save_item(self, item, output_epub, new_book, lock, glossary=None):
-        """翻译并保存EPUB项目"""
-        if item.get_type() == 9:
-            soup = BeautifulSoup(item.get_content(), 'html.parser')
-            
-            # 处理段落标签
-            p_list = soup.findAll("p")
-            if len(p_list) > 0:
-                for p in p_list:
-                    if self.stop_event.is_set():
-                        break
-                    print("翻前HTML (p)：", p)
-                    tresult = self.translate_html(str(p), glossary)
-                    if tresult.result:
-                        translated_text = tresult.data
-                        newtag = BeautifulSoup(translated_text, 'html.parser').p
-                        p.replace_with(newtag)
-                        print(f"翻后HTML (p)：{newtag}")
-            
-            # 处理引用标签
-            blockquote_list = soup.findAll("blockquote")
-            if len(blockquote_list) > 0:
-                print(f"发现 {len(blockquote_list)} 个引用块需要翻译")
-                for blockquote in blockquote_list:
-                    if self.stop_event.is_set():
-                        break
-                    # 获取原始class属性
-                    original_class = blockquote.get('class', [])
-                    print("翻前HTML (blockquote)：", blockquote)
-                    tresult = self.translate_html(str(blockquote), glossary)
-                    if tresult.result:
-                        translated_text = tresult.data
-                        # 创建新的blockquote标签
-                        new_blockquote = BeautifulSoup(translated_text, 'html.parser').blockquote
-                        # 确保保留原始class属性
-                        if original_class and not new_blockquote.get('class'):
-                            new_blockquote['class'] = original_class
-                        blockquote.replace_with(new_blockquote)
-                        print(f"翻后HTML (blockquote)：{new_blockquote}")
-            
-            # 如果既没有段落也没有引用，直接添加
-            if len(p_list) == 0 and len(blockquote_list) == 0:
-                new_book.add_item(item)
-                return
-                
-            item.set_content(str(soup).encode('utf-8'))
-        new_book.add_item(item)
-        with lock:
-            epub_options = {'ignore_ncx': False}
-            epub.write_epub(output_epub, new_book, epub_options)
+    async def atranslate_segment(self, segment, assembler, glossary=None):
+        """translate_segment 的异步版本"""
+        chapter = current_chapter.set(segment.document.name)
+        try:
+            print(f"翻前HTML ({segment.node.name})：", segment.source)
+            tresult = await self.atranslate_html(segment.source, glossary, node=segment.node)
+            self.apply_segment_result(segment, tresult)
+        finally:
+            current_chapter.reset(chapter)
+            self.complete_segment(segment, assembler)
+
+    def group_segments(self, segments, batch_tokens=0):
+        """把同一文档中相邻的片段按token预算打包成批，batch_tokens 为0时每批只有一个片段"""
+        batches = []
+        batch, batch_size = [], 0
+        for segment in segments:
+            size = estimate_tokens(segment.source)
+            if batch and (batch_tokens <= 0 or batch_size + size > batch_tokens
+                          or segment.document is not batch[-1].document
+                          or segment.index != batch[-1].index + 1):
+                batches.append(batch)
+                batch, batch_size = [], 0
+            batch.append(segment)
+            batch_size += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def translate_batch(self, batch, assembler, glossary=None):
+        """翻译一批片段，只有一个片段时按单段请求发送"""
+        if len(batch) == 1:
+            self.translate_segment(batch[0], assembler, glossary)
+            return
+        chapter = current_chapter.set(batch[0].document.name)
+        try:
+            print(f"批量翻译 {batch[0].document.item.file_name} 中的 {len(batch)} 个片段")
+            results = self.translate_html_batch([segment.source for segment in batch], glossary,
+                                                nodes=[segment.node for segment in batch])
+            for segment, tresult in zip(batch, results):
+                self.apply_segment_result(segment, tresult)
+        finally:
+            current_chapter.reset(chapter)
+            for segment in batch:
+                self.complete_segment(segment, assembler)
+
+    async def atranslate_batch(self, batch, assembler, glossary=None):
+        """translate_batch 的异步版本"""
+        if len(batch) == 1:
+            await self.atranslate_segment(batch[0], assembler, glossary)
+            return
+        chapter = current_chapter.set(batch[0].document.name)
+        try:
+            print(f"批量翻译 {batch[0].document.item.file_name} 中的 {len(batch)} 个片段")
+            results = await self.atranslate_html_batch([segment.source for segment in batch], glossary,
+                                                       nodes=[segment.node for segment in batch])
+            for segment, tresult in zip(batch, results):
+                self.apply_segment_result(segment, tresult)
+        finally:
+            current_chapter.reset(chapter)
+            for segment in batch:
+                self.complete_segment(segment, assembler)
+
+    async def open_async_clients(self, stack, connections):
+        """在当前事件循环中为每个端点创建连接池大小与并发数相当的异步客户端
+
+        连接绑定在创建它的事件循环上，stack 关闭时关闭连接并清除端点上的引用。
+        """
+        for endpoint in self.endpoints:
+            endpoint.async_client = await stack.enter_async_context(
+                self.create_api_client(self.max_connections or connections, asynchronous=True, endpoint=endpoint))
+        stack.callback(self.clear_async_clients)
+
+    def clear_async_clients(self):
+        for endpoint in self.endpoints:
+            endpoint.async_client = None
+
+    def restore_segments(self, documents, journal, assembler):
+        """把片段日志中已完成的译文套用到文档上，返回仍需翻译的片段"""
+        pending = []
+        for document in documents:
+            for segment in document.segments:
+                data = journal.lookup(document.item.file_name, segment.index, segment.source_hash)
+                if data is None:
+                    pending.append(segment)
+                    continue
+                self.apply_segment_result(segment, TranslationResult(True, 0, data), record=False)
+                self.complete_segment(segment, assembler)
+        return pending
+
+    def translated_node(self, node, tresult):
+        """由翻译结果得到替换原节点的新节点，翻译失败或译文中缺少对应标签时返回 None"""
+        if not tresult.result:
+            return None
+        new_node = tresult.node
+        if new_node is None:
+            with self.profiler.span("parse_fragment"):
+                new_node = self.parse_fragment(tresult.data).find(node.name)
+        if new_node is None:
+            print(f"译文中缺少 <{node.name}> 标签，保留原文")
+            return None
+        # 确保保留原始class属性
+        original_class = node.get('class', [])
+        if original_class and not new_node.get('class'):
+            new_node['class'] = original_class
+        return new_node
+
+    def apply_segment_result(self, segment, tresult, record=True):
+        """把译文替换回文档，并把完成的片段追加到片段日志"""
+        node = segment.node
+        new_node = self.translated_node(node, tresult)
+        if new_node is not None:
+            with segment.document.lock:
+                node.replace_with(new_node)
+            print(f"翻后HTML ({node.name})：{new_node}")
+            if record and segment.document.journal is not None:
+                segment.document.journal.record(segment.document.item.file_name, segment.index,
+                                                segment.source_hash, str(new_node))
+        if record:
+            self.metrics.record_segment(new_node is not None)
+
+    def complete_segment(self, segment, assembler):
+        """标记片段完成，文档的所有片段都完成后交给输出装配器"""
+        if segment.document.finish_segment():
+            self.finish_document(segment.document, assembler)
+
+    def pending_segments(self, documents):
+        """统计尚未完成的片段数"""
+        return sum(document.pending for document in documents)
+
+    def finish_document(self, document, assembler):
+        """序列化翻译完成的文档并交给输出装配器"""
+        with self.profiler.span("serialize"):
+            document.item.set_content(str(document.soup).encode('utf-8'))
+        assembler.add_item(document.item)
+        print(f"文档翻译完成: {document.item.file_name}")
 
     def modify_links(self, item, glossary=None):
         """修改EPUB中的链接和目录项"""
@@ -529,184 +1773,718 @@ class EpubTranslator:
             
         return glossary
 
-    def load_checkpoint(self, input_file, output_file):
-        """加载翻译进度检查点"""
+    def open_journal(self, input_file, resume=True):
+        """打开片段日志；恢复时同时恢复书籍背景信息"""
         base_name = os.path.splitext(os.path.basename(input_file))[0]
-        checkpoint_file = self.CHECKPOINT_FILE.format(base_name)
+        journal = SegmentJournal(self.JOURNAL_FILE.format(base_name), resume=resume)
+        
+        # 恢复书籍背景信息，如果存在且本次没有另行指定
+        if journal.meta.get('book_background') and not self.book_background:
+            self.book_background = journal.meta['book_background']
+            print("已恢复书籍背景信息")
+        journal.write_meta(book_background=self.book_background)
+        return journal
+
+    def translate_epub(self, input_epub, output_epub=None, num_threads=5, user_glossary=None, resume=True, flush_interval=None,
+                       engine="threads", concurrency=50, batch_tokens=0, report_path=None, metrics_file=None, metrics_port=None,
+                       profile=False, profile_trace=None, profile_cprofile=None, progress_callback=None, pool=None):
+        """翻译EPUB文件
+
+        flush_interval: 定期把已完成项目写出到输出文件的间隔（秒），None 表示只在结束时写出一次
+        engine: "threads" 使用 num_threads 个工作线程；"async" 使用异步引擎，最多同时发出 concurrency 个请求
+        batch_tokens: 大于0时把同一文档中相邻的段落按该token预算打包成一个请求
+        report_path: 运行结束时写出的JSON报告路径，默认保存在临时目录
+        metrics_file: 运行期间定期写出 Prometheus 文本格式指标的文件路径
+        metrics_port: 在该端口上提供 Prometheus 格式的 /metrics 端点
+        profile: 统计读取、目录、解析、词汇表、等待API、写出等各阶段的耗时，结束时输出汇总
+        profile_trace: 写出 Chrome trace 文件的路径（隐含 profile）
+        profile_cprofile: 写出合并了所有线程的 cProfile 结果的路径（隐含 profile）
+        progress_callback: 每秒以 (已完成片段数, 总片段数, 预计剩余秒数或 None) 调用一次，用于界面显示进度；
+            从其他线程调用 stop_event.set() 可以取消翻译，已完成的片段保留在片段日志中
+        pool: 与其他翻译任务共用的 SegmentPool，提供时片段由它的工作线程翻译，忽略 engine / num_threads / concurrency
+            （cProfile 不覆盖共用工作池的线程）
+        """
+        if output_epub is None:
+            output_epub = input_epub.replace('.epub', '_cn.epub')
         
-        if os.path.exists(checkpoint_file):
+        book = None
+        with self.run_session(input_epub, report_path, metrics_file, metrics_port, profile, profile_trace,
+                              profile_cprofile):
             try:
-                with open(checkpoint_file, 'rb') as f:
-                    checkpoint_data = pickle.load(f)
-                    print(f"已加载断点，已完成项 {checkpoint_data['completed_items']} 个")
+                book = self.open_book(input_epub, output_epub, user_glossary, resume, flush_interval, batch_tokens)
+                
+                with self.worker_pool(pool, engine, num_threads, concurrency) as pool:
+                    # 所有批次一次性提交给工作池
+                    self.submit_book(pool, book)
                     
-                    # 恢复书籍背景信息，如果存在
-                    if 'book_background' in checkpoint_data and checkpoint_data['book_background']:
-                        self.book_background = checkpoint_data['book_background']
-                        print("已恢复书籍背景信息")
+                    # 检查是否所有任务已完成
+                    documents, total_segments = book.documents, book.total_segments
+                    all_tasks_completed = self.pending_segments(documents) == 0
+                    while not all_tasks_completed:
+                        try:
+                            time.sleep(1)  # 短暂睡眠，允许主线程检查 KeyboardInterrupt
+                            
+                            completed = total_segments - self.pending_segments(documents)
+                            eta = self.estimate_eta(completed - book.restored_segments, total_segments - completed,
+                                                    book.started)
+                            if progress_callback is not None:
+                                progress_callback(completed, total_segments, eta)
+                            
+                            # 定期报告进度（完成的片段已实时写入片段日志）
+                            if self.progress_due(metrics_file):
+                                eta_text = f"，预计剩余 {eta:.0f} 秒" if eta is not None else ""
+                                print(f"翻译进度: {completed}/{total_segments} 个片段{eta_text}")
+                            
+                            # 按设定间隔把已完成的项目落盘
+                            book.assembler.maybe_flush()
+                            
+                            all_tasks_completed = self.pending_segments(documents) == 0
+                            if self.stop_event.is_set() and not all_tasks_completed:
+                                print("翻译已取消，已完成的片段已保存在片段日志中...")
+                                break
+                        except KeyboardInterrupt:
+                            print("侦测到Ctrl+C，正在退出，已完成的片段已保存在片段日志中...")
+                            # 通知跳过本次运行还没有开始的工作
+                            self.stop_event.set()
+                            break
+                            
+                    if progress_callback is not None:
+                        progress_callback(total_segments - self.pending_segments(documents), total_segments,
+                                          0 if all_tasks_completed else None)
+                    print("进入退出程序...")
+                
+                # 本次运行提交的工作都结束后一次性写出EPUB文件
+                result = self.close_book(book, all_tasks_completed)
+                print("退出程序执行完毕...")
+                
+                # 返回输出文件路径、临时目录路径和永久存储路径
+                return result
                         
-                    return checkpoint_data
-            except Exception as e:
-                print(f"加载断点出错: {e}")
+            except KeyboardInterrupt:
+                print("主线程侦测到Ctrl+C，正在退出...")
+                self.stop_event.set()
+                if book is not None:
+                    book.assembler.flush()
+                    book.journal.close()
+                return output_epub, None, None
+
+    @contextlib.contextmanager
+    def run_session(self, input_epub, report_path=None, metrics_file=None, metrics_port=None, profile=False,
+                    profile_trace=None, profile_cprofile=None):
+        """一次运行共用的准备和收尾，参数与 translate_epub 的同名参数相同
+
+        重新统计指标和重试预算，启动耗时分析和指标端点；退出时（包括中断和出错时）输出翻译记忆命中情况，
+        写出运行报告和耗时分析，再停止指标端点。报告和耗时汇总的默认文件名取自 input_epub。
+        """
+        self.metrics = RunMetrics()
+        self.retry_policy.reset()
+        self.profiler = StageProfiler(profile, trace=bool(profile_trace), cprofile=bool(profile_cprofile))
+        self.profiler.start()
+        self.last_progress_report = time.time()
+        with self.metrics.serve(metrics_port):
+            try:
+                yield
+            finally:
+                if self.translation_memory is not None:
+                    print(f"翻译记忆命中 {self.translation_memory.hits} 次，未命中 {self.translation_memory.misses} 次")
+                self.write_run_report(input_epub, report_path, metrics_file)
+                self.write_profile(input_epub, profile_trace, profile_cprofile)
+                self.profiler.stop()
+
+    def progress_due(self, metrics_file=None):
+        """距上次输出进度超过 PROGRESS_INTERVAL 秒时返回 True，同时刷新 Prometheus 指标文件"""
+        if time.time() - self.last_progress_report <= self.PROGRESS_INTERVAL:
+            return False
+        self.last_progress_report = time.time()
+        if metrics_file:
+            self.metrics.write_prometheus(metrics_file)
+        return True
+
+    def open_book_state(self, input_epub, user_glossary=None, resume=True):
+        """加载词汇表（并编译匹配器）和片段日志，返回 (词汇表, 片段日志)"""
+        with self.profiler.span("glossary_load"):
+            glossary = self.load_glossary(input_epub, user_glossary)
+            if glossary:
+                # 整个运行期间只编译一次词汇表
+                self.glossary_matcher(glossary)
         
-        return {
-            'completed_items': 0,
-            'processed_ids': set(),
-            'book_data': None,
-            'book_background': self.book_background  # 保存书籍背景信息
-        }
+        # 打开片段日志，恢复时跳过已经完成的段落
+        journal = self.open_journal(input_epub, resume)
+        return glossary, journal
 
-    def save_checkpoint(self, checkpoint_data, input_file):
-        """保存翻译进度检查点"""
-        base_name = os.path.splitext(os.path.basename(input_file))[0]
-        checkpoint_file = self.CHECKPOINT_FILE.format(base_name)
+    def open_book(self, input_epub, output_epub, user_glossary=None, resume=True, flush_interval=None, batch_tokens=0,
+                  chapter_prefix=""):
+        """读取一本书：加载词汇表和片段日志，翻译目录，切分文档并套用日志中已完成的片段
+
+        返回 BookJob，其中的批次还没有提交给工作池。chapter_prefix 用于在指标中区分不同书的章节。
+        """
+        glossary, journal = self.open_book_state(input_epub, user_glossary, resume)
+        
+        epub_options = {'ignore_ncx': False}
+        with self.profiler.span("epub_read"):
+            book = read_epub(input_epub, epub_options)
+        new_book = epub.EpubBook()
+        new_book.metadata = book.metadata
+        new_book.spine = book.spine
+        
+        # 遍历现有的 TOC并翻译
+        print(f"开始翻译目录")
+        with self.profiler.span("toc"):
+            new_toc = [self.modify_links(link, glossary) for link in book.toc]
+        # 更新书籍的 TOC
+        new_book.toc = tuple(new_toc)
+        new_book.set_language('zh-cn')
+        
+        assembler = EpubAssembler(new_book, output_epub, flush_interval=flush_interval, profiler=self.profiler)
+
+        # 预先把所有文档切分成段落级任务，统一交给工作池
+        documents = []
+        for item in book.get_items():
+            document = self.segment_item(item)
+            if document is None:
+                # 图片、样式表以及没有可翻译内容的文档直接交给装配器
+                assembler.add_item(item)
+            else:
+                document.journal = journal
+                document.name = chapter_prefix + document.name
+                documents.append(document)
+        total_segments = sum(len(document.segments) for document in documents)
+        print(f"共切分出 {total_segments} 个待翻译片段，来自 {len(documents)} 个文档")
         
-        # 保存书籍背景信息
-        checkpoint_data['book_background'] = self.book_background
+        # 日志中已有的片段直接套用译文，不再提交翻译
+        with self.profiler.span("journal_restore"):
+            pending = self.restore_segments(documents, journal, assembler)
+        if len(pending) < total_segments:
+            print(f"从片段日志恢复了 {total_segments - len(pending)} 个片段，剩余 {len(pending)} 个")
         
-        with open(checkpoint_file, 'wb') as f:
-            pickle.dump(checkpoint_data, f)
-        print(f"已保存断点，已完成项 {checkpoint_data['completed_items']} 个")
+        batches = self.group_segments(pending, batch_tokens)
+        if batch_tokens > 0:
+            print(f"批量模式: {len(pending)} 个片段打包为 {len(batches)} 个请求")
+        return BookJob(input_epub, output_epub, glossary, journal, assembler, documents, batches)
+
+    @contextlib.contextmanager
+    def worker_pool(self, pool=None, engine="threads", num_threads=5, concurrency=50):
+        """提供本次运行翻译片段的工作池，退出时等待本翻译器提交的工作全部结束
+
+        pool: 与其他翻译任务共用的 SegmentPool；为 None 时按 engine / num_threads / concurrency
+            创建本次运行自己的工作池，退出时关闭
+        """
+        owned = pool is None
+        if owned:
+            pool = SegmentPool(engine, num_threads, concurrency, wrap_thread=self.profiler.wrap_thread)
+        pool.attach(self)
+        try:
+            yield pool
+        except BaseException:
+            # 中断或出错时跳过本翻译器还没有开始的工作，不必等它们全部翻译完
+            self.stop_event.set()
+            raise
+        finally:
+            if owned:
+                pool.close()
+            else:
+                pool.release(self)
+
+    def submit_book(self, pool, book):
+        """把一本书尚未提交的批次全部交给工作池，同一本书的批次作为一个轮转单位"""
+        work = book.next_work()
+        while work is not None:
+            pool.submit(self, work, key=book)
+            work = book.next_work()
 
-    def translate_epub(self, input_epub, output_epub=None, num_threads=5, user_glossary=None, resume=True):
-        """翻译EPUB文件"""
+    def close_book(self, book, completed):
+        """写出一本书：未完成的文档按当前进度写出，全部完成时删除片段日志并复制到永久目录
+
+        返回 (输出文件路径, 临时目录路径, 永久存储路径)
+        """
+        # 中途停止时，未全部完成的文档按当前进度写出
+        for document in book.documents:
+            if not document.finished:
+                self.finish_document(document, book.assembler)
+        book.assembler.flush()
+        return self.finish_output(book.input_epub, book.output_epub, book.journal, completed)
+
+    def finish_output(self, input_epub, output_epub, journal, completed):
+        """输出文件写出后结束片段日志：全部完成时删除日志并把输出文件复制到永久目录，否则保留日志以便继续
+
+        返回 (输出文件路径, 临时目录路径, 永久存储路径)
+        """
+        if completed:
+            journal.remove()
+            print("翻译完成，已删除片段日志")
+        else:
+            journal.close()
+        
+        # 将翻译好的文件复制到TMP_DIR目录
+        tmp_output_path = None
+        translated_file_path = None
+        if os.path.exists(output_epub) and completed:
+            try:
+                # 创建目标文件名
+                base_name = os.path.splitext(os.path.basename(input_epub))[0]
+                # 临时目录版本
+                tmp_file_name = f"{base_name}_cn_{int(time.time())}.epub"
+                tmp_output_path = os.path.join(self.TMP_DIR, tmp_file_name)
+                
+                # 永久存储版本 
+                perm_file_name = f"{base_name}_cn_{int(time.time())}.epub"
+                translated_file_path = os.path.join(self.TRANSLATED_FILES_DIR, perm_file_name)
+                
+                # 复制文件到永久位置
+                shutil.copy2(output_epub, translated_file_path)
+                print(f"已将翻译结果保存到永久目录: {translated_file_path}")
+            except Exception as e:
+                print(f"复制文件时出错: {e}")
+                traceback.print_exc()
+        return output_epub, tmp_output_path, translated_file_path
+
+    def translate_epub_streaming(self, input_epub, output_epub=None, num_threads=5, user_glossary=None, resume=True,
+                                 engine="threads", concurrency=50, batch_tokens=0, max_open_documents=4,
+                                 report_path=None, metrics_file=None, metrics_port=None, profile=False,
+                                 profile_trace=None, profile_cprofile=None, progress_callback=None):
+        """流式翻译EPUB：逐个条目读取源压缩包，翻译完成的文档立即写入输出
+
+        同一时间只有 max_open_documents 个文档被解析并保留在内存中，其余条目直接从源压缩包复制，
+        峰值内存取决于并发数和打开的文档数，而不是整本书的大小。目录（NCX 和导航文档）中的标题
+        单独翻译，OPF 中的语言改为中文。progress_callback 以 (已完成文档数, 文档总数, 预计剩余秒数) 调用。
+        报告、指标和耗时分析的参数与 translate_epub 相同，返回值也与 translate_epub 相同。
+        """
         if output_epub is None:
             output_epub = input_epub.replace('.epub', '_cn.epub')
+        
+        completed = False
+        with self.run_session(input_epub, report_path, metrics_file, metrics_port, profile, profile_trace,
+                              profile_cprofile):
+            glossary, journal = self.open_book_state(input_epub, user_glossary, resume)
+            with EpubArchive(input_epub) as archive, EpubWriter(output_epub) as writer:
+                assembler = StreamingAssembler(writer, self.profiler)
+                documents = [item for item in archive.documents() if not item.is_nav]
+                document_names = {item.zip_name for item in documents}
             
-        try:
-            # 加载或创建词汇表
-            glossary = self.load_glossary(input_epub, user_glossary)
-            
-            # 加载断点
-            checkpoint = None
-            if resume:
-                checkpoint = self.load_checkpoint(input_epub, output_epub)
-            
-            # 如果没有断点或不需要恢复，重新开始
-            if not checkpoint or not resume or not checkpoint['book_data']:
-                print("从头开始翻译...")
-                epub_options = {'ignore_ncx': False}
-                book = epub.read_epub(input_epub, epub_options)
-                new_book = epub.EpubBook()
-                new_book.metadata = book.metadata
-                new_book.spine = book.spine
-                
-                # 遍历现有的 TOC并翻译
+                # 目录和元数据先写出，图片、样式表、字体等条目原样复制
                 print(f"开始翻译目录")
-                new_toc = [self.modify_links(link, glossary) for link in book.toc]
-                # 更新书籍的 TOC
-                new_book.toc = tuple(new_toc)
-                new_book.set_language('zh-cn')
-                
-                # 创建新的断点数据
-                checkpoint = {
-                    'completed_items': 0,
-                    'processed_ids': set(),
-                    'book_data': {
-                        'items': list(book.get_items()),
-                        'total_items': len(list(book.get_items()))
-                    }
-                }
-                
-                # 保存初始断点
-                self.save_checkpoint(checkpoint, input_epub)
-            else:
-                print(f"从断点恢复翻译，已完成 {checkpoint['completed_items']}/{checkpoint['book_data']['total_items']} 项...")
-                new_book = epub.read_epub(output_epub)
+                with self.profiler.span("toc"):
+                    self.write_streaming_metadata(archive, writer, glossary)
+                for info in archive.entries():
+                    if info.filename not in document_names:
+                        writer.copy(archive, info)
             
-            queue = Queue()
-            lock = threading.Lock()
-            threads = []
+                waiting = deque(documents)
+                open_documents = []
+                with self.worker_pool(None, engine, num_threads, concurrency) as pool:
+                    started = time.time()
+                    while waiting or open_documents:
+                        try:
+                            # 打开的文档不足 max_open_documents 个时解析下一个并把它的批次交给工作池
+                            while waiting and len(open_documents) < max_open_documents:
+                                document, pending = self.open_streaming_document(archive, waiting.popleft(), journal,
+                                                                                 assembler)
+                                if document is None:
+                                    continue
+                                open_documents.append(document)
+                                for batch in self.group_segments(pending, batch_tokens):
+                                    pool.submit(self, (batch, assembler, glossary))
+                            open_documents = [document for document in open_documents if not document.finished]
+                        
+                            done = len(documents) - len(waiting) - len(open_documents)
+                            if progress_callback is not None:
+                                progress_callback(done, len(documents), self.estimate_eta(done, len(documents) - done, started))
+                            if self.progress_due(metrics_file):
+                                print(f"翻译进度: {done}/{len(documents)} 个文档，"
+                                      f"{self.pending_segments(open_documents)} 个片段正在翻译")
+                            if self.stop_event.is_set():
+                                print("翻译已取消，已完成的片段已保存在片段日志中...")
+                                break
+                            if open_documents:
+                                time.sleep(0.1)
+                        except KeyboardInterrupt:
+                            print("侦测到Ctrl+C，正在退出，已完成的片段已保存在片段日志中...")
+                            self.stop_event.set()
+                            break
+                    completed = not waiting and not open_documents
+                    print("进入退出程序...")
             
-            # 创建工作线程
-            for _index in range(num_threads):
-                thread = threading.Thread(target=self.worker, args=(queue, output_epub, new_book, lock, glossary), name="Thread-"+_index.__str__())
-                thread.start()
-                threads.append(thread)
-
-            # 添加未处理的项目到队列
-            for item in checkpoint['book_data']['items']:
-                if item.id not in checkpoint['processed_ids']:
-                    queue.put(item)
-                
-            # 检查是否所有任务已完成
-            checkpoint_save_interval = 5  # 每5秒保存一次断点
-            last_checkpoint_save = time.time()
+                # 中途停止时，打开的文档按当前进度写出，还没有打开的文档保留原文
+                for document in open_documents:
+                    if not document.finished:
+                        self.finish_document(document, assembler)
+                for item in waiting:
+                    writer.copy(archive, archive.zip.getinfo(item.zip_name))
+            print(f"已写出EPUB文件: {output_epub}")
+            return self.finish_output(input_epub, output_epub, journal, completed)
+
+    def open_streaming_document(self, archive, manifest_item, journal, assembler):
+        """读取并切分一个文档，套用片段日志中已完成的片段
+
+        返回 (DocumentJob, 待翻译的片段)；没有可翻译内容的文档直接原样写出，返回 (None, None)
+        """
+        # 与 epub.read_epub 一样以OPF中的相对路径作为文档名，片段日志在两种模式之间通用
+        item = epub.EpubItem(uid=manifest_item.id, file_name=unquote(manifest_item.href),
+                             media_type=manifest_item.media_type, content=archive.read(manifest_item.zip_name))
+        item.zip_name = manifest_item.zip_name
+        document = self.segment_document(item)
+        if document is None:
+            assembler.add_item(item)
+            return None, None
+        document.journal = journal
+        with self.profiler.span("journal_restore"):
+            pending = self.restore_segments([document], journal, assembler)
+        return document, pending
+
+    def write_streaming_metadata(self, archive, writer, glossary=None):
+        """写出语言改为中文的OPF，以及标题已翻译的NCX和导航文档"""
+        titles = {}
+        
+        def translate_title(title):
+            # NCX 和导航文档中的标题相同，只翻译一次
+            if title not in titles:
+                tresult = self.translate_text(title, glossary)
+                titles[title] = tresult.data if tresult.result else title
+                print(f"翻译完成： {titles[title]}")
+            return titles[title]
+        
+        opf = archive.read(archive.opf_path).decode('utf-8')
+        opf = re.sub(r'(<dc:language[^>]*>)[^<]*(</dc:language>)', r'\1zh-cn\2', opf)
+        writer.write(archive.opf_path, opf.encode('utf-8'))
+        
+        ncx_item = archive.find(NCX_MEDIA_TYPE)
+        if ncx_item is not None:
+            ncx = archive.read(ncx_item.zip_name).decode('utf-8')
+            ncx = re.sub(r'(<navLabel>\s*<text>)(.*?)(</text>)',
+                         lambda match: match.group(1) + xml_escape(translate_title(html.unescape(match.group(2))))
+                         + match.group(3), ncx, flags=re.S)
+            writer.write(ncx_item.zip_name, ncx.encode('utf-8'))
+        
+        nav_item = archive.find(nav=True)
+        if nav_item is not None:
+            soup = self.parse_document(archive.read(nav_item.zip_name), nav_item.media_type)
+            for nav in soup.find_all("nav"):
+                for label in nav.find_all(["a", "span"]):
+                    if label.string and label.string.strip():
+                        label.string.replace_with(translate_title(label.string.strip()))
+            writer.write(nav_item.zip_name, str(soup).encode('utf-8'))
+
+    def translate_directory(self, input_dir, output_dir=None, num_threads=5, user_glossary=None, resume=True,
+                            engine="threads", concurrency=50, batch_tokens=0, max_open_books=4, report_path=None,
+                            metrics_file=None, metrics_port=None):
+        """批量翻译目录中的所有EPUB，所有书共用一个工作池、限流器和翻译记忆
+
+        最多同时有 max_open_books 本书的批次在工作池中排队，各书的批次按轮转顺序领取，
+        一本书的批次全部被领取后就打开下一本，使工作池始终保持饱和；每本书完成后立即写出。
+        结束时在输出目录写出每本书的状态汇总，返回汇总列表。
+        """
+        names = sorted(name for name in os.listdir(input_dir)
+                       if name.lower().endswith('.epub') and not name.lower().endswith('_cn.epub'))
+        output_dir = output_dir or input_dir
+        os.makedirs(output_dir, exist_ok=True)
+        print(f"批量翻译 {input_dir} 中的 {len(names)} 本书，输出到 {output_dir}")
+        
+        waiting = deque(names)
+        active = []
+        statuses = {name: {'input': os.path.join(input_dir, name), 'output': None, 'status': 'waiting',
+                           'segments': 0, 'completed_segments': 0, 'restored_segments': 0, 'seconds': None, 'error': None}
+                    for name in names}
+        with self.run_session(os.path.join(input_dir, "batch.epub"), report_path, metrics_file, metrics_port):
+            try:
+                with self.worker_pool(None, engine, num_threads, concurrency) as pool:
+                    while waiting or active:
+                        if self.stop_event.is_set():
+                            break
+                        
+                        # 还有批次在排队的书不足 max_open_books 本时打开下一本，
+                        # 各书的批次在工作池中按轮转顺序领取，打开新书期间工作线程也不会闲下来
+                        while waiting and sum(1 for book in active if pool.queued(book)) < max_open_books:
+                            name = waiting.popleft()
+                            status = statuses[name]
+                            status['output'] = os.path.join(output_dir, name[:-len('.epub')] + '_cn.epub')
+                            try:
+                                book = self.open_book(status['input'], status['output'], user_glossary, resume,
+                                                      batch_tokens=batch_tokens, chapter_prefix=f"{name}/")
+                            except Exception as e:
+                                print(f"打开 {name} 失败: {e}")
+                                traceback.print_exc()
+                                status.update(status='failed', error=str(e))
+                                continue
+                            book.name = name
+                            status.update(status='running', segments=book.total_segments,
+                                          restored_segments=book.restored_segments)
+                            active.append(book)
+                            self.submit_book(pool, book)
+                        
+                        # 完成的书立即写出
+                        for book in [book for book in active if self.pending_segments(book.documents) == 0]:
+                            active.remove(book)
+                            self.finish_batch_book(book, statuses[book.name], True)
+                        
+                        if self.progress_due(metrics_file):
+                            finished = sum(1 for status in statuses.values()
+                                           if status['status'] in ('completed', 'failed'))
+                            progress = ", ".join(f"{book.name} {book.total_segments - self.pending_segments(book.documents)}"
+                                                 f"/{book.total_segments}" for book in active)
+                            print(f"批量进度: 已完成 {finished}/{len(names)} 本；进行中: {progress}")
+                        time.sleep(0.2)
+            except KeyboardInterrupt:
+                print("侦测到Ctrl+C，正在退出，已完成的片段已保存在片段日志中...")
+                self.stop_event.set()
+            finally:
+                # 工作池关闭后，未完成的书按当前进度写出，片段日志保留以便下次继续
+                for book in active:
+                    self.finish_batch_book(book, statuses[book.name], self.pending_segments(book.documents) == 0)
+            
+            summary = list(statuses.values())
+            summary_path = os.path.join(output_dir, self.BATCH_SUMMARY_FILE)
+            with open(summary_path, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            counts = Counter(status['status'] for status in summary)
+            print("批量翻译结束: " + "，".join(f"{key} {value} 本" for key, value in counts.items()))
+            print(f"每本书的状态已保存到: {summary_path}")
+        return summary
+
+    def finish_batch_book(self, book, status, completed):
+        """写出批量模式中的一本书并更新其状态"""
+        try:
+            self.close_book(book, completed)
+            status['status'] = 'completed' if completed else 'incomplete'
+        except Exception as e:
+            print(f"写出 {book.name} 失败: {e}")
+            traceback.print_exc()
+            status.update(status='failed', error=str(e))
+        status['completed_segments'] = book.total_segments - self.pending_segments(book.documents)
+        status['seconds'] = round(time.time() - book.started, 1)
+        print(f"{book.name}: {status['status']}，{status['completed_segments']}/{book.total_segments} 个片段，"
+              f"用时 {status['seconds']} 秒")
+
+    def book_id(self, input_epub):
+        """任务库中书籍的标识：文件名加内容指纹，不同机器上同一本书得到相同的标识"""
+        digest = hashlib.sha1()
+        with open(input_epub, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        base_name = os.path.splitext(os.path.basename(input_epub))[0]
+        return f"{base_name}-{digest.hexdigest()[:12]}"
+
+    def translate_epub_distributed(self, input_epub, job_store, output_epub=None, user_glossary=None, resume=True,
+                                   lease_seconds=300, poll_interval=2, progress_callback=None):
+        """协调模式：把片段写入共享任务库，由任意数量的 --worker 进程翻译，全部完成后组装EPUB
+
+        协调进程在读取书籍时自己调用API翻译目录标题，因此同样需要API配置；
+        正文片段全部由工作进程翻译，协调进程定期收集写回的译文，套用到文档并追加到本地片段日志，
+        因此协调进程中断后重新运行也能从日志和任务库中已有的译文继续。
+        返回值与 translate_epub 相同。
+        """
+        if output_epub is None:
+            output_epub = input_epub.replace('.epub', '_cn.epub')
+        self.metrics = RunMetrics()
+        self.retry_policy.reset()
+        store = JobStore(job_store, lease_seconds=lease_seconds)
+        book = None
+        completed = False
+        try:
+            book = self.open_book(input_epub, output_epub, user_glossary, resume)
+            book_id = self.book_id(input_epub)
+            pending = {(segment.document.item.file_name, segment.index): segment
+                       for batch in book.batches for segment in batch}
+            store.add_book(book_id, os.path.basename(input_epub), book.glossary, self.book_background,
+                           [(doc, index, segment.source_hash, segment.node.name, segment.source)
+                            for (doc, index), segment in pending.items()], resume=resume)
+            print(f"已把 {len(pending)} 个片段写入任务库 {job_store}（书籍标识 {book_id}），等待工作进程翻译...")
             
-            all_tasks_completed = False
-            while not all_tasks_completed:
+            self.last_progress_report = time.time()
+            while pending:
                 try:
-                    time.sleep(1)  # 短暂睡眠，允许主线程检查 KeyboardInterrupt
+                    for doc, index, status, result in store.collect(book_id):
+                        segment = pending.pop((doc, index), None)
+                        if segment is None:
+                            # 本地片段日志中已经有的片段
+                            continue
+                        if status == JobStore.DONE and result:
+                            tresult = TranslationResult(True, 0, result)
+                        else:
+                            print(f"片段 {doc}#{index} 多次翻译失败，保留原文")
+                            tresult = TranslationResult(False, 0, None)
+                        self.apply_segment_result(segment, tresult)
+                        self.complete_segment(segment, book.assembler)
                     
-                    # 定期保存断点
-                    if time.time() - last_checkpoint_save > checkpoint_save_interval:
-                        checkpoint['completed_items'] = checkpoint['book_data']['total_items'] - queue.unfinished_tasks
-                        self.save_checkpoint(checkpoint, input_epub)
-                        last_checkpoint_save = time.time()
-                    
-                    all_tasks_completed = queue.unfinished_tasks == 0
+                    done = book.total_segments - len(pending)
+                    if progress_callback is not None:
+                        eta = self.estimate_eta(done - book.restored_segments, len(pending), book.started)
+                        progress_callback(done, book.total_segments, eta)
+                    if self.progress_due():
+                        counts = store.progress(book_id)
+                        print(f"翻译进度: {done}/{book.total_segments} 个片段，"
+                              f"工作进程处理中 {counts[JobStore.LEASED]} 个，排队 {counts[JobStore.PENDING]} 个")
+                    book.assembler.maybe_flush()
+                    if not pending or self.stop_event.wait(poll_interval):
+                        break
                 except KeyboardInterrupt:
-                    print("侦测到Ctrl+C，正在保存断点并退出...")
-                    checkpoint['completed_items'] = checkpoint['book_data']['total_items'] - queue.unfinished_tasks
-                    self.save_checkpoint(checkpoint, input_epub)
-                    # 通知终止所有子线程的操作
+                    print("侦测到Ctrl+C，正在退出，工作进程会继续翻译，重新运行即可继续收集...")
                     self.stop_event.set()
                     break
-                    
-            print("进入退出程序...")
-            # 最终保存断点
-            if not all_tasks_completed:
-                checkpoint['completed_items'] = checkpoint['book_data']['total_items'] - queue.unfinished_tasks
-                self.save_checkpoint(checkpoint, input_epub)
-                
-            for _ in threads:
-                queue.put(None)
-            for thread in threads:
-                thread.join()
-            print("退出程序执行完毕...")
-            
-            # 如果全部完成，可以删除断点文件
-            if all_tasks_completed:
-                base_name = os.path.splitext(os.path.basename(input_epub))[0]
-                checkpoint_file = self.CHECKPOINT_FILE.format(base_name)
-                if os.path.exists(checkpoint_file):
-                    os.remove(checkpoint_file)
-                    print("翻译完成，已删除断点文件")
             
-            # 将翻译好的文件复制到TMP_DIR目录
-            tmp_output_path = None
-            translated_file_path = None
-            if os.path.exists(output_epub) and all_tasks_completed:
+            completed = not pending
+            result = self.close_book(book, completed)
+            if completed:
+                store.remove_book(book_id)
+            print(f"已收集 {book.total_segments - len(pending)}/{book.total_segments} 个片段")
+            return result
+        finally:
+            store.close()
+
+    def run_worker(self, job_store, worker_id=None, num_threads=5, lease_size=4, lease_seconds=300, poll_interval=5,
+                   idle_exit=None):
+        """工作模式：从共享任务库领取片段翻译并写回译文，可以在多台机器上同时运行
+
+        num_threads 个线程各自领取 lease_size 个片段；后台线程每隔租约时长的三分之一续约一次，
+        进程崩溃时租约过期后片段由其他工作进程重新领取。没有可领取的片段时每 poll_interval 秒检查一次，
+        idle_exit 不为 None 时空闲超过该秒数后退出。
+        """
+        worker_id = worker_id or default_worker_id()
+        store = JobStore(job_store, lease_seconds=lease_seconds)
+        stop_heartbeat = threading.Event()
+        
+        def heartbeat():
+            while not stop_heartbeat.wait(lease_seconds / 3):
                 try:
-                    # 创建目标文件名
-                    base_name = os.path.splitext(os.path.basename(input_epub))[0]
-                    # 临时目录版本
-                    tmp_file_name = f"{base_name}_cn_{int(time.time())}.epub"
-                    tmp_output_path = os.path.join(self.TMP_DIR, tmp_file_name)
-                    
-                    # 永久存储版本 
-                    perm_file_name = f"{base_name}_cn_{int(time.time())}.epub"
-                    translated_file_path = os.path.join(self.TRANSLATED_FILES_DIR, perm_file_name)
-                    
-                    # 复制文件到永久位置
-                    shutil.copy2(output_epub, translated_file_path)
-                    print(f"已将翻译结果保存到永久目录: {translated_file_path}")
+                    store.renew(worker_id)
                 except Exception as e:
-                    print(f"复制文件时出错: {e}")
-                    traceback.print_exc()
-                    
-            # 返回输出文件路径、临时目录路径和永久存储路径
-            return output_epub, tmp_output_path, translated_file_path
-                    
+                    print(f"续约失败: {e}")
+        
+        self.resize_client(num_threads)
+        heartbeat_thread = threading.Thread(target=heartbeat, name="LeaseHeartbeat", daemon=True)
+        heartbeat_thread.start()
+        print(f"工作进程 {worker_id} 已启动，任务库: {job_store}")
+        idle_since = None
+        try:
+            while not self.stop_event.is_set():
+                book = store.next_book()
+                if book is None:
+                    idle_since = idle_since or time.time()
+                    if idle_exit is not None and time.time() - idle_since >= idle_exit:
+                        print("任务库中没有待翻译的片段，退出")
+                        break
+                    self.stop_event.wait(poll_interval)
+                    continue
+                idle_since = None
+                
+                print(f"开始翻译 {book['name']} 的片段")
+                self.book_background = book['book_background']
+                glossary = book['glossary']
+                if glossary:
+                    self.glossary_matcher(glossary)
+                threads = [threading.Thread(target=self.profiler.wrap_thread(self.lease_worker),
+                                            args=(store, book['id'], worker_id, glossary, lease_size),
+                                            name="Thread-" + str(index))
+                           for index in range(num_threads)]
+                for thread in threads:
+                    thread.start()
+                try:
+                    while any(thread.is_alive() for thread in threads):
+                        time.sleep(1)  # 短暂睡眠，允许主线程检查 KeyboardInterrupt
+                except KeyboardInterrupt:
+                    print("侦测到Ctrl+C，等待正在进行的请求完成后退出...")
+                    self.stop_event.set()
+                for thread in threads:
+                    thread.join()
         except KeyboardInterrupt:
-            print("主线程侦测到Ctrl+C，正在退出...")
-            checkpoint['completed_items'] = checkpoint['book_data']['total_items'] - queue.unfinished_tasks
-            self.save_checkpoint(checkpoint, input_epub)
-            for _ in threads:
-                queue.put(None)
-            for thread in threads:
-                thread.join()
-            return output_epub, None, None
+            self.stop_event.set()
+        finally:
+            stop_heartbeat.set()
+            released = store.release(worker_id)
+            if released:
+                print(f"已把 {released} 个未完成的片段放回任务库")
+            store.close()
+        report = self.metrics.report()
+        print(f"工作进程 {worker_id} 退出，共翻译 {report['segments']} 个片段，API调用 {report['api_calls']} 次")
+
+    def lease_worker(self, store, book_id, worker_id, glossary, lease_size=4):
+        """工作模式的线程函数：循环领取片段、翻译并写回，直到这本书没有可领取的片段"""
+        while not self.stop_event.is_set():
+            rows = store.lease(book_id, worker_id, lease_size)
+            if not rows:
+                return
+            for doc, index, tag, source in rows:
+                if self.stop_event.is_set():
+                    # 剩余的片段在退出时放回任务库
+                    return
+                chapter = current_chapter.set(doc)
+                new_node = None
+                try:
+                    print(f"翻前HTML ({tag})：", source)
+                    node = self.parse_fragment(source).find(tag)
+                    if node is not None:
+                        new_node = self.translated_node(node, self.translate_html(source, glossary, node=node))
+                except Exception:
+                    print(f"翻译片段时发生异常: {doc}#{index}")
+                    traceback.print_exc()
+                finally:
+                    current_chapter.reset(chapter)
+                if new_node is None:
+                    store.fail(book_id, doc, index)
+                else:
+                    print(f"翻后HTML ({tag})：{new_node}")
+                    store.complete(book_id, doc, index, str(new_node))
+                self.metrics.record_segment(new_node is not None)
+
+    def estimate_eta(self, translated, remaining, started):
+        """按本次运行已翻译片段的速度估算剩余秒数，还没有完成任何片段时返回 None"""
+        elapsed = time.time() - started
+        if translated <= 0 or elapsed <= 0:
+            return None
+        return remaining * elapsed / translated
+
+    def write_profile(self, input_epub, trace_path=None, cprofile_path=None):
+        """输出各阶段耗时汇总，并按需写出 Chrome trace 和 cProfile 文件"""
+        if not self.profiler.enabled:
+            return
+        self.profiler.stop()
+        base_name = os.path.splitext(os.path.basename(input_epub))[0]
+        summary_path = os.path.join(self.TMP_DIR, f"{base_name}_profile.json")
+        try:
+            print("各阶段耗时：")
+            print(self.profiler.format_summary())
+            self.profiler.write_summary(summary_path)
+            print(f"耗时汇总已保存到: {summary_path}")
+            if trace_path:
+                self.profiler.write_trace(trace_path)
+                print(f"Chrome trace 已保存到: {trace_path}")
+            if cprofile_path and self.profiler.write_cprofile(cprofile_path):
+                print(f"cProfile 结果已保存到: {cprofile_path}")
+        except Exception as e:
+            print(f"写出耗时分析出错: {e}")
+
+    def write_run_report(self, input_epub, report_path=None, metrics_file=None):
+        """写出本次运行的JSON报告（以及最终的 Prometheus 指标文件），返回报告路径"""
+        if report_path is None:
+            base_name = os.path.splitext(os.path.basename(input_epub))[0]
+            report_path = os.path.join(self.TMP_DIR, f"{base_name}_report.json")
+        try:
+            self.metrics.write_report(report_path)
+            if metrics_file:
+                self.metrics.write_prometheus(metrics_file)
+        except Exception as e:
+            print(f"写出运行报告出错: {e}")
+            return None
+        report = self.metrics.report()
+        latency = report['latency_seconds']
+        if latency['p50'] is not None:
+            print(f"API调用 {report['api_calls']} 次，延迟 p50 {latency['p50']:.2f}s / p95 {latency['p95']:.2f}s / "
+                  f"p99 {latency['p99']:.2f}s，每分钟 {report['segments_per_minute']} 个片段")
+        classifier = report['classifier']
+        print(f"发送前分类: 跳过 {classifier['skip']} 个，只替换术语 {classifier['glossary_only']} 个，"
+              f"需要翻译 {classifier['translate']} 个，节省 {classifier['requests_saved']} 次请求")
+        hedging = report['hedging']
+        if hedging['hedged']:
+            print(f"对冲请求: {hedging['hedged']} 次，其中 {hedging['hedge_wins']} 次对冲请求先返回")
+        retry = report['retry_policy']
+        if any(retry.values()):
+            print(f"重试: 可重试错误 {retry['retryable']} 次，限流 {retry['rate_limited']} 次，"
+                  f"放弃 {retry['gave_up']} 次，不可重试 {retry['fatal']} 次")
+        splits = report['splits']
+        if splits['segments'] or splits['truncated_calls']:
+            print(f"过长片段: 切分 {splits['segments']} 个（共 {splits['chunks']} 块），"
+                  f"译文被截断 {splits['truncated_calls']} 次")
+        print(f"运行报告已保存到: {report_path}")
+        return report_path
 
     def export_glossary_to_excel(self, glossary, base_filename=None):
         """将词汇表导出为Excel文件，保存在临时目录中"""
@@ -740,8 +2518,8 @@ class EpubTranslator:
             traceback.print_exc()
             return None
             
-    def export_terms_to_excel(self, terms, translations=None, base_filename=None):
-        """将提取的专有名词列表导出为Excel文件，可选添加已有的翻译"""
+    def export_terms_to_excel(self, terms, translations=None, base_filename=None, stats=None):
+        """将提取的专有名词列表导出为Excel文件，可选添加已有的翻译和出现次数统计"""
         if pd is None:
             print("错误: 无法导出Excel文件，pandas库未安装")
             return None
@@ -762,6 +2540,10 @@ class EpubTranslator:
                 "专有名词": terms,
                 "中文翻译": [translations_dict.get(term, "") for term in terms]
             }
+            if stats:
+                data["出现次数"] = [stats[term]["count"] for term in terms]
+                data["首次出现"] = [stats[term]["first_seen"]["doc"] for term in terms]
+                data["上下文"] = [stats[term]["first_seen"]["context"] for term in terms]
             
             # 创建DataFrame
             df = pd.DataFrame(data)
@@ -780,37 +2562,102 @@ class EpubTranslator:
 if __name__ == '__main__':
     # 创建命令行参数解析器
     parser = argparse.ArgumentParser(description='翻译 EPUB 文件从英文到中文')
-    parser.add_argument('input_file', help='输入的 EPUB 文件路径')
+    parser.add_argument('input_file', nargs='?', help='输入的 EPUB 文件路径')
+    parser.add_argument('--batch', metavar='DIR', help='批量翻译目录中的所有 EPUB，共用工作池、限流器和翻译记忆；--output 指定输出目录')
+    parser.add_argument('--max-open-books', type=int, default=4, help='批量模式中同时有批次排队的书籍数 (默认: 4)')
+    parser.add_argument('--job-store', help='共享任务库(SQLite)路径；指定输入文件时作为协调进程把片段写入任务库并等待工作进程翻译')
+    parser.add_argument('--worker', action='store_true', help='作为工作进程从 --job-store 领取片段翻译，可在多台机器上同时运行')
+    parser.add_argument('--worker-id', help='工作进程标识 (默认: 主机名-进程号)')
+    parser.add_argument('--lease-size', type=int, default=4, help='工作进程每个线程每次领取的片段数 (默认: 4)')
+    parser.add_argument('--lease-seconds', type=float, default=300, help='片段租约时长，工作进程崩溃后超过该时间片段重新排队 (默认: 300)')
+    parser.add_argument('--idle-exit', type=float, default=None, help='工作进程空闲超过该秒数后退出 (默认: 一直等待)')
     parser.add_argument('--output', '-o', help='输出的 EPUB 文件路径 (默认为输入文件名_cn.epub)')
     parser.add_argument('--threads', '-t', type=int, default=5, help='使用的线程数 (默认: 5)')
     parser.add_argument('--glossary', '-g', help='使用的词汇表文件路径 (JSON 格式)')
     parser.add_argument('--no-resume', action='store_true', help='禁用断点续传')
     parser.add_argument('--extract-terms', action='store_true', help='仅提取专有名词并保存')
     parser.add_argument('--export-excel', action='store_true', help='导出专有名词为Excel格式')
+    parser.add_argument('--min-freq', type=int, default=1, help='提取专有名词时的最少出现次数 (默认: 1)')
+    parser.add_argument('--term-workers', type=int, default=None, help='提取专有名词的进程数 (默认: CPU核心数)')
     parser.add_argument('--export-glossary', action='store_true', help='导出当前词汇表为Excel格式')
+    parser.add_argument('--stream', action='store_true', help='流式模式：逐个条目读写EPUB，内存占用不随书籍大小增长')
+    parser.add_argument('--max-open-documents', type=int, default=4, help='流式模式中同时解析并保留在内存中的文档数 (默认: 4)')
+    parser.add_argument('--flush-interval', type=float, default=None, help='定期写出已完成内容的间隔秒数 (默认: 仅在结束时写出)')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads', help='翻译引擎: threads 为多线程, async 为异步并发 (默认: threads)')
+    parser.add_argument('--concurrency', '-c', type=int, default=50, help='异步引擎的最大并发请求数 (默认: 50)')
+    parser.add_argument('--batch-tokens', type=int, default=0, help='把相邻段落按该token预算打包成一个请求 (默认: 0，不打包)')
+    parser.add_argument('--parser', choices=HTML_PARSERS, default=None,
+                        help='解析章节使用的解析器 (默认: 安装了 lxml 时为 lxml-xml，不是格式良好的 XHTML 的章节仍用 html.parser)')
+    parser.add_argument('--rpm', type=float, default=None, help='每分钟最多请求数 (默认读取 RATE_LIMIT_RPM，未设置则不限)')
+    parser.add_argument('--tpm', type=float, default=None, help='每分钟最多token数 (默认读取 RATE_LIMIT_TPM，未设置则不限)')
+    parser.add_argument('--report', help='运行报告(JSON)的保存路径 (默认保存在 tmp 目录)')
+    parser.add_argument('--metrics-file', help='运行期间定期写出 Prometheus 文本格式指标的文件路径')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在该端口提供 Prometheus 格式的 /metrics 端点')
+    parser.add_argument('--profile', action='store_true', help='统计各阶段耗时并在结束时输出汇总')
+    parser.add_argument('--profile-trace', help='写出 Chrome trace 文件的路径 (隐含 --profile)')
+    parser.add_argument('--profile-cprofile', help='写出 cProfile 结果的路径 (隐含 --profile)')
+    parser.add_argument('--http2', action='store_true', default=None, help='使用 HTTP/2 连接API (需要安装 h2)')
+    parser.add_argument('--max-connections', type=int, default=None, help='API连接池大小 (默认: 与线程数或并发数相同)')
+    parser.add_argument('--connect-timeout', type=float, default=None, help='建立连接的超时秒数 (默认读取 CONNECT_TIMEOUT，未设置为 10)')
+    parser.add_argument('--read-timeout', type=float, default=None, help='等待响应的超时秒数 (默认读取 READ_TIMEOUT，未设置为 30)')
+    parser.add_argument('--retry-budget', type=float, default=None, help='可重试错误的重试次数占请求数的比例上限 (默认读取 RETRY_BUDGET，未设置为 0.2)')
+    parser.add_argument('--hedge', action='store_true', default=None, help='请求等待超过近期延迟的 p95 时再发送一份相同的请求，先返回的结果胜出')
+    parser.add_argument('--hedge-max-fraction', type=float, default=None, help='被对冲的请求占全部请求的比例上限 (默认读取 HEDGE_MAX_FRACTION，未设置为 0.05)')
+    parser.add_argument('--endpoints', help='端点配置JSON文件，每个端点有自己的密钥、地址、模型和限流额度 (默认读取 ENDPOINTS_FILE)')
+    parser.add_argument('--no-stream-completions', action='store_true', help='一次性接收完整响应，不使用流式响应')
+    parser.add_argument('--max-output-tokens', type=int, default=None, help='单次请求的输出token上限，预计超过的片段在句子边界切分 (默认读取 MAX_OUTPUT_TOKENS，未设置为 1024)')
+    parser.add_argument('--no-mask', action='store_true', help='发送完整HTML，不把行内标签替换为占位符')
+    parser.add_argument('--no-cache', action='store_true', help='禁用持久化翻译记忆')
+    parser.add_argument('--cache-path', help='翻译记忆数据库路径 (默认保存在 tmp 目录)')
+    parser.add_argument('--cache-size-mb', type=float, default=200, help='翻译记忆容量上限，单位MB (默认: 200)')
     
     args = parser.parse_args()
     
     input_file = args.input_file
-    if not input_file.endswith('.epub'):
+    if args.worker:
+        if not args.job_store:
+            print("--worker 需要通过 --job-store 指定任务库。")
+            sys.exit(1)
+    elif args.batch:
+        if not os.path.isdir(args.batch):
+            print("--batch 必须是一个目录。")
+            sys.exit(1)
+    elif not input_file or not input_file.endswith('.epub'):
         print("输入文件必须是 EPUB 文件。")
         sys.exit(1)
     
     # 设置输出文件路径
-    output_file = args.output if args.output else input_file.replace('.epub', '_cn.epub')
+    output_file = args.output if args.output or args.batch or args.worker else input_file.replace('.epub', '_cn.epub')
     
     # 创建翻译器实例
-    translator = EpubTranslator()
+    translator = EpubTranslator(use_cache=not args.no_cache, cache_path=args.cache_path, cache_max_mb=args.cache_size_mb,
+                                requests_per_minute=args.rpm, tokens_per_minute=args.tpm, html_parser=args.parser,
+                                mask_markup=not args.no_mask, max_connections=args.max_connections, http2=args.http2,
+                                connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                                stream_completions=False if args.no_stream_completions else None,
+                                max_output_tokens=args.max_output_tokens,
+                                retry_policy=RetryPolicy(budget_ratio=args.retry_budget) if args.retry_budget is not None else None,
+                                hedge=args.hedge, hedge_max_fraction=args.hedge_max_fraction,
+                                endpoints=load_endpoints(args.endpoints) if args.endpoints else None)
+    
+    if args.worker:
+        translator.run_worker(args.job_store, worker_id=args.worker_id, num_threads=args.threads,
+                              lease_size=args.lease_size, lease_seconds=args.lease_seconds, idle_exit=args.idle_exit)
+        sys.exit(0)
     
     # 如果只是提取专有名词
-    if args.extract_terms:
-        terms, excel_path = translator.extract_terms(input_file, export_excel=args.export_excel)
+    if args.extract_terms and not args.batch:
+        terms, excel_path, term_stats = translator.extract_terms(input_file, export_excel=args.export_excel,
+                                                                 min_freq=args.min_freq, workers=args.term_workers)
         # 保存为 JSON 文件
         base_name = os.path.splitext(os.path.basename(input_file))[0]
         terms_file = f"{base_name}_terms.json"
         with open(terms_file, 'w', encoding='utf-8') as f:
             json.dump(terms, f, ensure_ascii=False, indent=2)
-        print(f"已提取 {len(terms)} 个可能的专有名词并保存到 {terms_file}")
+        stats_file = f"{base_name}_term_stats.json"
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(term_stats, f, ensure_ascii=False, indent=2)
+        print(f"已提取 {len(terms)} 个可能的专有名词并保存到 {terms_file}，出现次数统计保存到 {stats_file}")
         if excel_path:
             print(f"已导出专有名词到Excel: {excel_path}")
         sys.exit(0)
@@ -834,14 +2681,76 @@ if __name__ == '__main__':
             print(f"加载词汇表出错: {e}")
             sys.exit(1)
     
+    if args.batch:
+        summary = translator.translate_directory(
+            args.batch,
+            args.output,
+            num_threads=args.threads,
+            user_glossary=user_glossary,
+            resume=not args.no_resume,
+            engine=args.engine,
+            concurrency=args.concurrency,
+            batch_tokens=args.batch_tokens,
+            max_open_books=args.max_open_books,
+            report_path=args.report,
+            metrics_file=args.metrics_file,
+            metrics_port=args.metrics_port
+        )
+        sys.exit(0 if all(status['status'] == 'completed' for status in summary) else 1)
+    
+    if args.job_store:
+        print("开始协调翻译...")
+        translate_result = translator.translate_epub_distributed(
+            input_file,
+            args.job_store,
+            output_file,
+            user_glossary=user_glossary,
+            resume=not args.no_resume,
+            lease_seconds=args.lease_seconds
+        )
+        output_path, tmp_output_path, translated_file_path = translate_result
+        print(f"输出文件: {output_path}")
+        if translated_file_path:
+            print(f"永久存储文件: {translated_file_path}")
+        sys.exit(0)
+    
     print("开始翻译...")
-    translate_result = translator.translate_epub(
-        input_file, 
-        output_file, 
-        num_threads=args.threads, 
-        user_glossary=user_glossary, 
-        resume=not args.no_resume
-    )
+    if args.stream:
+        translate_result = translator.translate_epub_streaming(
+            input_file,
+            output_file,
+            num_threads=args.threads,
+            user_glossary=user_glossary,
+            resume=not args.no_resume,
+            engine=args.engine,
+            concurrency=args.concurrency,
+            batch_tokens=args.batch_tokens,
+            max_open_documents=args.max_open_documents,
+            report_path=args.report,
+            metrics_file=args.metrics_file,
+            metrics_port=args.metrics_port,
+            profile=args.profile,
+            profile_trace=args.profile_trace,
+            profile_cprofile=args.profile_cprofile
+        )
+    else:
+        translate_result = translator.translate_epub(
+            input_file, 
+            output_file, 
+            num_threads=args.threads, 
+            user_glossary=user_glossary, 
+            resume=not args.no_resume,
+            flush_interval=args.flush_interval,
+            engine=args.engine,
+            concurrency=args.concurrency,
+            batch_tokens=args.batch_tokens,
+            report_path=args.report,
+            metrics_file=args.metrics_file,
+            metrics_port=args.metrics_port,
+            profile=args.profile,
+            profile_trace=args.profile_trace,
+            profile_cprofile=args.profile_cprofile
+        )
     
     # 解包返回值
     output_path, tmp_output_path, translated_file_path = translate_result
@@ -0,0 +1,151 @@
+import json
+import os
+from collections import deque
+
+
+class GlossaryMatcher:
+    """把词汇表编译成 Aho–Corasick 自动机
+
+    编译一次后，对任意文本只需扫描一遍即可找出所有术语，
+    并按“最左最长”的规则不重叠地替换，代价与词汇表大小无关。
+    """
+    # 编译结果的格式版本，结构变化时递增，使旧的缓存文件失效
+    FORMAT_VERSION = 2
+    # 缓存文件中保存的编译结果
+    TABLES = ('goto', 'fail', 'term_length', 'dict_link', 'translation')
+
+    def __init__(self, glossary):
+        # 状态转移表、失败指针、以该状态结尾的术语长度（0表示不是术语结尾）、
+        # 沿失败链能到达的下一个术语结尾状态、术语对应的译文
+        self.goto = [{}]
+        self.fail = [0]
+        self.term_length = [0]
+        self.dict_link = [0]
+        self.translation = [None]
+        self.size = 0
+
+        for term, translation in glossary.items():
+            if term:
+                self._add(term, translation)
+        self._build()
+
+    def _add(self, term, translation):
+        state = 0
+        for char in term:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.term_length.append(0)
+                self.dict_link.append(0)
+                self.translation.append(None)
+            state = next_state
+        self.term_length[state] = len(term)
+        self.translation[state] = translation
+        self.size += 1
+
+    def _build(self):
+        """按广度优先顺序计算失败指针和输出链"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                fail_state = self.fail[next_state]
+                self.dict_link[next_state] = fail_state if self.term_length[fail_state] else self.dict_link[fail_state]
+
+    def find(self, text):
+        """返回文本中所有术语出现的位置 [(起点, 长度, 状态)]，可能互相重叠"""
+        goto, fail, term_length, dict_link = self.goto, self.fail, self.term_length, self.dict_link
+        matches = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            output = state if term_length[state] else dict_link[state]
+            while output:
+                length = term_length[output]
+                matches.append((index - length + 1, length, output))
+                output = dict_link[output]
+        return matches
+
+    def replace(self, text):
+        """按最左最长规则替换文本中的术语，返回 (替换后的文本, 被替换的术语列表)"""
+        if not self.size or not text:
+            return text, []
+        matches = self.find(text)
+        if not matches:
+            return text, []
+        matches.sort(key=lambda match: (match[0], -match[1]))
+
+        pieces = []
+        replaced = []
+        position = 0
+        for start, length, state in matches:
+            if start < position:
+                continue
+            pieces.append(text[position:start])
+            pieces.append(self.translation[state])
+            replaced.append((text[start:start + length], self.translation[state]))
+            position = start + length
+        pieces.append(text[position:])
+        return "".join(pieces), replaced
+
+    def to_tables(self):
+        """编译结果的可序列化形式"""
+        tables = {name: getattr(self, name) for name in self.TABLES}
+        tables['size'] = self.size
+        return tables
+
+    @classmethod
+    def from_tables(cls, tables):
+        """从 to_tables 的结果恢复匹配器，不重新编译；表的结构不一致时抛出 ValueError"""
+        matcher = cls.__new__(cls)
+        for name in cls.TABLES:
+            setattr(matcher, name, tables[name])
+        matcher.size = tables['size']
+        states = len(matcher.goto)
+        if not states or any(len(getattr(matcher, name)) != states for name in cls.TABLES):
+            raise ValueError("词汇表匹配器缓存的状态表长度不一致")
+        return matcher
+
+    @classmethod
+    def load_or_build(cls, glossary, version, cache_dir=None):
+        """从缓存目录加载已编译的自动机，不存在时编译并保存，供之后的运行复用
+
+        缓存以 JSON 保存状态表，加载时不执行任何代码，缓存目录被他人写入也只会导致重新编译。
+        """
+        cache_file = None
+        if cache_dir and version:
+            cache_file = os.path.join(cache_dir, f"glossary_{version}.v{cls.FORMAT_VERSION}.ac.json")
+            if os.path.exists(cache_file):
+                try:
+                    with open(cache_file, 'r', encoding='utf-8') as f:
+                        cached = json.load(f)
+                    if cached.get('version') != version:
+                        raise ValueError("词汇表指纹不一致")
+                    matcher = cls.from_tables(cached['tables'])
+                    print(f"已加载编译好的词汇表匹配器，包含 {matcher.size} 个词条")
+                    return matcher
+                except Exception as e:
+                    print(f"加载词汇表匹配器缓存出错，重新编译: {e}")
+
+        matcher = cls(glossary)
+        print(f"已编译词汇表匹配器，包含 {matcher.size} 个词条")
+        if cache_file:
+            try:
+                tmp_file = cache_file + ".tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump({'version': version, 'tables': matcher.to_tables()}, f, ensure_ascii=False)
+                os.replace(tmp_file, cache_file)
+            except Exception as e:
+                print(f"保存词汇表匹配器缓存出错: {e}")
+        return matcher
@@ -0,0 +1,100 @@
+"""对冲请求：请求等待时间超过近期延迟的高分位数时再发送一份相同的请求，先返回的结果胜出
+
+少数请求的延迟远高于中位数，而章节要等最慢的段落完成才能写出，这些长尾决定了整体耗时。
+对冲请求只在等待已经超过 p95 时发出，并限制被对冲请求的比例，额外的调用成本有上限。
+"""
+import collections
+import heapq
+import itertools
+import math
+import threading
+import time
+import traceback
+
+from run_metrics import percentile
+
+
+class HedgePolicy:
+    """根据近期延迟决定何时发送对冲请求
+
+    window: 计算分位数使用的最近请求数
+    quantile: 等待超过该分位数的延迟后发送对冲请求
+    max_fraction: 被对冲的请求占全部请求的比例上限
+    min_samples: 样本数不足时不对冲，避免按不可靠的分位数频繁对冲
+    min_delay: 对冲前至少等待的秒数
+    """
+    def __init__(self, window=500, quantile=0.95, max_fraction=0.05, min_samples=20, min_delay=0.5):
+        self.quantile = quantile
+        self.max_fraction = max_fraction
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.cached_delay = None
+        self.requests = 0
+        self.hedged = 0
+
+    def record(self, latency):
+        """记录一次请求从发出到拿到结果的时间"""
+        with self.lock:
+            self.latencies.append(latency)
+            self.cached_delay = None
+
+    def delay(self):
+        """登记一次请求并返回发送对冲请求前的等待秒数，样本不足时返回 None（不对冲）"""
+        with self.lock:
+            self.requests += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            if self.cached_delay is None:
+                self.cached_delay = max(self.min_delay, percentile(sorted(self.latencies), self.quantile))
+            return self.cached_delay
+
+    def try_hedge(self):
+        """对冲比例未超过上限时登记一次对冲并返回 True"""
+        with self.lock:
+            if self.hedged + 1 > self.max_fraction * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def extra_connections(self, connections):
+        """对冲请求需要的额外连接数，连接池按此扩大，对冲请求不必等待空闲连接"""
+        return max(1, math.ceil(connections * self.max_fraction))
+
+
+class HedgeTimer:
+    """在一个后台线程中按到期时间调用回调，所有请求共用，不必为每个请求占用一个等待线程"""
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.entries = []
+        self.counter = itertools.count()
+        self.thread = None
+
+    def schedule(self, delay, callback):
+        """delay 秒后在后台线程中调用 callback，返回可以传给 cancel 的句柄"""
+        entry = [time.monotonic() + delay, next(self.counter), callback]
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="HedgeTimer", daemon=True)
+                self.thread.start()
+            heapq.heappush(self.entries, entry)
+            self.cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        """取消还没有到期的回调"""
+        with self.cond:
+            entry[2] = None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.entries or self.entries[0][0] > time.monotonic():
+                    self.cond.wait(self.entries[0][0] - time.monotonic() if self.entries else None)
+                _deadline, _index, callback = heapq.heappop(self.entries)
+            if callback is not None:
+                try:
+                    callback()
+                except Exception:
+                    traceback.print_exc()
@@ -0,0 +1,213 @@
+import itertools
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from epubtranslator import EpubTranslator
+from rate_limiter import RateLimiter
+from segment_pool import SegmentPool
+
+
+class TranslationJob:
+    """在后台运行的一次EPUB翻译，保存状态和进度供界面轮询"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, job_id, name, input_path, output_path, translator_options=None, translate_options=None,
+                 book_background=None):
+        self.id = job_id
+        self.name = name
+        self.input_path = input_path
+        self.output_path = output_path
+        self.translator_options = translator_options or {}
+        self.translate_options = translate_options or {}
+        self.book_background = book_background
+        self.lock = threading.Lock()
+        self.status = self.QUEUED
+        self.completed = 0
+        self.total = 0
+        self.eta = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.report = None
+        self.profile = None
+        self.translated_file_path = None
+        self.translator = None
+        self.future = None
+        self.cancel_requested = False
+
+    @property
+    def finished(self):
+        return self.status in (self.COMPLETED, self.FAILED, self.CANCELLED)
+
+    @property
+    def progress(self):
+        """完成比例，0到1之间"""
+        if self.status == self.COMPLETED:
+            return 1.0
+        return self.completed / self.total if self.total else 0.0
+
+    def update_progress(self, completed, total, eta):
+        """translate_epub 的进度回调"""
+        with self.lock:
+            self.completed = completed
+            self.total = total
+            self.eta = eta
+
+    def snapshot(self):
+        """当前状态的副本，界面渲染时不会读到一半更新的数据"""
+        with self.lock:
+            return {
+                'id': self.id,
+                'name': self.name,
+                'status': self.status,
+                'completed': self.completed,
+                'total': self.total,
+                'progress': self.progress,
+                'eta': self.eta,
+                'submitted_at': self.submitted_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'error': self.error,
+                'output_path': self.output_path,
+                'translated_file_path': self.translated_file_path,
+                'report': self.report,
+                'profile': self.profile,
+            }
+
+
+class JobManager:
+    """在后台运行翻译任务的任务管理器
+
+    任务在界面脚本线程之外运行，页面重新运行或刷新后仍可以查询状态。线程池只用来排队和运行任务本身，
+    同时运行的书籍数量由它的大小（MAX_PARALLEL_JOBS）限制，其余任务排队。
+    每个任务使用自己的 EpubTranslator（各自的密钥、模型、书籍背景和进度），片段则交给相同引擎设置的任务共用的
+    SegmentPool 翻译，各书的批次轮转领取：同时运行多本书时工作线程数和并发请求数不随书数成倍增长。
+    相同限流设置的任务共用一个限流器，多本书加起来也不会超过服务端的额度。
+    """
+    def __init__(self, max_parallel_jobs=None):
+        self.max_parallel_jobs = max_parallel_jobs or int(os.getenv('MAX_PARALLEL_JOBS') or 2)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_parallel_jobs, thread_name_prefix="TranslationJob")
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.rate_limiters = {}
+        self.pools = {}
+        self.ids = itertools.count(1)
+
+    def shared_rate_limiter(self, requests_per_minute=None, tokens_per_minute=None):
+        """返回相同限流设置共用的限流器"""
+        key = (requests_per_minute or float(os.getenv('RATE_LIMIT_RPM') or 0),
+               tokens_per_minute or float(os.getenv('RATE_LIMIT_TPM') or 0))
+        with self.lock:
+            limiter = self.rate_limiters.get(key)
+            if limiter is None:
+                limiter = self.rate_limiters[key] = RateLimiter(*key)
+            return limiter
+
+    def shared_pool(self, engine="threads", num_threads=5, concurrency=50):
+        """返回相同引擎设置的任务共用的片段工作池，第一次使用时创建"""
+        key = (engine, concurrency if engine == "async" else num_threads)
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = self.pools[key] = SegmentPool(engine, num_threads, concurrency, daemon=True)
+            return pool
+
+    def submit(self, name, input_path, output_path, translator_options=None, translate_options=None, book_background=None):
+        """提交一个翻译任务，返回 TranslationJob"""
+        with self.lock:
+            job = TranslationJob(next(self.ids), name, input_path, output_path, translator_options, translate_options,
+                                 book_background)
+            self.jobs[job.id] = job
+        job.future = self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        with job.lock:
+            if job.cancel_requested:
+                job.status = TranslationJob.CANCELLED
+                job.finished_at = time.time()
+                return
+            job.status = TranslationJob.RUNNING
+            job.started_at = time.time()
+        try:
+            options = dict(job.translator_options)
+            options['rate_limiter'] = self.shared_rate_limiter(options.pop('requests_per_minute', None),
+                                                               options.pop('tokens_per_minute', None))
+            translator = EpubTranslator(**options)
+            if job.book_background:
+                translator.book_background = job.book_background
+            with job.lock:
+                job.translator = translator
+                if job.cancel_requested:
+                    translator.stop_event.set()
+            translate_options = dict(job.translate_options)
+            pool = self.shared_pool(translate_options.pop('engine', "threads"), translate_options.pop('num_threads', 5),
+                                    translate_options.pop('concurrency', 50))
+            output_path, _tmp_output_path, translated_file_path = translator.translate_epub(
+                job.input_path, job.output_path, progress_callback=job.update_progress, pool=pool, **translate_options)
+            with job.lock:
+                job.output_path = output_path
+                job.translated_file_path = translated_file_path
+                job.report = translator.metrics.report()
+                if translator.profiler.enabled:
+                    job.profile = translator.profiler.summary()
+                job.status = TranslationJob.CANCELLED if translator.stop_event.is_set() else TranslationJob.COMPLETED
+        except Exception as e:
+            traceback.print_exc()
+            with job.lock:
+                job.status = TranslationJob.FAILED
+                job.error = str(e)
+        finally:
+            with job.lock:
+                job.finished_at = time.time()
+                if job.translator is not None:
+                    job.translator.close()
+                job.translator = None
+
+    def cancel(self, job_id):
+        """取消排队中的任务，或通知运行中的任务在当前请求完成后停止"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        with job.lock:
+            job.cancel_requested = True
+            if job.translator is not None:
+                job.translator.stop_event.set()
+        if job.future is not None and job.future.cancel():
+            with job.lock:
+                job.status = TranslationJob.CANCELLED
+                job.finished_at = time.time()
+        return True
+
+    def list_jobs(self):
+        """按提交顺序返回所有任务的状态快照"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.snapshot() for job in jobs]
+
+    def has_active_jobs(self):
+        with self.lock:
+            return any(not job.finished for job in self.jobs.values())
+
+    def close(self):
+        """等待运行中的任务结束并关闭共用的工作池"""
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def clear_finished(self):
+        """从列表中移除已经结束的任务"""
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job.finished]:
+                del self.jobs[job_id]
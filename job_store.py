@@ -0,0 +1,202 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def default_worker_id():
+    """主机名加进程号，便于在任务库中看出片段被哪台机器领取"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class JobStore:
+    """多台机器共享的片段任务库（SQLite）
+
+    协调进程把一本书切分后的片段写入任务库，任意数量的工作进程领取片段、翻译后写回译文，
+    协调进程收集完成的片段并组装EPUB。领取片段时设置租约到期时间，工作进程定期续约；
+    进程崩溃后租约过期，片段会被其他工作进程重新领取。
+
+    数据库文件可以放在多台机器共享的卷上。网络文件系统通常不支持 WAL 需要的共享内存，
+    因此使用默认的回滚日志模式，并靠 busy_timeout 等待其他进程释放写锁。
+    """
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=5):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=60)
+        self.conn.execute("PRAGMA busy_timeout=60000")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS books ("
+            " id TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " glossary TEXT NOT NULL,"
+            " book_background TEXT,"
+            " created REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            " book TEXT NOT NULL,"
+            " doc TEXT NOT NULL,"
+            " idx INTEGER NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " tag TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " worker TEXT,"
+            " lease_until REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " collected INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (book, doc, idx))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_segments_status ON segments(book, status)")
+
+    def _transaction(self, callback):
+        """在写事务中执行 callback；BEGIN IMMEDIATE 立即取得写锁，多个进程同时领取时不会拿到同一个片段"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = callback(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def add_book(self, book_id, name, glossary, book_background, segments, resume=True):
+        """登记一本书和它待翻译的片段
+
+        segments 为 (文档, 序号, 原文指纹, 标签名, 原文HTML) 列表。恢复时保留任务库中已有的进度，
+        原文指纹变化的片段重新排队；不恢复时清空这本书之前的所有记录。
+        """
+        def add(conn):
+            if not resume:
+                conn.execute("DELETE FROM segments WHERE book = ?", (book_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO books (id, name, glossary, book_background, created) VALUES (?, ?, ?, ?, ?)",
+                (book_id, name, json.dumps(glossary or {}, ensure_ascii=False), book_background, time.time())
+            )
+            conn.executemany(
+                "INSERT INTO segments (book, doc, idx, hash, tag, source, status) VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (book, doc, idx) DO UPDATE SET hash = excluded.hash, tag = excluded.tag,"
+                " source = excluded.source, status = excluded.status, worker = NULL, lease_until = NULL,"
+                " attempts = 0, result = NULL, collected = 0"
+                " WHERE segments.hash != excluded.hash",
+                [(book_id, doc, index, source_hash, tag, source, self.PENDING)
+                 for doc, index, source_hash, tag, source in segments]
+            )
+            # 上次协调进程已经收集过的片段如果没有写入本地片段日志，需要重新收集
+            conn.execute("UPDATE segments SET collected = 0 WHERE book = ? AND status IN (?, ?)",
+                         (book_id, self.DONE, self.FAILED))
+        self._transaction(add)
+
+    def next_book(self):
+        """返回最早登记的、仍有可领取片段的书 {'id', 'name', 'glossary', 'book_background'}，没有时返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT b.id, b.name, b.glossary, b.book_background FROM books b"
+                " WHERE EXISTS (SELECT 1 FROM segments s WHERE s.book = b.id"
+                " AND (s.status = ? OR (s.status = ? AND s.lease_until < ?)))"
+                " ORDER BY b.created LIMIT 1",
+                (self.PENDING, self.LEASED, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'name': row[1], 'glossary': json.loads(row[2]), 'book_background': row[3]}
+
+    def lease(self, book_id, worker_id, limit=1):
+        """领取最多 limit 个待翻译或租约已过期的片段，返回 (文档, 序号, 标签名, 原文HTML) 列表"""
+        def lease(conn):
+            now = time.time()
+            rows = conn.execute(
+                "SELECT doc, idx, tag, source FROM segments WHERE book = ?"
+                " AND (status = ? OR (status = ? AND lease_until < ?)) ORDER BY doc, idx LIMIT ?",
+                (book_id, self.PENDING, self.LEASED, now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE segments SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1"
+                " WHERE book = ? AND doc = ? AND idx = ?",
+                [(self.LEASED, worker_id, now + self.lease_seconds, book_id, doc, index) for doc, index, _, _ in rows]
+            )
+            return rows
+        return self._transaction(lease)
+
+    def renew(self, worker_id):
+        """延长该工作进程持有的所有租约"""
+        def renew(conn):
+            return conn.execute("UPDATE segments SET lease_until = ? WHERE status = ? AND worker = ?",
+                                (time.time() + self.lease_seconds, self.LEASED, worker_id)).rowcount
+        return self._transaction(renew)
+
+    def release(self, worker_id):
+        """工作进程退出时把手上未完成的片段放回队列，不必等租约过期"""
+        def release(conn):
+            return conn.execute("UPDATE segments SET status = ?, worker = NULL, lease_until = NULL,"
+                                " attempts = MAX(attempts - 1, 0) WHERE status = ? AND worker = ?",
+                                (self.PENDING, self.LEASED, worker_id)).rowcount
+        return self._transaction(release)
+
+    def complete(self, book_id, doc, index, result):
+        """写回译文；片段已经被其他工作进程完成时忽略"""
+        def complete(conn):
+            conn.execute(
+                "UPDATE segments SET status = ?, result = ?, lease_until = NULL WHERE book = ? AND doc = ? AND idx = ?"
+                " AND status != ?",
+                (self.DONE, result, book_id, doc, index, self.DONE)
+            )
+        self._transaction(complete)
+
+    def fail(self, book_id, doc, index):
+        """翻译失败时把片段放回队列，超过最大尝试次数后标记为失败（保留原文）"""
+        def fail(conn):
+            conn.execute(
+                "UPDATE segments SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL,"
+                " lease_until = NULL WHERE book = ? AND doc = ? AND idx = ? AND status = ?",
+                (self.max_attempts, self.FAILED, self.PENDING, book_id, doc, index, self.LEASED)
+            )
+        self._transaction(fail)
+
+    def collect(self, book_id):
+        """取出已完成但还没有被协调进程收集的片段，返回 (文档, 序号, 状态, 译文) 列表"""
+        def collect(conn):
+            rows = conn.execute(
+                "SELECT doc, idx, status, result FROM segments WHERE book = ? AND status IN (?, ?) AND collected = 0",
+                (book_id, self.DONE, self.FAILED)
+            ).fetchall()
+            conn.executemany("UPDATE segments SET collected = 1 WHERE book = ? AND doc = ? AND idx = ?",
+                             [(book_id, doc, index) for doc, index, _, _ in rows])
+            return rows
+        return self._transaction(collect)
+
+    def progress(self, book_id):
+        """按状态统计片段数，租约已过期的片段计为待翻译"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT CASE WHEN status = ? AND lease_until < ? THEN ? ELSE status END, COUNT(*)"
+                " FROM segments WHERE book = ? GROUP BY 1",
+                (self.LEASED, time.time(), self.PENDING, book_id)
+            ).fetchall()
+        counts = {self.PENDING: 0, self.LEASED: 0, self.DONE: 0, self.FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def remove_book(self, book_id):
+        """书籍组装完成后删除它的所有记录"""
+        def remove(conn):
+            conn.execute("DELETE FROM segments WHERE book = ?", (book_id,))
+            conn.execute("DELETE FROM books WHERE id = ?", (book_id,))
+        self._transaction(remove)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,92 @@
+import copy
+import re
+
+from bs4 import NavigableString, Tag
+
+# 占位符：⟦1⟧…⟦/1⟧ 包住带内容的标签，⟦2/⟧ 代表没有内容的标签（如 <br/>）
+PLACEHOLDER_PATTERN = re.compile(r'⟦(/?)(\d+)(/?)⟧')
+PLACEHOLDER_CHARS = ('⟦', '⟧')
+
+
+def empty_copy(element):
+    """复制一个标签但不包含其子节点"""
+    clone = copy.copy(element)
+    if isinstance(clone, Tag):
+        clone.clear()
+    return clone
+
+
+class MaskedSegment:
+    """把段落内部的行内标签替换成短占位符后的纯文本
+
+    发送给模型的只有文本和占位符，class、href 等属性都不再占用token；
+    restore 按占位符把原始标签重新套回译文，并检查结构是否完整。
+    """
+    def __init__(self, node, text_filter=None):
+        self.node = node
+        self.elements = {}
+        self.replaced = []
+        self.text_filter = text_filter
+        pieces = []
+        self._mask_children(node, pieces)
+        self.text = "".join(pieces)
+
+    def _mask_children(self, parent, pieces):
+        for child in parent.children:
+            if type(child) is NavigableString:
+                text = str(child)
+                if self.text_filter is not None:
+                    text, replaced = self.text_filter(text)
+                    self.replaced.extend(replaced)
+                pieces.append(text)
+                continue
+            index = len(self.elements) + 1
+            self.elements[index] = child
+            if isinstance(child, Tag) and child.contents:
+                pieces.append(f"⟦{index}⟧")
+                self._mask_children(child, pieces)
+                pieces.append(f"⟦/{index}⟧")
+            else:
+                # 空标签以及注释等特殊节点整体用一个占位符代替
+                pieces.append(f"⟦{index}/⟧")
+
+    @classmethod
+    def create(cls, node, text_filter=None):
+        """生成遮蔽后的片段；原文本身含有占位符字符时无法可靠还原，返回 None"""
+        if any(char in text for text in node.strings for char in PLACEHOLDER_CHARS):
+            return None
+        return cls(node, text_filter)
+
+    def restore(self, translated):
+        """把译文中的占位符还原为原始标签，返回新的节点；结构与原文不一致时返回 None"""
+        root = empty_copy(self.node)
+        stack = [(root, None)]
+        seen = set()
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(translated):
+            if match.start() > position:
+                stack[-1][0].append(NavigableString(translated[position:match.start()]))
+            position = match.end()
+            closing, index, self_closing = match.group(1), int(match.group(2)), match.group(3)
+            original = self.elements.get(index)
+            if original is None or (closing and self_closing):
+                return None
+            if closing:
+                if stack[-1][1] != index:
+                    return None
+                stack.pop()
+                continue
+            if index in seen:
+                return None
+            seen.add(index)
+            if self_closing:
+                stack[-1][0].append(copy.copy(original))
+            else:
+                element = empty_copy(original)
+                stack[-1][0].append(element)
+                stack.append((element, index))
+        if position < len(translated):
+            stack[-1][0].append(NavigableString(translated[position:]))
+        if len(stack) != 1 or len(seen) != len(self.elements):
+            return None
+        return root
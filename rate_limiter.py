@@ -0,0 +1,108 @@
+import asyncio
+import email.utils
+import threading
+import time
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中日韩字符约1个token，其余字符约4个一个token"""
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if '⺀' <= char <= '鿿' or '豈' <= char <= '﫿')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def parse_retry_after(headers):
+    """从响应头中解析 Retry-After（秒数或HTTP日期），无法解析时返回 None"""
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms') or headers.get('Retry-After-Ms')
+        if value:
+            return float(value) / 1000
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class RateLimiter:
+    """线程安全的令牌桶限流器，同时限制每分钟请求数(RPM)和每分钟token数(TPM)
+
+    额度充足时请求立即放行；额度不足时调用方按预约的时间等待，
+    多个线程或协程之间按先来后到的顺序排队，而不是各自忙等。
+    收到 429 时调用 penalize 让所有请求暂停到 Retry-After 指定的时间。
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute or None
+        self.tokens_per_minute = tokens_per_minute or None
+        self.lock = threading.Lock()
+        now = time.monotonic()
+        self.last_refill = now
+        self.blocked_until = now
+        # 桶中剩余额度，允许为负数，表示已经被预约的未来额度
+        self.request_allowance = float(self.requests_per_minute or 0)
+        self.token_allowance = float(self.tokens_per_minute or 0)
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        if self.requests_per_minute:
+            self.request_allowance = min(float(self.requests_per_minute),
+                                         self.request_allowance + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.token_allowance = min(float(self.tokens_per_minute),
+                                       self.token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def reserve(self, tokens=0):
+        """预约一次请求的额度，返回需要等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.blocked_until - now)
+            if self.requests_per_minute:
+                self.request_allowance -= 1
+                if self.request_allowance < 0:
+                    wait = max(wait, -self.request_allowance * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                # 单个请求超过整桶容量时按整桶计算，避免永远无法放行
+                self.token_allowance -= min(tokens, self.tokens_per_minute)
+                if self.token_allowance < 0:
+                    wait = max(wait, -self.token_allowance * 60 / self.tokens_per_minute)
+            return wait
+
+    def acquire(self, tokens=0):
+        """阻塞直到可以发送请求"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=0):
+        """acquire 的异步版本"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """根据响应中的实际用量修正token桶"""
+        if not self.tokens_per_minute or actual_tokens is None:
+            return
+        with self.lock:
+            self.token_allowance -= actual_tokens - estimated_tokens
+
+    def penalize(self, retry_after):
+        """服务端限流（429）时，让所有后续请求至少等待 retry_after 秒"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
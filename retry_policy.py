@@ -0,0 +1,139 @@
+"""API调用失败后的重试策略
+
+把异常分为可重试（超时、连接中断、5xx）、被限流（429）和不可重试（参数错误、认证失败、额度耗尽等）三类。
+重试前按带抖动的指数退避等待，多个线程同时失败时不会在同一时刻一起重试；
+可重试错误的重试次数还受整次运行的重试预算限制，服务端整体故障时不会被大量重试进一步压垮。
+"""
+import random
+import threading
+
+import httpx
+import openai
+
+from rate_limiter import parse_retry_after
+
+RETRYABLE = "retryable"
+RATE_LIMITED = "rate_limited"
+FATAL = "fatal"
+
+# 可以重试的 4xx 状态码：请求超时、冲突
+RETRYABLE_STATUS_CODES = frozenset([408, 409])
+
+
+def classify_error(error):
+    """返回 (分类, 服务端建议的等待秒数)，没有建议时等待秒数为 None"""
+    if isinstance(error, openai.RateLimitError):
+        # 额度耗尽不是暂时性的限流，重试没有意义
+        if getattr(error, 'code', None) == 'insufficient_quota':
+            return FATAL, None
+        return RATE_LIMITED, parse_retry_after(error.response.headers)
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code >= 500 or error.status_code in RETRYABLE_STATUS_CODES:
+            # 503 等响应也可能带有 Retry-After
+            return RETRYABLE, parse_retry_after(error.response.headers)
+        return FATAL, None
+    # 超时和连接中断；流式响应读到一半断开时 httpx 的异常不会被包装
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return RETRYABLE, None
+    # 流式响应中服务端返回的错误事件
+    if isinstance(error, openai.APIError):
+        return RETRYABLE, None
+    error_msg = str(error).lower()
+    if "timeout" in error_msg or "timed out" in error_msg:
+        return RETRYABLE, None
+    return FATAL, None
+
+
+def endpoint_error(error):
+    """错误是否只与所用的端点有关（密钥无效、无权限、模型不存在、额度耗尽），换一个端点可能成功"""
+    if isinstance(error, openai.RateLimitError):
+        return getattr(error, 'code', None) == 'insufficient_quota'
+    return isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError))
+
+
+class RetryPolicy:
+    """重试策略：指数退避加随机抖动，以及整次运行共享的重试预算
+
+    base_delay / max_delay: 第 n 次重试的退避上限为 min(max_delay, base_delay * 2**n)
+    budget_ratio / min_budget: 可重试错误的重试总数不超过 min_budget + budget_ratio * 已发送的请求数
+    max_rate_limit_retries: 单次调用被限流后最多重试的次数；限流由服务端明确要求等待，
+        并且由共享的限流器统一放慢，不计入重试预算
+    """
+    def __init__(self, base_delay=1.0, max_delay=60.0, budget_ratio=0.2, min_budget=20, max_rate_limit_retries=8,
+                 seed=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.min_budget = min_budget
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.attempts = 0
+        self.retries = 0
+
+    def reset(self):
+        """开始新的一次运行，重试预算重新计算"""
+        with self.lock:
+            self.attempts = 0
+            self.retries = 0
+
+    def record_attempt(self):
+        with self.lock:
+            self.attempts += 1
+
+    def backoff(self, attempt, full_jitter=True):
+        """第 attempt 次重试（从0开始）前的等待秒数
+
+        full_jitter 时在 0 到上限之间均匀取值；否则至少等待上限的一半，用于必须放慢的限流。
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        with self.lock:
+            jitter = self.random.random()
+        if full_jitter:
+            return ceiling * jitter
+        return ceiling / 2 * (1 + jitter)
+
+    def start(self, max_retries=3):
+        """开始一次调用的重试计数"""
+        return RetryState(self, max_retries)
+
+
+class RetryState:
+    """一次调用（含其重试）的重试计数"""
+    def __init__(self, policy, max_retries):
+        self.policy = policy
+        self.max_retries = max_retries
+        self.retries = 0
+        self.rate_limited = 0
+        # 放弃重试的原因，供调用方输出
+        self.reason = None
+
+    @property
+    def total(self):
+        return self.retries + self.rate_limited
+
+    def next_delay(self, kind, retry_after=None):
+        """返回下一次重试前需要等待的秒数，不应再重试时返回 None 并设置 reason"""
+        if kind == FATAL:
+            self.reason = "错误不可重试"
+            return None
+        policy = self.policy
+        if kind == RATE_LIMITED:
+            if self.rate_limited >= policy.max_rate_limit_retries:
+                self.reason = f"被限流超过 {policy.max_rate_limit_retries} 次"
+                return None
+            delay = policy.backoff(self.rate_limited, full_jitter=False)
+            self.rate_limited += 1
+            # 服务端给出等待时间时至少等待这么久，再加上抖动错开各线程
+            return delay if retry_after is None else retry_after + delay / 2
+        if self.retries >= self.max_retries:
+            self.reason = f"超过最大重试次数 ({self.max_retries})"
+            return None
+        with policy.lock:
+            if policy.retries >= policy.min_budget + policy.budget_ratio * policy.attempts:
+                self.reason = "本次运行的重试预算已用完"
+                return None
+            policy.retries += 1
+        delay = policy.backoff(self.retries)
+        self.retries += 1
+        return delay if retry_after is None else max(retry_after, delay)
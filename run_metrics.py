@@ -0,0 +1,308 @@
+import contextlib
+import contextvars
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 当前正在翻译的章节，线程和协程各自独立；API调用的token用量按它汇总到章节
+current_chapter = contextvars.ContextVar("current_chapter", default=None)
+
+# 不属于任何章节的调用（例如目录、书名）汇总到这一项
+OTHER_CHAPTER = "(other)"
+
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+# 计算延迟分位数时保留的样本数上限，超过后按蓄水池抽样替换，长时间运行的内存占用不再增长
+LATENCY_RESERVOIR_SIZE = 4096
+
+
+def percentile(sorted_values, q):
+    """按最近秩法计算已排序数据的分位数，没有数据时返回 None"""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class RunMetrics:
+    """一次运行中所有API调用的指标
+
+    每次调用记录延迟、输入/输出token数、重试次数，另外统计翻译记忆命中和完成的片段数。
+    延迟的总和、次数和最大值精确统计，分位数由最多 reservoir_size 个均匀抽取的样本估算。
+    report 生成JSON报告，prometheus_text 生成 Prometheus 文本格式，可写入文件或通过HTTP暴露。
+    """
+    def __init__(self, reservoir_size=LATENCY_RESERVOIR_SIZE, seed=None):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.reservoir_size = reservoir_size
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.latency_sum = 0.0
+        self.latency_max = None
+        self.calls = 0
+        self.failed_calls = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.segments = 0
+        self.failed_segments = 0
+        # 发送前规则分类的结果：skip / glossary_only / translate
+        self.classifications = Counter()
+        # 过长片段的切分：被切分的片段数、切出的块数，以及因达到输出上限被截断的调用数
+        self.split_segments = 0
+        self.split_chunks = 0
+        self.truncated_calls = 0
+        # 重试策略的决定：按可重试、被限流分类的重试次数，以及放弃重试和不可重试的错误数
+        self.retry_decisions = Counter()
+        # 发送过对冲请求的次数，以及其中对冲请求先返回的次数
+        self.hedged = 0
+        self.hedge_wins = 0
+        # 多端点时各端点成功、失败的请求数和被剔除的次数
+        self.endpoint_calls = {}
+        self.chapters = {}
+
+    def record_call(self, latency, prompt_tokens=0, completion_tokens=0, retries=0, ok=True):
+        """记录一次API调用（含其重试），latency 为最后一次请求的往返时间"""
+        chapter = current_chapter.get() or OTHER_CHAPTER
+        with self.lock:
+            self.calls += 1
+            self._sample_latency(latency)
+            self.failed_calls += 0 if ok else 1
+            self.retries += retries
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            stats = self.chapters.setdefault(chapter, {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            stats['calls'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+
+    def _sample_latency(self, latency):
+        # 蓄水池抽样：第 n 个样本以 reservoir_size / n 的概率替换一个已有样本
+        self.latency_sum += latency
+        self.latency_max = latency if self.latency_max is None else max(self.latency_max, latency)
+        if len(self.latencies) < self.reservoir_size:
+            self.latencies.append(latency)
+            return
+        index = self.random.randrange(self.calls)
+        if index < self.reservoir_size:
+            self.latencies[index] = latency
+
+    def record_cache(self, hit):
+        with self.lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def record_classification(self, kind):
+        with self.lock:
+            self.classifications[kind] += 1
+
+    def record_split(self, chunks):
+        with self.lock:
+            self.split_segments += 1
+            self.split_chunks += chunks
+
+    def record_truncated(self):
+        with self.lock:
+            self.truncated_calls += 1
+
+    def record_retry(self, decision):
+        with self.lock:
+            self.retry_decisions[decision] += 1
+
+    def record_hedge(self, won):
+        with self.lock:
+            self.hedged += 1
+            self.hedge_wins += 1 if won else 0
+
+    def record_endpoint(self, name, model=None, ok=True, ejected=False):
+        with self.lock:
+            stats = self.endpoint_calls.setdefault(name, {'model': model, 'ok': 0, 'failed': 0, 'ejections': 0})
+            stats['ok' if ok else 'failed'] += 1
+            stats['ejections'] += 1 if ejected else 0
+
+    def record_segment(self, ok=True):
+        with self.lock:
+            if ok:
+                self.segments += 1
+            else:
+                self.failed_segments += 1
+
+    def report(self):
+        """生成可序列化为JSON的运行报告"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            elapsed = time.time() - self.started
+            cache_lookups = self.cache_hits + self.cache_misses
+            return {
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'elapsed_seconds': round(elapsed, 3),
+                'segments': self.segments,
+                'failed_segments': self.failed_segments,
+                'segments_per_minute': round(self.segments * 60 / elapsed, 2) if elapsed > 0 else None,
+                'api_calls': self.calls,
+                'failed_calls': self.failed_calls,
+                'retries': self.retries,
+                'latency_seconds': {
+                    **{f"p{int(q * 100)}": self._round(percentile(latencies, q)) for q in LATENCY_QUANTILES},
+                    'mean': self._round(self.latency_sum / self.calls) if self.calls else None,
+                    'max': self._round(self.latency_max),
+                },
+                'tokens': {
+                    'prompt': self.prompt_tokens,
+                    'completion': self.completion_tokens,
+                    'total': self.prompt_tokens + self.completion_tokens,
+                },
+                'cache': {
+                    'hits': self.cache_hits,
+                    'misses': self.cache_misses,
+                    'hit_rate': round(self.cache_hits / cache_lookups, 4) if cache_lookups else None,
+                },
+                'classifier': {
+                    'skip': self.classifications['skip'],
+                    'glossary_only': self.classifications['glossary_only'],
+                    'translate': self.classifications['translate'],
+                    # 跳过和只替换术语的片段都不需要调用API
+                    'requests_saved': self.classifications['skip'] + self.classifications['glossary_only'],
+                },
+                'hedging': {
+                    'hedged': self.hedged,
+                    'hedge_wins': self.hedge_wins,
+                },
+                'retry_policy': {
+                    'retryable': self.retry_decisions['retryable'],
+                    'rate_limited': self.retry_decisions['rate_limited'],
+                    'gave_up': self.retry_decisions['gave_up'],
+                    'fatal': self.retry_decisions['fatal'],
+                },
+                'endpoints': {name: dict(stats) for name, stats in self.endpoint_calls.items()},
+                'splits': {
+                    'segments': self.split_segments,
+                    'chunks': self.split_chunks,
+                    'truncated_calls': self.truncated_calls,
+                },
+                'tokens_per_chapter': {chapter: dict(stats) for chapter, stats in self.chapters.items()},
+            }
+
+    @staticmethod
+    def _round(value):
+        return round(value, 4) if value is not None else None
+
+    def write_report(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+    def prometheus_text(self, prefix="epubtranslator"):
+        """以 Prometheus 文本格式导出当前指标"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            lines = [
+                f"# HELP {prefix}_api_calls_total API calls by outcome.",
+                f"# TYPE {prefix}_api_calls_total counter",
+                f'{prefix}_api_calls_total{{status="ok"}} {self.calls - self.failed_calls}',
+                f'{prefix}_api_calls_total{{status="failed"}} {self.failed_calls}',
+                f"# HELP {prefix}_api_retries_total Retried API requests.",
+                f"# TYPE {prefix}_api_retries_total counter",
+                f"{prefix}_api_retries_total {self.retries}",
+                f"# HELP {prefix}_retry_decisions_total Retry policy decisions by error class.",
+                f"# TYPE {prefix}_retry_decisions_total counter",
+                *(f'{prefix}_retry_decisions_total{{decision="{decision}"}} {self.retry_decisions[decision]}'
+                  for decision in ('retryable', 'rate_limited', 'gave_up', 'fatal')),
+                f"# HELP {prefix}_api_latency_seconds Round trip time of API requests.",
+                f"# TYPE {prefix}_api_latency_seconds summary",
+            ]
+            for q in LATENCY_QUANTILES:
+                value = percentile(latencies, q)
+                lines.append(f'{prefix}_api_latency_seconds{{quantile="{q}"}} {value if value is not None else "NaN"}')
+            lines += [
+                f"{prefix}_api_latency_seconds_sum {self.latency_sum}",
+                f"{prefix}_api_latency_seconds_count {self.calls}",
+                f"# HELP {prefix}_tokens_total Tokens used by API calls.",
+                f"# TYPE {prefix}_tokens_total counter",
+                f'{prefix}_tokens_total{{kind="prompt"}} {self.prompt_tokens}',
+                f'{prefix}_tokens_total{{kind="completion"}} {self.completion_tokens}',
+                f"# HELP {prefix}_cache_lookups_total Translation memory lookups.",
+                f"# TYPE {prefix}_cache_lookups_total counter",
+                f'{prefix}_cache_lookups_total{{result="hit"}} {self.cache_hits}',
+                f'{prefix}_cache_lookups_total{{result="miss"}} {self.cache_misses}',
+                f"# HELP {prefix}_segments_total Segments translated in this run.",
+                f"# TYPE {prefix}_segments_total counter",
+                f'{prefix}_segments_total{{status="ok"}} {self.segments}',
+                f'{prefix}_segments_total{{status="failed"}} {self.failed_segments}',
+                f"# HELP {prefix}_segments_classified_total Segments by pre-dispatch classification.",
+                f"# TYPE {prefix}_segments_classified_total counter",
+            ]
+            for kind in ('skip', 'glossary_only', 'translate'):
+                lines.append(f'{prefix}_segments_classified_total{{class="{kind}"}} {self.classifications[kind]}')
+            lines += [
+                f"# HELP {prefix}_hedged_requests_total Requests that were hedged, by which copy answered first.",
+                f"# TYPE {prefix}_hedged_requests_total counter",
+                f'{prefix}_hedged_requests_total{{winner="original"}} {self.hedged - self.hedge_wins}',
+                f'{prefix}_hedged_requests_total{{winner="hedge"}} {self.hedge_wins}',
+                f"# HELP {prefix}_segments_split_total Over-long segments split at sentence boundaries.",
+                f"# TYPE {prefix}_segments_split_total counter",
+                f"{prefix}_segments_split_total {self.split_segments}",
+                f"# HELP {prefix}_completions_truncated_total Completions cut off at the output token limit.",
+                f"# TYPE {prefix}_completions_truncated_total counter",
+                f"{prefix}_completions_truncated_total {self.truncated_calls}",
+            ]
+            if self.endpoint_calls:
+                lines += [
+                    f"# HELP {prefix}_endpoint_requests_total API requests by endpoint and outcome.",
+                    f"# TYPE {prefix}_endpoint_requests_total counter",
+                ]
+                for name, stats in self.endpoint_calls.items():
+                    lines.append(f'{prefix}_endpoint_requests_total{{endpoint="{name}",status="ok"}} {stats["ok"]}')
+                    lines.append(f'{prefix}_endpoint_requests_total{{endpoint="{name}",status="failed"}} {stats["failed"]}')
+                lines += [
+                    f"# HELP {prefix}_endpoint_ejections_total Times an endpoint was temporarily ejected.",
+                    f"# TYPE {prefix}_endpoint_ejections_total counter",
+                    *(f'{prefix}_endpoint_ejections_total{{endpoint="{name}"}} {stats["ejections"]}'
+                      for name, stats in self.endpoint_calls.items()),
+                ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """原子地写出 Prometheus 文本文件，可配合 node_exporter 的 textfile 收集器使用"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    @contextlib.contextmanager
+    def serve(self, port, host="127.0.0.1"):
+        """在后台线程中提供 /metrics HTTP端点，退出时停止服务并释放端口；port 为空时不启动，得到 None"""
+        if not port:
+            yield None
+            return
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+        print(f"指标端点: http://{host}:{port}/metrics")
+        try:
+            yield server
+        finally:
+            server.shutdown()
+            # 同一进程中多次运行（界面任务、批量模式）会重复使用同一个端口
+            server.server_close()
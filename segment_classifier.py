@@ -0,0 +1,99 @@
+"""发送前的规则分类：判断片段是否不需要翻译、只需替换词汇表术语，还是需要调用API翻译
+
+只用正则和字符统计，每个片段的开销远小于一次API请求。
+"""
+import re
+
+# 分类结果：不需要翻译、只需替换词汇表术语、需要调用API翻译
+SKIP = "skip"
+GLOSSARY_ONLY = "glossary_only"
+TRANSLATE = "translate"
+
+# 内容按原样保留的代码类标签
+CODE_TAGS = frozenset(['pre', 'code', 'kbd', 'samp', 'tt', 'var'])
+
+LATIN_PATTERN = re.compile(r'[A-Za-z]')
+CJK_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+# 大写罗马数字及可选的结尾标点；不在标题中时要求带标点（"IV."、"XII)"），
+# 不带标点的 "DC"、"MD"、"LIV" 等可能是缩写或单词
+ROMAN_NUMERAL_PATTERN = re.compile(r'^(?=[MDCLXVI])M{0,3}(?:CM|CD|D?C{0,3})(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})([.):]?)$')
+HEADING_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+URL_PATTERN = re.compile(r'^(?:(?:https?|ftp)://|www\.)\S+$', re.IGNORECASE)
+EMAIL_PATTERN = re.compile(r'^(?:mailto:)?[\w.+-]+@[\w-]+(?:\.[\w-]+)+$', re.IGNORECASE)
+ISBN_PATTERN = re.compile(r'^(?:ISBN(?:-1[03])?:?\s*)?(?:97[89][\s-]?)?\d[\d\s-]{7,14}[\dXx]$', re.IGNORECASE)
+# 只认散文中几乎不会出现的强特征：以 { } 或 ); 结尾、函数或类定义、单独的 import 语句、#include、
+# "名称 = 值" 形式的赋值。for、if 或 * 开头的行在折行的正文和列表中也很常见，不作为依据
+CODE_LINE_PATTERN = re.compile(
+    r'(?:(?:[{}]|\);)\s*$'
+    r'|^\s*(?:def|function)\s+\w+\s*\(.*\)\s*[:{]?\s*$'
+    r'|^\s*class\s+\w+\s*(?:\(.*\))?\s*[:{]\s*$'
+    r'|^\s*(?:import\s+[\w.]+(?:\s+as\s+\w+)?|from\s+[\w.]+\s+import\s+[\w, *]+)\s*$'
+    r'|^\s*#include\b|^\s*[\w.\[\]]+\s*=\s*[^\s=].*$)'
+)
+# 已是中文的判定：中文字符占中英文字符总数的比例
+CHINESE_RATIO = 0.5
+
+
+def chinese_ratio(text):
+    """中文字符占中英文字符总数的比例，没有中英文字符时返回 0"""
+    cjk = len(CJK_PATTERN.findall(text))
+    latin = len(LATIN_PATTERN.findall(text))
+    return cjk / (cjk + latin) if cjk + latin else 0.0
+
+
+def has_latin(text):
+    return LATIN_PATTERN.search(text) is not None
+
+
+def looks_like_code(text):
+    """多行文本中至少三分之二的行有代码的强特征时认为是代码示例；误判会让正文不被翻译，宁可漏判"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return False
+    return sum(1 for line in lines if CODE_LINE_PATTERN.search(line)) * 3 >= len(lines) * 2
+
+
+def is_code_node(node):
+    """节点本身是代码标签，或者所有非空文本都位于代码标签内"""
+    if node is None:
+        return False
+    if node.name in CODE_TAGS:
+        return True
+    strings = [string for string in node.find_all(string=True) if string.strip()]
+    if not strings:
+        return False
+    return all(any(parent.name in CODE_TAGS for parent in string.parents if parent is not node)
+               for string in strings)
+
+
+def is_roman_numeral(text, node=None):
+    """章节编号形式的大写罗马数字：带结尾标点，或者位于标题标签中"""
+    match = ROMAN_NUMERAL_PATTERN.match(text)
+    if match is None or text.rstrip('.):') == 'I':
+        return False
+    return bool(match.group(1)) or (node is not None and node.name in HEADING_TAGS)
+
+
+def skip_reason(text, node=None):
+    """判断片段是否完全不需要翻译，返回原因，需要进一步处理时返回 None
+
+    text 为片段的纯文本；node 为对应的已解析节点（可选），用于识别代码标签。
+    """
+    stripped = text.strip()
+    if not stripped:
+        return "空白"
+    if not has_latin(stripped):
+        return "没有英文字母"
+    if chinese_ratio(stripped) >= CHINESE_RATIO:
+        return "已是中文"
+    # 单独的 "I" 是英文单词；"mix"、"DC" 这类同形的单词和缩写需要翻译
+    if is_roman_numeral(stripped, node):
+        return "罗马数字"
+    if URL_PATTERN.match(stripped) or EMAIL_PATTERN.match(stripped):
+        return "网址"
+    if ISBN_PATTERN.match(stripped):
+        return "ISBN"
+    if is_code_node(node) or looks_like_code(stripped):
+        return "代码"
+    return None
+
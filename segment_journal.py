@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def segment_hash(source):
+    """计算片段原文的指纹，用于确认恢复时片段内容没有变化"""
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+class SegmentJournal:
+    """追加写入的片段日志（JSONL），取代整本书的 pickle 断点
+
+    每个片段翻译完成时只追加一行 {"doc", "index", "hash", "data"}，
+    写断点的代价只和新完成的工作量有关。恢复时按 (文档, 序号, 原文指纹)
+    精确跳过已经完成的段落。第一行保存书籍背景等元信息。
+
+    恢复时只为每个文档记录其片段在日志中的位置，查询某个文档时才读出它的译文，
+    并且只保留最近查询的一个文档，内存占用不随已完成的片段数增长。
+    """
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.lock = threading.Lock()
+        # 文档名 -> 该文档的片段记录在日志文件中的偏移量
+        self.offsets = {}
+        self.meta = {}
+        self._cached_doc = None
+        self._cached_entries = {}
+        if resume and os.path.exists(path):
+            end, newline = self._load()
+            # 截掉最后一条完整记录之后写了一半的内容，新记录不会接在残行后面
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+            self.file = open(path, 'a', encoding='utf-8')
+            if newline:
+                self.file.write("\n")
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+
+    def _load(self):
+        """读取日志，返回 (最后一条完整记录的结束位置, 该记录是否缺少换行符)"""
+        count = 0
+        end, newline = 0, False
+        with open(self.path, 'rb') as f:
+            offset = f.tell()
+            for line in iter(f.readline, b''):
+                record = self._parse(line)
+                if record is not None:
+                    if 'meta' in record:
+                        self.meta.update(record['meta'])
+                    else:
+                        self.offsets.setdefault(record['doc'], []).append(offset)
+                        count += 1
+                    end, newline = f.tell(), not line.endswith(b"\n")
+                offset = f.tell()
+        print(f"已加载片段日志，已完成片段 {count} 个")
+        return end, newline
+
+    @staticmethod
+    def _parse(line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            # 进程被强制结束时最后一行可能只写了一半
+            return None
+
+    def document_entries(self, doc):
+        """读出一个文档已完成的片段：{序号: (原文指纹, 译文)}"""
+        entries = {}
+        offsets = self.offsets.get(doc)
+        if not offsets:
+            return entries
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                record = self._parse(f.readline())
+                if record is not None:
+                    entries[record['index']] = (record['hash'], record['data'])
+        return entries
+
+    def _write(self, record):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def write_meta(self, **meta):
+        """记录书籍背景等元信息"""
+        self.meta.update(meta)
+        self._write({'meta': meta})
+
+    def lookup(self, doc, index, source_hash):
+        """返回已完成片段的译文；没有记录或原文已变化时返回 None"""
+        if doc != self._cached_doc:
+            self._cached_doc, self._cached_entries = doc, self.document_entries(doc)
+        entry = self._cached_entries.get(index)
+        if entry is None or entry[0] != source_hash:
+            return None
+        return entry[1]
+
+    def record(self, doc, index, source_hash, data):
+        """追加一个完成的片段"""
+        self._write({'doc': doc, 'index': index, 'hash': source_hash, 'data': data})
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def remove(self):
+        """翻译全部完成后删除日志文件"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
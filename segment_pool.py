@@ -0,0 +1,187 @@
+"""多个翻译任务共用的片段工作池
+
+工作项是 (翻译器, (批次, 装配器, 词汇表))，由固定数量的工作线程（或一个后台线程中运行的异步引擎）执行，
+同时运行的请求数由工作池的大小决定，不随同时翻译的书籍数成倍增长。不同提交方（不同的书或不同的翻译任务）
+的工作按轮转顺序领取，后加入的书不必等前面的书已经提交的工作全部完成。
+"""
+import asyncio
+import collections
+import contextlib
+import threading
+import traceback
+
+
+class SegmentPool:
+    """片段工作池
+
+    engine: "threads" 使用 num_threads 个工作线程；"async" 在一个后台线程的事件循环中运行 concurrency 个协程
+    wrap_thread: 包装工作线程入口函数的函数（例如 StageProfiler.wrap_thread），使 cProfile 也覆盖工作线程
+    daemon: 工作线程是否为守护线程；与进程同生命周期、不会被显式关闭的工作池（界面的任务管理器）需要设为 True
+
+    翻译器的 stop_event 被设置后，它还没有开始的工作直接跳过，不影响其他翻译器的工作。
+    """
+    def __init__(self, engine="threads", num_threads=5, concurrency=50, wrap_thread=None, daemon=False):
+        self.engine = engine
+        self.size = concurrency if engine == "async" else num_threads
+        self.cond = threading.Condition()
+        # 提交方 -> 还没有被领取的工作，order 是轮转顺序
+        self.pending = {}
+        self.order = collections.deque()
+        # 翻译器 -> 已提交但还没有执行完的工作数
+        self.outstanding = collections.Counter()
+        self.closed = False
+        # 异步引擎的事件循环、唤醒等待工作的协程的事件，以及各翻译器在该事件循环中的异步客户端
+        self.loop = None
+        self.wakeup = None
+        self.async_clients = {}
+        wrap_thread = wrap_thread or (lambda target: target)
+        if engine == "async":
+            print(f"使用异步引擎，最大并发请求数 {concurrency}")
+            self.threads = [threading.Thread(target=wrap_thread(asyncio.run), args=(self._run_async(),),
+                                             name="AsyncEngine", daemon=daemon)]
+        else:
+            self.threads = [threading.Thread(target=wrap_thread(self._run_thread), name=f"Thread-{index}", daemon=daemon)
+                            for index in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def attach(self, translator):
+        """翻译器开始使用工作池：按工作线程数扩大它的同步客户端连接池"""
+        if self.engine != "async":
+            translator.resize_client(self.size)
+
+    def submit(self, translator, work, key=None):
+        """提交一个工作 (批次, 装配器, 词汇表)；key 是轮转分配的单位，默认每个翻译器一份"""
+        key = translator if key is None else key
+        with self.cond:
+            if key not in self.pending:
+                self.pending[key] = collections.deque()
+                self.order.append(key)
+            self.pending[key].append((translator, work))
+            self.outstanding[translator] += 1
+            self.cond.notify()
+        self._wake_async()
+
+    def queued(self, key):
+        """提交方还没有被领取的工作数"""
+        with self.cond:
+            return len(self.pending.get(key, ()))
+
+    def drain(self, translator):
+        """等待翻译器已提交的工作全部结束（已停止的翻译器的剩余工作会被跳过）"""
+        with self.cond:
+            while self.outstanding[translator]:
+                self.cond.wait()
+            del self.outstanding[translator]
+
+    def release(self, translator):
+        """翻译器不再使用工作池：等待它的工作结束并关闭它在异步引擎中的客户端"""
+        self.drain(translator)
+        if self.loop is not None and self.loop.is_running() and translator in self.async_clients:
+            asyncio.run_coroutine_threadsafe(self._close_clients(translator), self.loop).result()
+
+    def close(self):
+        """不再接受工作，等待已提交的工作完成后结束所有工作线程"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self._wake_async()
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _take(self):
+        """按轮转顺序取出下一个工作，没有时返回 None；调用方需持有 cond"""
+        if not self.order:
+            return None
+        key = self.order[0]
+        items = self.pending[key]
+        item = items.popleft()
+        if items:
+            self.order.rotate(-1)
+        else:
+            self.order.popleft()
+            del self.pending[key]
+        return item
+
+    def _done(self, translator):
+        with self.cond:
+            self.outstanding[translator] -= 1
+            if not self.outstanding[translator]:
+                self.cond.notify_all()
+
+    def _run_thread(self):
+        while True:
+            with self.cond:
+                item = self._take()
+                while item is None and not self.closed:
+                    self.cond.wait()
+                    item = self._take()
+            if item is None:
+                return
+            translator, work = item
+            try:
+                if not translator.stop_event.is_set():
+                    translator.translate_batch(*work)
+            except Exception:
+                print(f"{threading.current_thread().name}发生异常")
+                traceback.print_exc()
+            finally:
+                self._done(translator)
+
+    def _wake_async(self):
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.wakeup.set)
+            except RuntimeError:
+                # 事件循环已经结束
+                pass
+
+    async def _run_async(self):
+        self.wakeup = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        clients_lock = asyncio.Lock()
+
+        async def run():
+            while True:
+                # 先清除再取工作：两者之间没有 await，其他线程提交的唤醒不会丢失
+                self.wakeup.clear()
+                with self.cond:
+                    item = self._take()
+                    closed = self.closed
+                if item is None:
+                    if closed:
+                        return
+                    await self.wakeup.wait()
+                    continue
+                translator, work = item
+                batch = work[0]
+                try:
+                    if not translator.stop_event.is_set():
+                        async with clients_lock:
+                            if translator not in self.async_clients:
+                                stack = contextlib.AsyncExitStack()
+                                await translator.open_async_clients(stack, self.size)
+                                self.async_clients[translator] = stack
+                        await translator.atranslate_batch(*work)
+                except Exception:
+                    print(f"翻译片段时发生异常: {batch[0].document.item.file_name}#{batch[0].index}")
+                    traceback.print_exc()
+                finally:
+                    self._done(translator)
+
+        try:
+            await asyncio.gather(*(run() for _ in range(self.size)))
+        finally:
+            for translator in list(self.async_clients):
+                await self._close_clients(translator)
+
+    async def _close_clients(self, translator):
+        stack = self.async_clients.pop(translator, None)
+        if stack is not None:
+            await stack.aclose()
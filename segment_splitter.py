@@ -0,0 +1,80 @@
+"""在句子边界切分过长的片段，分别翻译后按顺序拼接
+
+模型的输出token数有上限，译文超过上限会被截断（finish_reason 为 "length"）。
+预计译文超过上限的片段先切成若干块，每块的预计译文都不超过上限，各块可以并发翻译。
+遮蔽后的文本只在占位符之外切分，拼接后的译文仍能整体还原标签。完整HTML切开后标签不再成对，
+调用方不应对其切分。
+"""
+import re
+
+from markup_mask import PLACEHOLDER_PATTERN
+from rate_limiter import estimate_tokens
+
+# 按 estimate_tokens 的估算方式，英文译成中文后的token数约为原文的倍数（偏保守）
+OUTPUT_TOKEN_RATIO = 1.5
+
+# 切分翻译后拼接的译文估算token数低于原文的这个比例时，认为有块的译文丢失
+MIN_OUTPUT_RATIO = 0.5
+
+# 句末标点（可带后引号或右括号）之后的空白处
+SENTENCE_BREAK_PATTERN = re.compile(r'(?<=[.!?;。！？；…])["\'”’)\]]*\s+')
+
+
+def estimate_output_tokens(text):
+    """估算 text 译成中文后的token数"""
+    return int(estimate_tokens(text) * OUTPUT_TOKEN_RATIO)
+
+
+def output_too_short(source, translated):
+    """拼接后的译文是否明显短于原文（中文译文的估算token数通常不少于原文）"""
+    return estimate_tokens(translated) < MIN_OUTPUT_RATIO * estimate_tokens(source)
+
+
+def sentence_breaks(text):
+    """返回可以切分的位置（句末空白之后），位于成对占位符 ⟦n⟧…⟦/n⟧ 之内的位置除外"""
+    depth_changes = []
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        closing, _index, empty = match.groups()
+        if not empty:
+            depth_changes.append((match.start(), -1 if closing else 1))
+    breaks = []
+    depth = 0
+    changes = iter(depth_changes)
+    change = next(changes, None)
+    for match in SENTENCE_BREAK_PATTERN.finditer(text):
+        while change is not None and change[0] < match.end():
+            depth += change[1]
+            change = next(changes, None)
+        if depth == 0 and match.end() < len(text):
+            breaks.append(match.end())
+    return breaks
+
+
+def split_sentences(text):
+    """把 text 切成句子，句间空白留在前一句末尾，各句首尾相接等于原文"""
+    pieces = []
+    start = 0
+    for end in sentence_breaks(text):
+        pieces.append(text[start:end])
+        start = end
+    pieces.append(text[start:])
+    return pieces
+
+
+def split_text(text, max_output_tokens):
+    """把 text 按句子合并成预计译文不超过 max_output_tokens 的若干块
+
+    不需要切分时返回 [text]；单个句子本身超过上限时该句单独成块。
+    """
+    if estimate_output_tokens(text) <= max_output_tokens:
+        return [text]
+    chunks = []
+    current = ""
+    for sentence in split_sentences(text):
+        if current and estimate_output_tokens(current + sentence) > max_output_tokens:
+            chunks.append(current)
+            current = sentence
+        else:
+            current += sentence
+    chunks.append(current)
+    return chunks
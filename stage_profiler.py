@@ -0,0 +1,131 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+# 未启用分析时所有计时区间共用的空上下文，开销可以忽略
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class StageProfiler:
+    """按阶段统计耗时的分析器
+
+    用 span("阶段名") 包住各个阶段（读取EPUB、翻译目录、解析、词汇表、等待API、写出等），
+    汇总每个阶段的次数、总耗时和最长耗时。并发的线程或协程中的区间会各自累加，
+    因此各阶段总耗时之和可以超过实际经过的时间。
+    可选地记录每个区间生成 Chrome trace（chrome://tracing、Perfetto 可直接打开），
+    或对主线程和工作线程运行 cProfile 并合并输出。
+    """
+    def __init__(self, enabled=False, trace=False, cprofile=False):
+        self.enabled = enabled or trace or cprofile
+        self.trace = trace
+        self.cprofile = cprofile
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.events = []
+        self.profiles = []
+        self.main_profile = None
+
+    def span(self, name):
+        """返回一个计时上下文；未启用时返回空上下文"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, started, time.perf_counter())
+
+    def add(self, name, started, finished):
+        """记录一个已经结束的区间"""
+        elapsed = finished - started
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            stage['count'] += 1
+            stage['total'] += elapsed
+            stage['max'] = max(stage['max'], elapsed)
+            if self.trace:
+                self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (started - self.started) * 1e6, 'dur': elapsed * 1e6})
+
+    def start(self):
+        """开始对调用线程运行 cProfile"""
+        if self.cprofile and self.main_profile is None:
+            self.main_profile = cProfile.Profile()
+            self.main_profile.enable()
+
+    def stop(self):
+        if self.main_profile is not None:
+            self.main_profile.disable()
+            with self.lock:
+                self.profiles.append(self.main_profile)
+            self.main_profile = None
+
+    def wrap_thread(self, target):
+        """包装工作线程的入口函数，使 cProfile 也覆盖该线程"""
+        if not self.cprofile:
+            return target
+
+        def run(*args, **kwargs):
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self.lock:
+                    self.profiles.append(profile)
+        return run
+
+    def summary(self):
+        """各阶段耗时汇总，按总耗时从高到低排序"""
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1]['total'], reverse=True)
+            return {
+                'wall_seconds': round(time.perf_counter() - self.started, 4),
+                'stages': {name: {'count': stage['count'], 'total_seconds': round(stage['total'], 4),
+                                  'mean_seconds': round(stage['total'] / stage['count'], 6),
+                                  'max_seconds': round(stage['max'], 4)}
+                           for name, stage in stages},
+            }
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = [f"{name}: {stage['count']} 次，总耗时 {stage['total_seconds']:.3f}s，"
+                 f"平均 {stage['mean_seconds'] * 1000:.2f}ms，最长 {stage['max_seconds'] * 1000:.2f}ms"
+                 for name, stage in summary['stages'].items()]
+        lines.append(f"总经过时间 {summary['wall_seconds']:.3f}s（并发阶段的耗时会累加）")
+        return "\n".join(lines)
+
+    def write_summary(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def write_trace(self, path):
+        """写出 Chrome trace 事件文件"""
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def write_cprofile(self, path):
+        """合并所有线程的 cProfile 结果并写出，可用 pstats 或 snakeviz 查看"""
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# 测试直接导入仓库根目录下的模块
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def translator(monkeypatch):
+    """不连接真实服务的翻译器，API调用由各测试替换"""
+    from epubtranslator import EpubTranslator
+    for name in ('API_KEY_2', 'BASE_URL_2', 'ENDPOINTS_FILE', 'HTML_PARSER'):
+        monkeypatch.delenv(name, raising=False)
+    translator = EpubTranslator(api_key="test", api_base="http://127.0.0.1:9/v1", model_name="test",
+                                use_cache=False, max_output_tokens=200)
+    yield translator
+    translator.close()
@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from endpoint_pool import Endpoint, EndpointPool, create_endpoints, endpoints_from_env, load_endpoints
+from epubtranslator import EpubTranslator, TranslationRequest
+from translation_memory import TranslationMemory
+
+
+def make_pool(**kwargs):
+    return EndpointPool([Endpoint("a", model="m1"), Endpoint("b", model="m2")], **kwargs)
+
+
+def test_acquire_balances_outstanding_and_avoids_excluded():
+    pool = make_pool()
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.name, second.name} == {"a", "b"}
+    pool.release(first, 0.1)
+    assert pool.acquire(exclude=second) is first
+    # 唯一健康的端点被排除时仍然选中它
+    pool.eject(first, "测试")
+    assert pool.acquire(exclude=second) is second
+
+
+def test_consecutive_failures_eject_until_success():
+    pool = make_pool(eject_failures=2)
+    a, b = pool.endpoints
+    a.outstanding = 3
+    assert not pool.release(a, failed=True)
+    assert pool.release(a, failed=True)
+    assert a.ejected() and pool.has_alternative(a) and not pool.has_alternative(b)
+    # 剔除前发出的请求随后失败不会延长剔除时间
+    until = a.ejected_until
+    assert not pool.release(a, failed=True)
+    assert a.ejected_until == until and a.outstanding == 0
+
+
+def test_release_without_latency_does_not_reset_failures():
+    pool = make_pool(eject_failures=3)
+    a = pool.endpoints[0]
+    a.outstanding = 2
+    pool.release(a, failed=True)
+    pool.release(a)
+    assert a.failures == 1 and not a.latencies
+
+
+def test_slow_endpoint_is_ejected_by_median():
+    pool = make_pool(min_samples=3, latency_factor=3.0, latency_margin=1.0)
+    a, b = pool.endpoints
+    a.outstanding = b.outstanding = 10
+    for _ in range(3):
+        pool.release(a, 0.5)
+    # 个别长请求不影响中位数
+    assert not pool.release(b, 20.0)
+    pool.release(b, 0.6)
+    assert not pool.release(b, 0.7)
+    for _ in range(2):
+        pool.release(b, 5.0)
+    assert b.ejected() and not b.latencies
+
+
+def test_endpoints_from_env(monkeypatch):
+    monkeypatch.setenv('API_KEY_2', "k2")
+    monkeypatch.setenv('MODEL_NAME_2', "m2")
+    monkeypatch.setenv('RATE_LIMIT_RPM_2', "30")
+    monkeypatch.delenv('BASE_URL_2', raising=False)
+    monkeypatch.delenv('API_KEY_3', raising=False)
+    monkeypatch.delenv('BASE_URL_3', raising=False)
+    configs = endpoints_from_env("k1", "http://example/v1", "m1")
+    endpoints = create_endpoints(configs)
+    assert [(endpoint.name, endpoint.api_key, endpoint.base_url, endpoint.model) for endpoint in endpoints] == [
+        ("default", "k1", "http://example/v1", "m1"), ("endpoint2", "k2", "http://example/v1", "m2")]
+    assert not endpoints[0].rate_limiter.enabled
+    assert endpoints[1].rate_limiter.requests_per_minute == 30
+
+
+def test_load_endpoints_reads_key_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('SECOND_KEY', "secret")
+    path = tmp_path / "endpoints.json"
+    path.write_text(json.dumps({'endpoints': [{'model': "m1", 'api_key': "k1"},
+                                              {'model': "m2", 'api_key_env': "SECOND_KEY", 'weight': 2}]}))
+    endpoints = create_endpoints(load_endpoints(path))
+    assert [endpoint.name for endpoint in endpoints] == ["endpoint1", "endpoint2"]
+    assert endpoints[1].api_key == "secret" and endpoints[1].weight == 2
+
+
+@pytest.fixture
+def pooled_translator(monkeypatch, tmp_path):
+    for name in ('ENDPOINTS_FILE', 'RATE_LIMIT_RPM', 'RATE_LIMIT_TPM'):
+        monkeypatch.delenv(name, raising=False)
+    translator = EpubTranslator(use_cache=False, requests_per_minute=60, endpoints=[
+        {'name': "a", 'api_key': "a", 'base_url': "http://127.0.0.1:9/v1", 'model': "m1"},
+        {'name': "b", 'api_key': "b", 'base_url': "http://127.0.0.1:9/v2", 'model': "m2", 'requests_per_minute': 30}])
+    translator.translation_memory = TranslationMemory(str(tmp_path / "memory.db"))
+    yield translator
+    translator.translation_memory.close()
+    translator.close()
+
+
+def test_rate_limit_applies_per_key(pooled_translator):
+    translator = pooled_translator
+    a, b = translator.endpoints
+    # RATE_LIMIT_RPM 是第一个端点的额度，不再限制所有端点的总速率
+    assert not translator.rate_limiter.enabled
+    assert a.rate_limiter.requests_per_minute == 60
+    assert b.rate_limiter.requests_per_minute == 30
+
+
+def test_memory_is_keyed_by_answering_model(pooled_translator, monkeypatch):
+    translator = pooled_translator
+    a, b = translator.endpoints
+    monkeypatch.setattr(translator.endpoints, 'acquire', lambda exclude=None: b.__setattr__('outstanding', 1) or b)
+    monkeypatch.setattr(translator, 'read_completion', lambda client, params, cancelled=None:
+                        (f"译文（{params['model']}）", "stop", None))
+
+    request = TranslationRequest("system", "Hello there.", "Hello there.")
+    tresult = translator.cached_completion(request)
+    assert tresult.data == "译文（m2）" and tresult.model == "m2"
+    memory = translator.translation_memory
+    assert memory.get(translator.cache_key(request, "m2")) == "译文（m2）"
+    assert memory.get(translator.cache_key(request, "m1")) is None
+
+    # 之后由其他端点处理时仍能复用这条译文
+    cached = translator.lookup_cache(TranslationRequest("system", "Hello there.", "Hello there."))
+    assert cached.data == "译文（m2）" and cached.model == "m2"
@@ -0,0 +1,67 @@
+import zipfile
+
+import pytest
+
+from epub_archive import EpubArchive, EpubWriter
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+OPF = """<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="extra" href="text/extra.xhtml" media-type="application/xhtml+xml"/>
+    <item id="ch2" href="text/chapter%202.xhtml" media-type="application/xhtml+xml"/>
+    <item id="ch1" href="text/ch1.xhtml" media-type="application/xhtml+xml"/>
+    <item id="css" href="style.css" media-type="text/css"/>
+  </manifest>
+  <spine><itemref idref="ch1"/><itemref idref="ch2"/></spine>
+</package>"""
+
+
+@pytest.fixture
+def book(tmp_path):
+    path = str(tmp_path / "book.epub")
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", CONTAINER)
+        zf.writestr("OEBPS/content.opf", OPF)
+        for name in ("nav.xhtml", "text/extra.xhtml", "text/chapter 2.xhtml", "text/ch1.xhtml"):
+            zf.writestr(f"OEBPS/{name}", f"<html><body><p>{name}</p></body></html>")
+        zf.writestr("OEBPS/style.css", "p { margin: 0 }" * 100)
+    return path
+
+
+def test_reads_manifest_in_reading_order(book):
+    with EpubArchive(book) as archive:
+        assert archive.opf_path == "OEBPS/content.opf"
+        # 书脊中的文档在前，其余文档按清单顺序排在最后；href 中的转义字符被还原
+        assert [item.zip_name for item in archive.documents()] == [
+            "OEBPS/text/ch1.xhtml", "OEBPS/text/chapter 2.xhtml", "OEBPS/nav.xhtml", "OEBPS/text/extra.xhtml"]
+        assert archive.find(nav=True).id == "nav"
+        assert archive.find("text/css").zip_name == "OEBPS/style.css"
+        assert archive.find("application/x-dtbncx+xml") is None
+        assert archive.resolve("../images/a.png#frag") == "images/a.png"
+
+
+def test_writer_copies_entries_without_recompressing(book, tmp_path):
+    output = str(tmp_path / "out.epub")
+    with EpubArchive(book) as archive, EpubWriter(output) as writer:
+        for info in archive.entries():
+            writer.copy(archive, info)
+        assert not writer.write("OEBPS/style.css", b"")
+        assert writer.write("OEBPS/new.xhtml", b"<html/>")
+
+    with zipfile.ZipFile(book) as source, zipfile.ZipFile(output) as target:
+        assert target.testzip() is None
+        infos = target.infolist()
+        # mimetype 是第一个不压缩的条目，且只写出一次
+        assert infos[0].filename == "mimetype" and infos[0].compress_type == zipfile.ZIP_STORED
+        assert [info.filename for info in infos].count("mimetype") == 1
+        for info in source.infolist():
+            assert target.read(info.filename) == source.read(info.filename)
+            assert target.getinfo(info.filename).compress_size == info.compress_size
+        assert target.read("OEBPS/new.xhtml") == b"<html/>"
@@ -0,0 +1,52 @@
+import json
+
+from epubtranslator import EpubTranslator
+from glossary_matcher import GlossaryMatcher
+
+
+def test_leftmost_longest_replacement():
+    matcher = GlossaryMatcher({"Middle": "中间", "Middle-earth": "中土", "earth": "大地", "Shire": "夏尔", "": "空"})
+    assert matcher.size == 4
+    text, replaced = matcher.replace("Middle-earth and the Shire, the middle of the earth")
+    assert text == "中土 and the 夏尔, the middle of the 大地"
+    assert replaced == [("Middle-earth", "中土"), ("Shire", "夏尔"), ("earth", "大地")]
+
+
+def test_overlapping_terms_found_through_failure_links():
+    matcher = GlossaryMatcher({"he": "他", "she": "她", "hers": "她的"})
+    assert sorted((start, length) for start, length, _state in matcher.find("ushers")) == [(1, 3), (2, 2), (2, 4)]
+    assert matcher.replace("ushers") == ("u她rs", [("she", "她")])
+    assert GlossaryMatcher({}).replace("text") == ("text", [])
+
+
+def test_compiled_matcher_is_cached(tmp_path, capsys):
+    glossary = {"Frodo": "弗罗多"}
+    GlossaryMatcher.load_or_build(glossary, "v1", str(tmp_path))
+    matcher = GlossaryMatcher.load_or_build(glossary, "v1", str(tmp_path))
+    assert "已加载编译好的词汇表匹配器" in capsys.readouterr().out
+    assert matcher.replace("Frodo") == ("弗罗多", [("Frodo", "弗罗多")])
+
+
+def test_cache_is_json_and_tampered_cache_is_rebuilt(tmp_path, capsys):
+    glossary = {"Frodo": "弗罗多"}
+    GlossaryMatcher.load_or_build(glossary, "v1", str(tmp_path))
+    [cache_file] = tmp_path.iterdir()
+    cached = json.loads(cache_file.read_text(encoding='utf-8'))
+    assert cached['version'] == "v1" and cached['tables']['size'] == 1
+    cached['tables']['fail'].append(0)
+    cache_file.write_text(json.dumps(cached), encoding='utf-8')
+    matcher = GlossaryMatcher.load_or_build(glossary, "v1", str(tmp_path))
+    assert "重新编译" in capsys.readouterr().out
+    assert matcher.replace("Frodo") == ("弗罗多", [("Frodo", "弗罗多")])
+
+
+def test_translator_caches_matchers_by_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(EpubTranslator, 'TMP_DIR', str(tmp_path))
+    translator = EpubTranslator(use_cache=False)
+    glossary = {"Frodo": "弗罗多"}
+    matcher = translator.glossary_matcher(glossary)
+    assert translator.glossary_matcher(dict(glossary)) is matcher
+    # 修改后的词汇表不会沿用旧的匹配器
+    glossary["Sam"] = "山姆"
+    assert translator.glossary_matcher(glossary).replace("Sam")[0] == "山姆"
+    translator.close()
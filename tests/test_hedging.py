@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from epubtranslator import EpubTranslator
+from hedging import HedgePolicy
+
+ENDPOINTS = [{'name': "slow", 'api_key': "a", 'base_url': "http://127.0.0.1:9/v1", 'model': "slow-model"},
+             {'name': "fast", 'api_key': "b", 'base_url': "http://127.0.0.1:9/v2", 'model': "fast-model"}]
+
+
+def test_policy_waits_for_samples_and_caps_fraction():
+    policy = HedgePolicy(min_samples=3, max_fraction=0.5, min_delay=0.0)
+    assert policy.delay() is None
+    for latency in (0.1, 0.2, 0.3):
+        policy.record(latency)
+    assert policy.delay() == pytest.approx(0.3)
+    assert policy.try_hedge()
+    assert not policy.try_hedge()
+
+
+@pytest.fixture
+def hedging_translator(monkeypatch):
+    monkeypatch.delenv('ENDPOINTS_FILE', raising=False)
+    translator = EpubTranslator(use_cache=False, hedge=True, stream_completions=True, endpoints=[dict(config) for config in ENDPOINTS])
+    translator.hedge_policy = HedgePolicy(min_samples=1, max_fraction=1.0, min_delay=0.05)
+    translator.hedge_policy.record(0.0)
+    yield translator
+    translator.close()
+
+
+def test_hedge_winner_is_credited(hedging_translator, monkeypatch):
+    translator = hedging_translator
+    slow, fast = translator.endpoints
+
+    threads = {}
+
+    def read_completion(client, params, cancelled=None):
+        threads[params['model']] = threading.current_thread()
+        if client is slow.client:
+            cancelled.wait(2)
+            return "slow", "stop", None
+        return params['model'], "stop", None
+    monkeypatch.setattr(translator, 'read_completion', read_completion)
+
+    tresult = translator.chat_completion("system", "Hello there.")
+    assert tresult.result and tresult.data == "fast-model"
+    # 落选的原请求不记延迟，胜出的对冲请求的延迟和成功记在它自己的端点名下
+    assert slow.outstanding == 0 and fast.outstanding == 0
+    assert len(slow.latencies) == 0
+    assert len(fast.latencies) == 1 and fast.latency < 0.5
+    assert translator.metrics.endpoint_calls == {'fast': {'model': 'fast-model', 'ok': 1, 'failed': 0, 'ejections': 0}}
+    # 原请求在调用线程中发送，只有对冲请求使用线程池
+    assert threads["slow-model"] is threading.current_thread()
+    assert threads["fast-model"] is not threading.current_thread()
+    # 分位数按原请求发出时算起的等待时间统计，包括发送对冲请求前等待的时间
+    assert 0.05 <= translator.hedge_policy.latencies[-1] < 0.5
+
+
+def test_primary_failure_waits_for_hedge(hedging_translator, monkeypatch):
+    translator = hedging_translator
+    slow, fast = translator.endpoints
+
+    def read_completion(client, params, cancelled=None):
+        if client is slow.client:
+            time.sleep(0.2)
+            raise RuntimeError("primary failed")
+        time.sleep(0.3)
+        return params['model'], "stop", None
+    monkeypatch.setattr(translator, 'read_completion', read_completion)
+
+    output, answered, _latency = translator.hedged_completion(translator.completion_params("system", "Hello."), slow)
+    assert output[0] == "fast-model" and answered is fast
+    assert translator.metrics.report()['hedging'] == {'hedged': 1, 'hedge_wins': 1}
+
+
+def test_non_streaming_request_is_not_hedged(hedging_translator, monkeypatch):
+    translator = hedging_translator
+    slow, _fast = translator.endpoints
+    monkeypatch.setattr(translator, 'read_completion', lambda client, params, cancelled=None:
+                        time.sleep(0.1) or ("slow", "stop", None))
+    params = dict(translator.completion_params("system", "Hello."), stream=False)
+    output, answered, _latency = translator.hedged_completion(params, slow)
+    assert output[0] == "slow" and answered is slow
+    assert translator.metrics.report()['hedging']['hedged'] == 0
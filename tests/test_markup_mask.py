@@ -0,0 +1,34 @@
+from bs4 import BeautifulSoup
+
+from glossary_matcher import GlossaryMatcher
+from markup_mask import MaskedSegment
+
+
+def paragraph(html):
+    return BeautifulSoup(html, "html.parser").p
+
+
+def test_inline_tags_become_placeholders_and_restore():
+    node = paragraph('<p class="x">Read <a href="ch2.xhtml"><i>this</i></a> now.<br/></p>')
+    masked = MaskedSegment.create(node)
+    assert masked.text == "Read ⟦1⟧⟦2⟧this⟦/2⟧⟦/1⟧ now.⟦3/⟧"
+    restored = masked.restore("现在读⟦1⟧⟦2⟧这个⟦/2⟧⟦/1⟧。⟦3/⟧")
+    assert str(restored) == '<p class="x">现在读<a href="ch2.xhtml"><i>这个</i></a>。<br/></p>'
+
+
+def test_restore_rejects_broken_structure():
+    masked = MaskedSegment.create(paragraph("<p>A <b>bold</b> and <i>italic</i> word.</p>"))
+    # 缺少占位符、交叉嵌套、重复出现或编号不存在时都无法还原
+    assert masked.restore("一个⟦1⟧粗体⟦/1⟧词。") is None
+    assert masked.restore("⟦1⟧粗⟦2⟧体⟦/1⟧斜⟦/2⟧") is None
+    assert masked.restore("⟦1⟧粗⟦/1⟧⟦1⟧粗⟦/1⟧⟦2⟧斜⟦/2⟧") is None
+    assert masked.restore("⟦1⟧粗⟦/1⟧⟦2⟧斜⟦/2⟧⟦3/⟧") is None
+    assert masked.restore("⟦2⟧斜体⟦/2⟧和⟦1⟧粗体⟦/1⟧") is not None
+
+
+def test_text_filter_and_placeholder_characters():
+    matcher = GlossaryMatcher({"Gandalf": "甘道夫"})
+    masked = MaskedSegment.create(paragraph("<p>Gandalf met <b>Frodo</b>.</p>"), text_filter=matcher.replace)
+    assert masked.text == "甘道夫 met ⟦1⟧Frodo⟦/1⟧." and masked.replaced == [("Gandalf", "甘道夫")]
+    # 原文本身含有占位符字符时不遮蔽
+    assert MaskedSegment.create(paragraph("<p>Odd ⟦1⟧ text</p>")) is None
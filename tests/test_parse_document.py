@@ -0,0 +1,61 @@
+import pytest
+
+from epubtranslator import well_formed_xhtml
+
+XHTML = (b'<?xml version="1.0" encoding="utf-8"?>\n'
+         b'<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n'
+         b'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><body>'
+         b'<section epub:type="chapter"><p>Mr.&nbsp;Smith said&mdash;hello<a id="x"/> again &amp; again.<br/></p>'
+         b'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+         b'<image xlink:href="cover.jpg"/></svg></section></body></html>')
+
+
+def test_default_parser_keeps_named_entities(translator):
+    soup = translator.parse_document(XHTML, "application/xhtml+xml")
+    assert soup.p.get_text() == "Mr.\xa0Smith said—hello again & again."
+
+
+def test_default_parser_keeps_self_closing_tags(translator):
+    soup = translator.parse_document(XHTML, "application/xhtml+xml")
+    assert soup.find("a", id="x").contents == []
+
+
+def test_xhtml_is_parsed_as_xml_and_round_trips(translator):
+    pytest.importorskip("lxml")
+    assert translator.html_parser == "lxml-xml"
+    soup = translator.parse_document(XHTML, "application/xhtml+xml")
+    assert soup.is_xml
+    output = str(soup)
+    for markup in ('xmlns:epub="http://www.idpf.org/2007/ops"', '<section epub:type="chapter">', '<a id="x"/>',
+                   '<br/>', '<image xlink:href="cover.jpg"/>', 'again &amp; again', 'Mr.\xa0Smith said—hello'):
+        assert markup in output
+
+
+@pytest.mark.parametrize("content", [
+    # 标签不配对：XML 解析器的容错模式会丢弃内容
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><body><p>a<b>b</p><p>c</p></body></html>',
+    # 未知实体
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><body><p>a &madeup; b</p></body></html>',
+    # 内部 DTD 子集
+    b'<?xml version="1.0"?><!DOCTYPE html [<!ENTITY x "y">]><html><body><p>&x;</p></body></html>',
+])
+def test_malformed_xhtml_falls_back_to_html_parser(translator, content):
+    pytest.importorskip("lxml")
+    assert well_formed_xhtml(content) is None
+    soup = translator.parse_document(content, "application/xhtml+xml")
+    assert not soup.is_xml and len(soup.find_all("p")) >= 1
+
+
+def test_html_documents_are_not_parsed_as_xml(translator):
+    pytest.importorskip("lxml")
+    soup = translator.parse_document(b"<html><body><p>A&nbsp;B<br>C</p></body></html>", "text/html")
+    assert not soup.is_xml and soup.p.get_text() == "A\xa0BC"
+
+
+def test_unsupported_parser_falls_back_to_default(monkeypatch):
+    from epubtranslator import DEFAULT_HTML_PARSER, EpubTranslator
+    monkeypatch.delenv('ENDPOINTS_FILE', raising=False)
+    translator = EpubTranslator(api_key="test", api_base="http://127.0.0.1:9/v1", model_name="test",
+                                use_cache=False, html_parser="lxml")
+    assert translator.html_parser == DEFAULT_HTML_PARSER
+    translator.close()
@@ -0,0 +1,46 @@
+import email.utils
+import time
+
+import pytest
+
+from rate_limiter import RateLimiter, estimate_tokens, parse_retry_after
+
+
+def test_request_bucket_queues_callers_in_order():
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(60):
+        assert limiter.reserve() == 0
+    # 额度用完后每个请求按先来后到各自多等一秒
+    assert limiter.reserve() == pytest.approx(1, abs=0.05)
+    assert limiter.reserve() == pytest.approx(2, abs=0.05)
+
+
+def test_token_bucket_and_usage_correction():
+    limiter = RateLimiter(tokens_per_minute=600)
+    assert limiter.reserve(500) == 0
+    # 超过整桶容量的请求按整桶计算
+    assert limiter.reserve(10000) == pytest.approx(50, abs=0.5)
+    limiter.record_usage(500, 200)
+    assert limiter.reserve(0) == pytest.approx(20, abs=0.5)
+
+
+def test_penalize_and_disabled_limiter():
+    limiter = RateLimiter()
+    assert not limiter.enabled and limiter.reserve(10 ** 6) == 0
+    limiter.penalize(3)
+    assert limiter.reserve() == pytest.approx(3, abs=0.05)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({'retry-after-ms': "1500"}) == 1.5
+    assert parse_retry_after({'Retry-After': "7"}) == 7
+    assert parse_retry_after({'retry-after': "soon"}) is None
+    assert parse_retry_after(None) is None
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert parse_retry_after({'retry-after': date}) == pytest.approx(30, abs=2)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 3
+    assert estimate_tokens("中文abcd") == 4
@@ -0,0 +1,56 @@
+import httpx
+import openai
+
+from retry_policy import FATAL, RATE_LIMITED, RETRYABLE, RetryPolicy, classify_error, endpoint_error
+
+REQUEST = httpx.Request("POST", "http://127.0.0.1:9/v1/chat/completions")
+
+
+def status_error(cls, status, headers=None, body=None):
+    return cls("error", response=httpx.Response(status, request=REQUEST, headers=headers or {}), body=body)
+
+
+def test_classify_error():
+    assert classify_error(status_error(openai.RateLimitError, 429, {'retry-after': "2"})) == (RATE_LIMITED, 2)
+    quota = status_error(openai.RateLimitError, 429, body={'code': "insufficient_quota"})
+    assert classify_error(quota) == (FATAL, None) and endpoint_error(quota)
+    assert classify_error(status_error(openai.InternalServerError, 503, {'retry-after': "5"})) == (RETRYABLE, 5)
+    assert classify_error(status_error(openai.ConflictError, 409)) == (RETRYABLE, None)
+    assert classify_error(status_error(openai.BadRequestError, 400)) == (FATAL, None)
+    assert classify_error(openai.APIConnectionError(request=REQUEST)) == (RETRYABLE, None)
+    assert classify_error(httpx.ReadError("reset")) == (RETRYABLE, None)
+    assert classify_error(ValueError("bad")) == (FATAL, None)
+
+
+def test_endpoint_error():
+    assert endpoint_error(status_error(openai.AuthenticationError, 401))
+    assert endpoint_error(status_error(openai.NotFoundError, 404))
+    assert not endpoint_error(status_error(openai.RateLimitError, 429))
+    assert not endpoint_error(status_error(openai.InternalServerError, 500))
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=8.0, seed=1)
+    for attempt in range(6):
+        ceiling = min(8.0, 2 ** attempt)
+        assert 0 <= policy.backoff(attempt) <= ceiling
+        assert ceiling / 2 <= policy.backoff(attempt, full_jitter=False) <= ceiling
+
+
+def test_retry_limits_and_budget():
+    policy = RetryPolicy(budget_ratio=0.5, min_budget=1, max_rate_limit_retries=2, seed=1)
+    for _ in range(2):
+        policy.record_attempt()
+    state = policy.start(max_retries=5)
+    assert state.next_delay(FATAL) is None and state.reason == "错误不可重试"
+    # 被限流的重试不占用预算，但有次数上限
+    assert state.next_delay(RATE_LIMITED, retry_after=3) >= 3
+    assert state.next_delay(RATE_LIMITED) is not None
+    assert state.next_delay(RATE_LIMITED) is None
+    # 预算为 1 + 0.5 * 2 = 2 次
+    assert state.next_delay(RETRYABLE) is not None
+    assert policy.start().next_delay(RETRYABLE, retry_after=10) >= 10
+    assert state.next_delay(RETRYABLE) is None and state.reason == "本次运行的重试预算已用完"
+    assert state.total == 3
+    policy.reset()
+    assert policy.start(max_retries=0).next_delay(RETRYABLE) is None
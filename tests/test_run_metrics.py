@@ -0,0 +1,41 @@
+import socket
+import urllib.request
+
+import pytest
+
+from run_metrics import RunMetrics
+
+
+def test_latency_samples_are_bounded():
+    metrics = RunMetrics(reservoir_size=100, seed=1)
+    for index in range(10000):
+        metrics.record_call(index / 1000)
+    assert len(metrics.latencies) == 100
+    latency = metrics.report()['latency_seconds']
+    # 总和、次数和最大值精确统计，分位数是抽样估计
+    assert latency['mean'] == pytest.approx(4.9995)
+    assert latency['max'] == 9.999
+    assert 3.5 < latency['p50'] < 6.5
+    text = metrics.prometheus_text()
+    assert "epubtranslator_api_latency_seconds_count 10000\n" in text
+
+
+def test_latency_report_without_calls():
+    latency = RunMetrics().report()['latency_seconds']
+    assert latency == {'p50': None, 'p95': None, 'p99': None, 'mean': None, 'max': None}
+
+
+def test_serve_releases_port():
+    metrics = RunMetrics()
+    metrics.record_call(0.5)
+    with metrics.serve(0) as server:
+        assert server is None
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    for _ in range(2):
+        # 同一端口可以在同一进程中重复使用
+        with metrics.serve(port) as server:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                assert b"epubtranslator_api_latency_seconds_count 1\n" in response.read()
+        assert server.socket.fileno() == -1
@@ -0,0 +1,59 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from segment_classifier import looks_like_code, skip_reason
+
+
+def node(html):
+    return next(iter(BeautifulSoup(html, 'html.parser').children))
+
+
+@pytest.mark.parametrize("text", [
+    "He walked for hours.\nfor a while (he thought) it was fine.\nif only: she said.",
+    "* First point about the plan.\n* Second point about the plan.",
+    "return to the village\nwhile the sun set\nif he could",
+    "He paused; the room went quiet;\nnobody moved;",
+    "// a note\n/* aside */",
+])
+def test_wrapped_prose_is_not_code(text):
+    assert not looks_like_code(text)
+    assert skip_reason(text) is None
+
+
+@pytest.mark.parametrize("text", [
+    "def main():\n    value = compute(1)\n    print(value);",
+    "int main() {\n    return 0;\n}",
+    "import os\nfrom sys import argv\npath = os.getcwd()",
+])
+def test_code_is_skipped(text):
+    assert skip_reason(text) == "代码"
+
+
+def test_code_tag_is_skipped():
+    assert skip_reason("for i in range(3): print(i)", node("<pre>for i in range(3): print(i)</pre>")) == "代码"
+
+
+@pytest.mark.parametrize("text", ["mix", "Mix", "DC", "CD", "MD", "LIV", "MIX", "I", "I.", "civil", "vi", "Did"])
+def test_words_and_abbreviations_are_translated(text):
+    assert skip_reason(text) is None
+
+
+@pytest.mark.parametrize("text", ["IV.", "XII)", "XLII:", "MMXXIV."])
+def test_numbered_headings_are_skipped(text):
+    assert skip_reason(text) == "罗马数字"
+
+
+def test_bare_numeral_in_heading_is_skipped():
+    assert skip_reason("XIV", node("<h2>XIV</h2>")) == "罗马数字"
+    assert skip_reason("XIV", node("<p>XIV</p>")) is None
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("   ", "空白"),
+    ("12345", "没有英文字母"),
+    ("https://example.com/page", "网址"),
+    ("ISBN 978-0-306-40615-7", "ISBN"),
+    ("这是已经翻译好的中文 text", "已是中文"),
+])
+def test_other_skip_reasons(text, reason):
+    assert skip_reason(text) == reason
@@ -0,0 +1,69 @@
+import json
+
+from segment_journal import SegmentJournal, segment_hash
+
+
+def test_resume_looks_up_entries_per_document(tmp_path):
+    path = str(tmp_path / "book.journal")
+    journal = SegmentJournal(path)
+    journal.write_meta(book_background="背景")
+    journal.record("a.xhtml", 0, segment_hash("one"), "一")
+    journal.record("b.xhtml", 0, segment_hash("two"), "二")
+    journal.record("a.xhtml", 1, segment_hash("three"), "三")
+    journal.close()
+    # 强制结束时写了一半的最后一行被忽略
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"doc": "b.xhtml", "ind')
+
+    journal = SegmentJournal(path)
+    assert journal.meta == {'book_background': "背景"}
+    # 恢复时只记录位置，查询时才读出当前文档的译文
+    assert set(journal.offsets) == {"a.xhtml", "b.xhtml"} and len(journal.offsets["a.xhtml"]) == 2
+    assert journal.lookup("a.xhtml", 1, segment_hash("three")) == "三"
+    assert journal.lookup("a.xhtml", 0, segment_hash("changed")) is None
+    assert journal.lookup("b.xhtml", 0, segment_hash("two")) == "二"
+    assert list(journal._cached_entries) == [0]
+    assert journal.lookup("c.xhtml", 0, segment_hash("one")) is None
+    journal.remove()
+
+
+def test_resume_drops_torn_line_before_appending(tmp_path):
+    path = str(tmp_path / "book.journal")
+    journal = SegmentJournal(path)
+    journal.record("a.xhtml", 0, segment_hash("one"), "一")
+    journal.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"doc": "a.xhtml", "ind')
+
+    journal = SegmentJournal(path)
+    journal.record("a.xhtml", 1, segment_hash("two"), "二")
+    journal.close()
+    with open(path, encoding='utf-8') as f:
+        assert [json.loads(line)['index'] for line in f] == [0, 1]
+    journal = SegmentJournal(path)
+    assert journal.lookup("a.xhtml", 1, segment_hash("two")) == "二"
+    journal.close()
+
+
+def test_resume_keeps_record_without_newline(tmp_path):
+    path = str(tmp_path / "book.journal")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"doc": "a.xhtml", "index": 0, "hash": "%s", "data": "一"}' % segment_hash("one"))
+
+    journal = SegmentJournal(path)
+    journal.record("a.xhtml", 1, segment_hash("two"), "二")
+    journal.close()
+    journal = SegmentJournal(path)
+    assert journal.lookup("a.xhtml", 0, segment_hash("one")) == "一"
+    assert journal.lookup("a.xhtml", 1, segment_hash("two")) == "二"
+    journal.close()
+
+
+def test_without_resume_starts_empty(tmp_path):
+    path = str(tmp_path / "book.journal")
+    journal = SegmentJournal(path)
+    journal.record("a.xhtml", 0, segment_hash("one"), "一")
+    journal.close()
+    journal = SegmentJournal(path, resume=False)
+    assert journal.lookup("a.xhtml", 0, segment_hash("one")) is None
+    journal.close()
@@ -0,0 +1,64 @@
+import threading
+
+from segment_pool import SegmentPool
+
+
+class FakeTranslator:
+    def __init__(self, name, log, gate=None):
+        self.name = name
+        self.log = log
+        self.gate = gate
+        self.stop_event = threading.Event()
+        self.started = threading.Event()
+        self.client_size = None
+
+    def resize_client(self, size):
+        self.client_size = size
+
+    def translate_batch(self, batch, assembler, glossary):
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.log.append((self.name, batch))
+
+
+def test_books_are_taken_round_robin():
+    log = []
+    gate = threading.Event()
+    a = FakeTranslator("a", log, gate)
+    b = FakeTranslator("b", log, gate)
+    with SegmentPool(num_threads=1) as pool:
+        pool.attach(a)
+        assert a.client_size == 1
+        # 唯一的工作线程被第一个工作占住，其余工作都在排队
+        pool.submit(a, (0, None, None))
+        a.started.wait()
+        for index in range(1, 4):
+            pool.submit(a, (index, None, None))
+        for index in range(2):
+            pool.submit(b, (index, None, None))
+        assert pool.queued(a) == 3 and pool.queued(b) == 2
+        gate.set()
+        pool.drain(a)
+        pool.drain(b)
+    # 后提交的 b 不必等 a 已经提交的工作全部完成
+    assert log == [("a", 0), ("a", 1), ("b", 0), ("a", 2), ("b", 1), ("a", 3)]
+
+
+def test_stopped_translator_skips_remaining_work():
+    log = []
+    gate = threading.Event()
+    a = FakeTranslator("a", log, gate)
+    b = FakeTranslator("b", log)
+    with SegmentPool(num_threads=1) as pool:
+        pool.submit(a, (0, None, None))
+        a.started.wait()
+        for index in range(1, 3):
+            pool.submit(a, (index, None, None))
+        pool.submit(b, (0, None, None))
+        a.stop_event.set()
+        gate.set()
+        pool.release(a)
+        pool.release(b)
+    # 停止前已经开始的工作照常完成，其他翻译器不受影响
+    assert log == [("a", 0), ("b", 0)]
@@ -0,0 +1,36 @@
+import pytest
+
+from segment_splitter import estimate_output_tokens, output_too_short, sentence_breaks, split_sentences, split_text
+
+PARAGRAPH = " ".join(f"This is sentence number {index} of a rather long paragraph." for index in range(200))
+
+
+def test_split_sentences_round_trip():
+    assert "".join(split_sentences(PARAGRAPH)) == PARAGRAPH
+
+
+def test_split_text_round_trip_and_limit():
+    chunks = split_text(PARAGRAPH, 100)
+    assert len(chunks) > 1
+    assert "".join(chunks) == PARAGRAPH
+    assert all(estimate_output_tokens(chunk) <= 100 for chunk in chunks)
+
+
+def test_short_text_is_not_split():
+    assert split_text("Hello there. How are you?", 1000) == ["Hello there. How are you?"]
+
+
+def test_no_break_inside_placeholder_pair():
+    text = "First sentence. ⟦1⟧Inside one. Inside two.⟦/1⟧ Last sentence."
+    for position in sentence_breaks(text):
+        before = text[:position]
+        assert before.count("⟦1⟧") == before.count("⟦/1⟧")
+
+
+@pytest.mark.parametrize("translated, short", [
+    ("这是一个很长的段落的完整译文。" * 20, False),
+    ("这是", True),
+])
+def test_output_too_short(translated, short):
+    source = "This is a fairly long English paragraph that needs translating. " * 5
+    assert output_too_short(source, translated) is short
@@ -0,0 +1,41 @@
+"""切分翻译的端到端检查：用替身代替API调用，确认拼接后的译文不丢内容"""
+from epubtranslator import TranslationResult
+
+SENTENCES = " ".join(f"Sentence {index} goes on for a little while." for index in range(120))
+LONG_HTML = f'<p class="x">{SENTENCES} <em>Emphasised {SENTENCES}</em> {SENTENCES}</p>'
+
+
+def echo(calls):
+    """原样返回请求内容的替身，记录每次请求的内容"""
+    def chat_completion(system_prompt, content, max_retries=3, label="", max_tokens=None):
+        calls.append(content)
+        return TranslationResult(True, 0, content)
+    return chat_completion
+
+
+def test_full_html_is_not_split(translator, monkeypatch):
+    calls = []
+    monkeypatch.setattr(translator, 'chat_completion', echo(calls))
+    tresult = translator.translate_html(LONG_HTML, mask=False)
+    assert tresult.result
+    assert calls == [LONG_HTML]
+    assert tresult.data == LONG_HTML
+
+
+def test_masked_html_round_trips_after_split(translator, monkeypatch):
+    calls = []
+    monkeypatch.setattr(translator, 'chat_completion', echo(calls))
+    node = translator.parse_fragment(LONG_HTML).p
+    tresult = translator.translate_html(LONG_HTML, node=node, mask=True)
+    assert tresult.result
+    assert len(calls) > 1
+    assert str(tresult.node) == LONG_HTML
+
+
+def test_short_stitched_result_fails(translator, monkeypatch):
+    def chat_completion(system_prompt, content, max_retries=3, label="", max_tokens=None):
+        return TranslationResult(True, 0, content[:5])
+    monkeypatch.setattr(translator, 'chat_completion', chat_completion)
+    tresult = translator.translate_text(SENTENCES)
+    assert not tresult.result
+    assert tresult.errorcode == TranslationResult.INCOMPLETE
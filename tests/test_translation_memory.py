@@ -0,0 +1,32 @@
+from translation_memory import TranslationMemory
+
+
+def test_put_get_and_persist(tmp_path):
+    path = str(tmp_path / "memory.db")
+    memory = TranslationMemory(path)
+    key = TranslationMemory.make_key("m", "system", "v1", "Hello.")
+    # 模型、系统提示、词汇表版本任一不同都是不同的键
+    assert key != TranslationMemory.make_key("m2", "system", "v1", "Hello.")
+    assert key != TranslationMemory.make_key("m", "system", "v2", "Hello.")
+    assert memory.get(key) is None
+    memory.put(key, "你好。")
+    memory.put(key, "您好。")
+    assert memory.get(key) == "您好。"
+    assert (memory.hits, memory.misses) == (1, 1)
+    memory.close()
+
+    memory = TranslationMemory(path)
+    assert memory.get(key) == "您好。"
+    assert memory.total_bytes == len(key) + len("您好。".encode('utf-8'))
+    memory.close()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "memory.db"), max_bytes=1000)
+    keys = [TranslationMemory.make_key("m", "s", "", str(index)) for index in range(10)]
+    for key in keys:
+        memory.put(key, "x" * 100)
+    # 超过容量时淘汰最久未使用的条目，直到降到上限的90%以下
+    assert memory.total_bytes <= 900
+    assert memory.get(keys[0]) is None and memory.get(keys[-1]) == "x" * 100
+    memory.close()
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class TranslationMemory:
+    """基于SQLite的持久化翻译记忆
+
+    以 (模型名, 系统提示, 词汇表版本, 原文片段) 的哈希为键保存译文，
+    同一本书重复翻译或再版时可以直接复用历史译文而不再调用API。
+    数据库总大小超过 max_bytes 时按最近使用时间淘汰旧条目。
+    """
+    # 每写入多少条检查一次是否需要淘汰
+    EVICT_CHECK_EVERY = 200
+
+    def __init__(self, db_path, max_bytes=200 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_check = 0
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory ("
+            " key TEXT PRIMARY KEY,"
+            " translation TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_last_used ON memory(last_used)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM memory").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name, system_prompt, glossary_version, segment):
+        """生成缓存键；系统提示中已包含书籍背景信息"""
+        payload = json.dumps([model_name or "", system_prompt, glossary_version or "", segment], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """查询译文，未命中时返回 None"""
+        with self.lock:
+            row = self.conn.execute("SELECT translation FROM memory WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE memory SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, translation):
+        """保存译文"""
+        size = len(key) + len(translation.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM memory WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO memory (key, translation, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, translation, size, time.time())
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._puts_since_check += 1
+            if self._puts_since_check >= self.EVICT_CHECK_EVERY or self.total_bytes > self.max_bytes:
+                self._puts_since_check = 0
+                self._evict()
+
+    def _evict(self):
+        """超过容量上限时删除最久未使用的条目，直到降到上限的90%"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        while self.total_bytes > target:
+            rows = self.conn.execute("SELECT key, size FROM memory ORDER BY last_used LIMIT 500").fetchall()
+            if not rows:
+                break
+            self.conn.executemany("DELETE FROM memory WHERE key = ?", [(k,) for k, _ in rows])
+            self.total_bytes -= sum(size for _, size in rows)
+            removed += len(rows)
+        print(f"翻译记忆超过容量上限，已淘汰 {removed} 条旧记录")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()